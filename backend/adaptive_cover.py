@@ -0,0 +1,265 @@
+"""
+Green cover of large regions within a tile or time budget.
+
+A zoom z tile covers the ground of four z + 1 tiles, so a first pass at a
+coarse zoom costs a fraction of the tiles of the analysis zoom. Tiles that
+came out all green or all built-up hardly change when looked at closer;
+mixed ones do. Each refinement round replaces the tiles contributing most
+to the estimated error with their four children (deg2num / tile_bounds
+addressing), until that estimate is within tolerance, the budget is spent
+or every tile is at the analysis zoom.
+
+The error estimate is a heuristic, not a guaranteed bound: it assumes
+tiles change on refinement in proportion to how mixed they are, at the
+largest rate seen so far.
+
+Tiles are clipped to the region with the same masks as polygon mode, so the
+estimate measures the region itself, also for a bounding box.
+"""
+import math
+import os
+import time
+
+from shapely.geometry import box
+from shapely.prepared import prep
+
+from tile_utils import compute_tile_counts, region_key, tile_bounds, tiles_for_bbox
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+# Coarsest zoom a region is estimated at
+ADAPTIVE_MIN_ZOOM = int(os.getenv("ADAPTIVE_MIN_ZOOM", 12))
+# Tiles per second assumed when sizing the first pass for a time budget;
+# later rounds use the rate measured so far
+ADAPTIVE_TILE_RATE = float(os.getenv("ADAPTIVE_TILE_RATE", 20))
+# Default error tolerance, in percentage points of green cover
+ADAPTIVE_TOLERANCE = 1.0
+# Share of the budget the first pass may use, the rest goes to refinement
+COARSE_SHARE = 0.25
+# Most tiles fetched per refinement round. Smaller rounds follow the error
+# estimate more closely, larger ones keep more fetches in flight.
+ROUND_TILES = 128
+
+# How far a tile's green ratio moves per zoom level of refinement, as a
+# share of its mixedness 4p(1 - p). Used until enough refinements have
+# been seen to measure it.
+PRIOR_DEVIATION = 0.05
+MIN_DEVIATION_SAMPLES = 8
+# Tiles that look uniform at a coarse zoom can still hide small patches
+MIN_MIXEDNESS = 0.05
+
+
+def tile_budget_for(tile_budget=None, time_budget=None):
+    """
+    Tiles an estimate may fetch: tile_budget when given, else as many as
+    time_budget seconds allow at ADAPTIVE_TILE_RATE.
+    """
+    if tile_budget:
+        return tile_budget
+    if time_budget is None:
+        raise ValueError("adaptive green cover needs a tile or a time budget")
+    return max(1, int(time_budget * ADAPTIVE_TILE_RATE))
+
+
+def plan_first_pass(bounds, max_zoom, tile_budget=None, time_budget=None):
+    """
+    (tile budget, zoom of the first pass) of an estimate over a region's
+    bounds. Raises ValueError if the region is too large for the budget
+    even at ADAPTIVE_MIN_ZOOM.
+    """
+    budget = tile_budget_for(tile_budget, time_budget)
+    zoom = start_zoom(bounds, max_zoom, budget)
+    if zoom is None:
+        tiles = len(tiles_for_bbox(bounds, ADAPTIVE_MIN_ZOOM))
+        raise ValueError(f"region needs {tiles} tiles at zoom {ADAPTIVE_MIN_ZOOM}, "
+                         f"more than the budget of {budget}")
+    return budget, zoom
+
+
+def start_zoom(bounds, max_zoom, tile_budget):
+    """
+    Zoom of the first pass over a region's bounds: max_zoom when the whole
+    region fits the budget, else the finest zoom that fits COARSE_SHARE of
+    it, else the finest that fits it at all. None if even ADAPTIVE_MIN_ZOOM
+    needs more tiles than the budget.
+    """
+    if len(tiles_for_bbox(bounds, max_zoom)) <= tile_budget:
+        return max_zoom
+    fitting = None
+    for zoom in range(max_zoom - 1, ADAPTIVE_MIN_ZOOM - 1, -1):
+        tiles = len(tiles_for_bbox(bounds, zoom))
+        if tiles <= tile_budget * COARSE_SHARE:
+            return zoom
+        if fitting is None and tiles <= tile_budget:
+            fitting = zoom
+    return fitting
+
+
+def _cell_bound(green, total, levels, deviation):
+    """Largest expected change, as a ratio, of a tile's green cover at `levels` zooms finer."""
+    if not levels or not total:
+        return 0.0
+    p = green / total
+    mixedness = max(4 * p * (1 - p), MIN_MIXEDNESS)
+    # The refined ratio can't leave [0, 1] either
+    return min(max(p, 1 - p), deviation * mixedness * levels)
+
+
+def _measure(tiles, zoom, prepared, key, geom, mapbox_token, progress):
+    """
+    Green and total pixels of the region within (x, y) tiles at `zoom`,
+    skipping tiles that don't touch it. Returns ({(z, x, y): (green, total)},
+    {(z, x, y): error}, tiles processed).
+    """
+    interior = []
+    regions = {}
+    for x, y in tiles:
+        tile_box = box(*tile_bounds(x, y, zoom))
+        if prepared.contains(tile_box):
+            interior.append((x, y))
+        elif prepared.intersects(tile_box):
+            regions[(x, y)] = [(key, geom)]
+    if not interior and not regions:
+        return {}, {}, 0
+
+    counts, region_counts, failed = compute_tile_counts(
+        interior, zoom, mapbox_token, regions, progress
+    )
+    measured = {(zoom, *tile): counts[tile] for tile in interior if tile in counts}
+    measured.update(
+        ((zoom, *tile), region_counts[(tile, key)]) for tile in regions if (tile, key) in region_counts
+    )
+    errors = {(zoom, *tile): error for tile, error in failed.items()}
+    return measured, errors, len(interior) + len(regions)
+
+
+def _children(cell):
+    z, x, y = cell
+    return [(z + 1, 2 * x + dx, 2 * y + dy) for dx in (0, 1) for dy in (0, 1)]
+
+
+def adaptive_green_cover(geom, name, max_zoom, mapbox_token, tile_budget=None,
+                         time_budget=None, tolerance=ADAPTIVE_TOLERANCE, progress=None):
+    """
+    Estimate green cover inside a shapely (Multi)Polygon, as analyzed at
+    max_zoom, fetching at most tile_budget tiles and starting no
+    refinement round after time_budget seconds (either may be None, not
+    both). tolerance is the estimated error, in percentage points, at which
+    refinement stops.
+
+    Returns the fields of compute_green_cover, with pixels counted at
+    max_zoom resolution, plus "zoom" (coarsest zoom in the estimate),
+    "max_zoom", "tiles_by_zoom", "error_estimate" and "stopped" (tolerance,
+    tile_budget, time_budget, max_zoom, or failed when no tile could be
+    classified). Raises ValueError if the region is too large for the
+    budget even at ADAPTIVE_MIN_ZOOM.
+    """
+    budget, zoom = plan_first_pass(geom.bounds, max_zoom, tile_budget, time_budget)
+    started = time.monotonic()
+    deadline = started + time_budget if time_budget else None
+
+    prepared = prep(geom)
+    key = region_key(name, geom)
+    fetched = 0
+
+    def report(done, total):
+        # Progress of the whole estimate, against the tiles it may fetch
+        if progress:
+            progress(min(fetched + done, budget), budget)
+
+    cells, failed, fetched = _measure(
+        tiles_for_bbox(geom.bounds, zoom), zoom, prepared, key, geom, mapbox_token, report
+    )
+    deviations = []
+    settled = set()  # cells whose children could not all be classified
+
+    while True:
+        if len(deviations) >= MIN_DEVIATION_SAMPLES:
+            deviation = max(deviations)
+        else:
+            deviation = max([PRIOR_DEVIATION] + deviations)
+        bounds = {
+            cell: _cell_bound(green, total, max_zoom - cell[0], deviation)
+            for cell, (green, total) in cells.items()
+        }
+        weight = {cell: total * 4 ** (max_zoom - cell[0]) for cell, (_, total) in cells.items()}
+        total_weight = sum(weight.values())
+        error = sum(weight[cell] * bounds[cell] for cell in cells) / total_weight \
+            if total_weight else 0.0
+
+        candidates = sorted(
+            (cell for cell in cells if bounds[cell] > 0 and cell not in settled),
+            key=lambda cell: weight[cell] * bounds[cell], reverse=True,
+        )
+        if not cells:
+            stopped = "failed"
+            break
+        if error * 100 <= tolerance:
+            stopped = "tolerance"
+            break
+        if not candidates:
+            stopped = "max_zoom"
+            break
+        room = budget - fetched if tile_budget else math.inf
+        reason = "tile_budget"
+        if deadline is not None:
+            elapsed = time.monotonic() - started
+            remaining = deadline - time.monotonic()
+            timed = int(remaining * fetched / elapsed) if remaining > 0 and elapsed else 0
+            if timed < room:
+                room, reason = timed, "time_budget"
+        batch = candidates[:int(min(room, ROUND_TILES) // 4)]
+        if not batch:
+            stopped = reason
+            break
+
+        by_zoom = {}
+        for cell in batch:
+            by_zoom.setdefault(cell[0] + 1, []).extend((x, y) for _, x, y in _children(cell))
+        measured = {}
+        errors = {}
+        for child_zoom, tiles in by_zoom.items():
+            round_measured, round_errors, processed = _measure(
+                tiles, child_zoom, prepared, key, geom, mapbox_token, report
+            )
+            measured.update(round_measured)
+            errors.update(round_errors)
+            fetched += processed
+
+        for cell in batch:
+            children = _children(cell)
+            if any(child in errors for child in children):
+                # Keep the coarser estimate rather than leave a hole
+                settled.add(cell)
+                continue
+            green, total = cells.pop(cell)
+            refined = [measured[child] for child in children if child in measured]
+            child_total = sum(t for _, t in refined)
+            if total and child_total:
+                p = green / total
+                change = abs(sum(g for g, _ in refined) / child_total - p)
+                deviations.append(change / max(4 * p * (1 - p), MIN_MIXEDNESS))
+            cells.update((child, measured[child]) for child in children if child in measured)
+
+    green_pixels = sum(green * 4 ** (max_zoom - cell[0]) for cell, (green, _) in cells.items())
+    tiles_by_zoom = {}
+    for z, _, _ in cells:
+        tiles_by_zoom[str(z)] = tiles_by_zoom.get(str(z), 0) + 1
+    return {
+        "green_cover": round(green_pixels / total_weight * 100, 2) if total_weight else 0.0,
+        "green_pixels": green_pixels,
+        "total_pixels": total_weight,
+        "tiles_total": fetched,
+        "failed_tiles": [
+            {"x": x, "y": y, "z": z, "error": error}
+            for (z, x, y), error in failed.items() if (z, x, y) not in cells
+        ],
+        "zoom": min((cell[0] for cell in cells), default=zoom),
+        "max_zoom": max((cell[0] for cell in cells), default=zoom),
+        "tiles_by_zoom": dict(sorted(tiles_by_zoom.items())),
+        "error_estimate": round(error * 100, 2),
+        "stopped": stopped,
+        "seconds": round(time.monotonic() - started, 3),
+    }
@@ -1,463 +1,1024 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import os
-import requests
+import gzip
+import hashlib
+import json
+import time
 import geojson
-from shapely.geometry import shape, Polygon, MultiPolygon
-from tile_utils import calculate_green_cover_from_tiles
 from dotenv import load_dotenv
 import concurrent.futures
+from collections import OrderedDict
 from threading import Lock
-import time
 import logging
 
+# Load .env before importing modules that read their settings at import time
+load_dotenv()
+
+from osm_utils import (
+    BOUNDARY_CACHE_VERSION, CHANDIGARH_SECTORS, OVERPASS_URL, clear_boundary_cache,
+    fetch_sector_geojson, load_sector_boundaries, sector_key, seed_boundaries
+)
+from cache_versions import CLASSIFIER_VERSION
+from geo_encoding import build_topology, simplify_tolerance, simplify_zoom, topology_to_geojson
+from jobs import JOB_STORE_PATH, JobManager, JobQueueFull, JobStore
+from metrics import STAGE_SECONDS, render as render_metrics, share_metrics
+from rate_governor import governed_get, governor_stats
+from sector_cache import SECTOR_CACHE_PATH, SectorRefresher, get_sector_cache
+from single_flight import LeaseStore, SingleFlight
+from snapshot import SNAPSHOT_PATH, load_snapshot
+from tile_store import get_rendered_tiles, get_tile_results, get_tile_store
+# numpy, shapely and PIL (tile_utils, green_mosaic, overlay_tiles,
+# vector_tiles) are imported by the functions that compute something, so a
+# worker starting from a snapshot serves it before paying for them
+
 logging.basicConfig(level=logging.DEBUG)
 
-load_dotenv()
 app = Flask(__name__)
 CORS(app)
+# Every worker publishes its metrics, so /metrics can report all of them
+share_metrics()
 
 MAPBOX_TOKEN = os.getenv("MAPBOX_TOKEN")
 PORT = os.getenv("PORT", 8080)
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 ZOOM_LEVEL = 17
+# "bbox" counts every tile of a sector's bounding box; "polygon" only counts
+# pixels inside the sector. Can be overridden per request with ?mode=
+COVER_MODE = os.getenv("COVER_MODE", "bbox")
+COVER_MODES = ("bbox", "polygon")
+# Geometry encodings offered with ?format= (see geo_encoding.py)
+GEOMETRY_FORMATS = ("geojson", "topojson")
+# Compressed geometry responses kept per worker, reused until their sectors change
+ENCODED_CACHE_SIZE = 64
+# Largest region, in tiles, accepted by the job API
+MAX_REGION_TILES = int(os.getenv("MAX_REGION_TILES", 10000))
 
-# Cache for sector data to avoid repeated API calls
-sector_cache = {}
-cache_lock = Lock()
-
-# List of all Chandigarh sectors
-CHANDIGARH_SECTORS = [
-    "Sector 1", "Sector 2", "Sector 3", "Sector 4", "Sector 5", "Sector 6",
-    "Sector 7", "Sector 8", "Sector 9", "Sector 10", "Sector 11", "Sector 12",
-    "Sector 13", "Sector 14", "Sector 15", "Sector 16", "Sector 17", "Sector 18",
-    "Sector 19", "Sector 20", "Sector 21", "Sector 22", "Sector 23", "Sector 24",
-    "Sector 25", "Sector 26", "Sector 27", "Sector 28", "Sector 29", "Sector 30",
-    "Sector 31", "Sector 32", "Sector 33", "Sector 34", "Sector 35", "Sector 36",
-    "Sector 37", "Sector 38", "Sector 39", "Sector 40", "Sector 41", "Sector 42",
-    "Sector 43", "Sector 44", "Sector 45", "Sector 46", "Sector 47", "Sector 48",
-    "Sector 49", "Sector 50", "Sector 51", "Sector 52", "Sector 53", "Sector 54",
-    "Sector 55", "Sector 56"
-]
-
-def fetch_sector_geojson(sector_name):
-    """Fetch GeoJSON data for a specific sector"""
-    # Convert sector name format for Overpass query (space to dot)
-    query_sector_name = sector_name.replace(" ", ".")
-    overpass_url = "https://overpass-api.de/api/interpreter"
-    
-    # Use your working query pattern but with geometry output
-    query = f"""
-    [out:json][timeout:25];
-    area["name"="Chandigarh"]->.searchArea;
-    (
-      relation["boundary"="administrative"]["name"~"{query_sector_name}"](area.searchArea);
-    );
-    (._;>;);
-    out geom;
-    """
-    
-    try:
-        print(f"Querying for {sector_name} (using {query_sector_name})")
-        response = requests.get(overpass_url, params={'data': query}, timeout=30)
-        
-        if response.status_code != 200:
-            print(f"Overpass API error: {response.status_code}")
-            return None
-            
-        data = response.json()
-        elements = data.get("elements", [])
-        print(f"Found {len(elements)} elements for {sector_name}")
-        
-        if not elements:
-            print(f"No elements found for {query_sector_name}")
-            return None
-            
-        # Process the response
-        geojson_result = process_overpass_response(elements, sector_name)
-        return geojson_result
-            
-    except Exception as e:
-        print(f"Error fetching sector data for {sector_name}: {e}")
-        return None
+# Cached sector results are only reused if computed the same way
+SECTOR_CACHE_VERSION = f"{CLASSIFIER_VERSION}:{BOUNDARY_CACHE_VERSION}:{ZOOM_LEVEL}"
 
-def process_overpass_response(elements, sector_name):
-    """Process Overpass API response into GeoJSON"""
-    
-    # Separate elements by type
-    ways = {}
-    nodes = {}
-    relations = []
-    
-    for element in elements:
-        if element["type"] == "node":
-            nodes[element["id"]] = (element["lon"], element["lat"])
-        elif element["type"] == "way":
-            ways[element["id"]] = element
-        elif element["type"] == "relation":
-            relations.append(element)
-    
-    print(f"Found: {len(nodes)} nodes, {len(ways)} ways, {len(relations)} relations")
-    
-    # First try to process relations
-    for relation in relations:
-        polygon = build_polygon_from_relation(relation, ways, nodes)
-        if polygon:
-            return geojson.FeatureCollection([
-                geojson.Feature(
-                    geometry=polygon,
-                    properties={
-                        "name": sector_name,
-                        "source": "relation",
-                        "id": relation["id"]
-                    }
-                )
-            ])
-    
-    # If no relation worked, try individual ways
-    for way_id, way in ways.items():
-        if "geometry" in way:
-            coords = [(p["lon"], p["lat"]) for p in way["geometry"]]
-            if len(coords) >= 4:
-                try:
-                    # Ensure closed polygon
-                    if coords[0] != coords[-1]:
-                        coords.append(coords[0])
-                    
-                    polygon = geojson.Polygon([coords])
-                    return geojson.FeatureCollection([
-                        geojson.Feature(
-                            geometry=polygon,
-                            properties={
-                                "name": sector_name,
-                                "source": "way",
-                                "id": way_id
-                            }
-                        )
-                    ])
-                except Exception as e:
-                    print(f"Error creating polygon from way: {e}")
-                    continue
-    
-    return None
-
-def build_polygon_from_relation(relation, ways, nodes):
-    """Build a polygon from a relation's members"""
-    try:
-        outer_ways = []
-        inner_ways = []
-        
-        # Collect way IDs for outer and inner roles
-        for member in relation.get("members", []):
-            if member["type"] == "way" and member["ref"] in ways:
-                way = ways[member["ref"]]
-                
-                # Get coordinates from way geometry
-                if "geometry" in way:
-                    coords = [(p["lon"], p["lat"]) for p in way["geometry"]]
-                elif "nodes" in way:
-                    # Fallback: build coordinates from node references
-                    coords = []
-                    for node_id in way["nodes"]:
-                        if node_id in nodes:
-                            coords.append(nodes[node_id])
-                else:
-                    continue
-                
-                if len(coords) >= 2:
-                    role = member.get("role", "")
-                    if role == "outer" or role == "":
-                        outer_ways.append(coords)
-                    elif role == "inner":
-                        inner_ways.append(coords)
-        
-        if not outer_ways:
-            return None
-        
-        # Connect outer ways into a single ring
-        outer_ring = connect_ways(outer_ways)
-        if not outer_ring or len(outer_ring) < 4:
-            return None
-        
-        # Ensure closed ring
-        if outer_ring[0] != outer_ring[-1]:
-            outer_ring.append(outer_ring[0])
-        
-        # Process inner rings
-        inner_rings = []
-        for inner_way_coords in inner_ways:
-            inner_ring = connect_ways([inner_way_coords])
-            if inner_ring and len(inner_ring) >= 4:
-                if inner_ring[0] != inner_ring[-1]:
-                    inner_ring.append(inner_ring[0])
-                inner_rings.append(inner_ring)
-        
-        # Create GeoJSON polygon
-        if inner_rings:
-            return geojson.Polygon([outer_ring] + inner_rings)
-        else:
-            return geojson.Polygon([outer_ring])
-            
-    except Exception as e:
-        print(f"Error building polygon from relation: {e}")
-        return None
+def merge_sector_polygons(geojson_data, sector_name):
+    """Merge a sector's valid polygons into one shapely geometry, or None"""
+    from shapely.geometry import MultiPolygon, Polygon, shape
+    from shapely.ops import unary_union
 
-def connect_ways(way_list):
-    """Connect multiple ways into a single coordinate list"""
-    if len(way_list) == 1:
-        return way_list[0]
-    
-    if not way_list:
-        return []
-    
-    # Start with the first way
-    result = way_list[0][:]
-    remaining = way_list[1:]
+    polygons = []
+    for feature in geojson_data["features"]:
+        try:
+            geom = shape(feature["geometry"])
+            if isinstance(geom, (Polygon, MultiPolygon)) and geom.is_valid:
+                polygons.append(geom)
+        except Exception as e:
+            print(f"Error processing geometry for {sector_name}: {e}")
+            continue
     
-    while remaining:
-        connected = False
-        last_point = result[-1]
-        first_point = result[0]
-        
-        for i, way_coords in enumerate(remaining):
-            way_start = way_coords[0]
-            way_end = way_coords[-1]
-            
-            # Try to connect to the end of current result
-            if last_point == way_start:
-                result.extend(way_coords[1:])
-                remaining.pop(i)
-                connected = True
-                break
-            elif last_point == way_end:
-                result.extend(reversed(way_coords[:-1]))
-                remaining.pop(i)
-                connected = True
-                break
-            # Try to connect to the beginning of current result
-            elif first_point == way_end:
-                result = way_coords[:-1] + result
-                remaining.pop(i)
-                connected = True
-                break
-            elif first_point == way_start:
-                result = list(reversed(way_coords[1:])) + result
-                remaining.pop(i)
-                connected = True
-                break
-        
-        if not connected:
-            # Can't connect remaining ways - return what we have
-            break
+    if not polygons:
+        return None
     
-    return result
+    if len(polygons) == 1:
+        return polygons[0]
+    return unary_union(polygons)
+
+def request_cover_mode():
+    """The cover mode requested with ?mode=, falling back to COVER_MODE"""
+    mode = request.args.get("mode", COVER_MODE)
+    return mode if mode in COVER_MODES else COVER_MODE
+
+def compute_sector_cover(sector_name, merged, mode, progress=None):
+    """Green cover of a sector's bounding box or, in polygon mode, of the sector itself"""
+    from tile_utils import compute_geometry_green_cover, compute_green_cover
+
+    if mode == "polygon":
+        return compute_geometry_green_cover(merged, sector_name, ZOOM_LEVEL, MAPBOX_TOKEN, progress)
+    return compute_green_cover(merged.bounds, ZOOM_LEVEL, MAPBOX_TOKEN, progress)
 
-def calculate_sector_green_cover(sector_name):
+def sector_result(sector_name, geojson_data, bbox, cover, mode):
+    """Shape a green cover computation into the per-sector result dict"""
+    return {
+        "sector": sector_name,
+        "green_cover": round(cover["green_cover"], 2),
+        "geojson": geojson_data,
+        "bbox": bbox,
+        "mode": mode,
+        "tiles_total": cover["tiles_total"],
+        "failed_tiles": cover["failed_tiles"]
+    }
+
+def calculate_sector_green_cover(sector_name, mode=COVER_MODE, progress=None):
     """Calculate green cover for a single sector"""
+    with STAGE_SECONDS.time(stage="sector"):
+        return _calculate_sector_green_cover(sector_name, mode, progress)
+
+def _calculate_sector_green_cover(sector_name, mode, progress):
     try:
         geojson_data = fetch_sector_geojson(sector_name)
         if not geojson_data:
             return None
         
-        polygons = []
-        for feature in geojson_data["features"]:
-            try:
-                geom = shape(feature["geometry"])
-                if isinstance(geom, (Polygon, MultiPolygon)) and geom.is_valid:
-                    polygons.append(geom)
-            except Exception as e:
-                print(f"Error processing geometry for {sector_name}: {e}")
-                continue
-        
-        if not polygons:
+        merged = merge_sector_polygons(geojson_data, sector_name)
+        if merged is None:
             return None
         
-        # Merge polygons and get bounding box
-        if len(polygons) == 1:
-            merged = polygons[0]
-        else:
-            merged = MultiPolygon(polygons)
-        
         bbox = merged.bounds  # (minx, miny, maxx, maxy)
         
-        green_percent = calculate_green_cover_from_tiles(bbox, ZOOM_LEVEL, MAPBOX_TOKEN)
-        
-        return {
-            "sector": sector_name,
-            "green_cover": round(green_percent, 2),
-            "geojson": geojson_data,
-            "bbox": bbox
-        }
+        cover = compute_sector_cover(sector_name, merged, mode, progress)
+        return sector_result(sector_name, geojson_data, bbox, cover, mode)
         
     except Exception as e:
         print(f"Error calculating green cover for {sector_name}: {e}")
         return None
 
+def sector_tile_layout(sector_names, mode):
+    """
+    Work out the tiles each sector needs. Returns (sectors, unique_tiles,
+    regions, failed_sectors), sectors holding (name, geojson, bbox, tiles,
+    edge tiles, region key) and regions the edge tiles of every sector in
+    polygon mode, as compute_tile_counts takes them.
+    """
+    from tile_utils import region_key, tiles_for_bbox, tiles_for_geometry
+
+    # One bulk Overpass query (or the on-disk boundary cache) covers every sector
+    load_sector_boundaries()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        boundaries = dict(zip(sector_names, executor.map(fetch_sector_geojson, sector_names)))
+    
+    failed_sectors = []
+    sectors = []
+    unique_tiles = set()
+    regions = {}
+    for sector_name in sector_names:
+        geojson_data = boundaries[sector_name]
+        merged = merge_sector_polygons(geojson_data, sector_name) if geojson_data else None
+        if merged is None:
+            failed_sectors.append(sector_name)
+            print(f"✗ {sector_name}: No boundary")
+            continue
+        if mode == "polygon":
+            tiles, edge = tiles_for_geometry(merged, ZOOM_LEVEL)
+            key = region_key(sector_name, merged)
+            for tile in edge:
+                regions.setdefault(tile, []).append((key, merged))
+        else:
+            tiles, edge, key = tiles_for_bbox(merged.bounds, ZOOM_LEVEL), [], None
+        unique_tiles.update(tiles)
+        sectors.append((sector_name, geojson_data, merged.bounds, tiles, edge, key))
+    return sectors, unique_tiles, regions, failed_sectors
+
+def calculate_all_sectors_green_cover(sector_names, mode=COVER_MODE, progress=None):
+    """
+    Calculate green cover for many sectors at once. Neighbouring sectors
+    share edge tiles, so the union of all their tiles is analyzed once and
+    each sector's total is aggregated from the per-tile counts.
+    Returns (results, failed_sectors).
+    """
+    with STAGE_SECONDS.time(stage="sectors"):
+        return _calculate_all_sectors_green_cover(sector_names, mode, progress)
+
+def _calculate_all_sectors_green_cover(sector_names, mode, progress):
+    from tile_utils import compute_tile_counts, summarize_tile_counts
+
+    sectors, unique_tiles, regions, failed_sectors = sector_tile_layout(sector_names, mode)
+    
+    print(f"Analyzing {len(unique_tiles | set(regions))} unique tiles for {len(sectors)} sectors "
+          f"({sum(len(s[3]) + len(s[4]) for s in sectors)} before deduplication)")
+    counts, region_counts, failed = compute_tile_counts(
+        unique_tiles, ZOOM_LEVEL, MAPBOX_TOKEN, regions, progress
+    )
+    
+    results = []
+    for sector_name, geojson_data, bbox, tiles, edge, key in sectors:
+        cover = summarize_tile_counts(tiles, ZOOM_LEVEL, counts, failed, edge, key, region_counts)
+        if not cover["total_pixels"]:
+            failed_sectors.append(sector_name)
+            print(f"✗ {sector_name}: No tiles available")
+            continue
+        results.append(sector_result(sector_name, geojson_data, bbox, cover, mode))
+        print(f"✓ {sector_name}: {results[-1]['green_cover']}%")
+    
+    return results, failed_sectors
+
+def compute_sectors(mode, sector_names, progress=None):
+    """Compute sectors for the sector cache: {sector: result, or None if it failed}"""
+    if len(sector_names) == 1:
+        return {sector_names[0]: calculate_sector_green_cover(sector_names[0], mode, progress)}
+    results, failed_sectors = calculate_all_sectors_green_cover(sector_names, mode, progress)
+    computed = dict.fromkeys(failed_sectors)
+    computed.update((result["sector"], result) for result in results)
+    return computed
+
+sector_cache = get_sector_cache()
+sector_refresher = SectorRefresher(sector_cache, compute_sectors, SECTOR_CACHE_VERSION)
+# Leases live next to the sector cache so every worker sees them
+sector_flights = SingleFlight(LeaseStore(SECTOR_CACHE_PATH))
+
+def cached_sector_results(sector_names, mode):
+    """
+    Look sectors up in the sector cache. Returns ({sector: result or None},
+    missing sectors). Stale results are returned as well and handed to the
+    background refresher, so only sectors never computed before are missing.
+    """
+    sector_refresher.start()
+    entries = sector_cache.get_many(mode, sector_names, SECTOR_CACHE_VERSION)
+    if any(not entry.fresh for entry in entries.values()):
+        sector_refresher.wake()
+    missing = [sector for sector in sector_names if sector not in entries]
+    return {sector: entry.result for sector, entry in entries.items()}, missing
+
+def compute_missing_sectors(mode, missing, progress=None):
+    """
+    Compute sectors missing from the sector cache and store them. Concurrent
+    requests for the same sectors, in this worker or in another one, share
+    a single computation. Returns {sector: result or None}.
+    """
+    def compute():
+        computed = compute_sectors(mode, missing, progress)
+        sector_cache.put_many(mode, computed, SECTOR_CACHE_VERSION)
+        return computed
+    
+    def lookup():
+        entries = sector_cache.get_many(mode, missing, SECTOR_CACHE_VERSION, record=False)
+        if len(entries) < len(missing):
+            return None
+        return {sector: entry.result for sector, entry in entries.items()}
+    
+    return sector_flights.do(f"sectors:{mode}:{','.join(missing)}", compute, lookup)
+
+def sectors_stamp(sector_names, mode):
+    """
+    Identify the current cached state of sectors without loading them, or
+    None if some are not cached yet. Stale sectors are handed to the refresher.
+    """
+    cached, stale, newest = sector_cache.touch(mode, sector_names, SECTOR_CACHE_VERSION)
+    if stale:
+        sector_refresher.wake()
+    return (cached, newest) if cached == len(sector_names) else None
+
+def get_sector_result(sector_name, mode, progress=None):
+    """A sector's result from the sector cache, computed on a miss. None if it failed."""
+    key = sector_key(sector_name)
+    if key is None:
+        # Not a sector name, don't let arbitrary names fill the cache
+        return calculate_sector_green_cover(sector_name, mode, progress)
+    
+    cached, missing = cached_sector_results([key], mode)
+    if missing:
+        cached = compute_missing_sectors(mode, missing, progress)
+    return cached[key]
+
+def all_sectors_data(mode, job=None):
+    """The /api/all-sectors response, computing the sectors missing from the cache"""
+    cached, missing = cached_sector_results(CHANDIGARH_SECTORS, mode)
+    if job:
+        job.report(sectors_done=len(cached), sectors_total=len(CHANDIGARH_SECTORS), force=True)
+    if missing:
+        print(f"Computing {len(missing)} sectors missing from the cache")
+        cached.update(compute_missing_sectors(mode, missing, job.tiles if job else None))
+    if job:
+        job.report(sectors_done=len(CHANDIGARH_SECTORS), force=True)
+    
+    results = [cached[sector] for sector in CHANDIGARH_SECTORS if cached[sector]]
+    failed_sectors = [sector for sector in CHANDIGARH_SECTORS if not cached[sector]]
+    return build_all_sectors_response(results, failed_sectors, mode)
+
 @app.route("/api/all-sectors")
 def get_all_sectors():
-    """Get all sectors with their green cover data"""
+    """
+    Get all sectors with their green cover data. Geometry is raw GeoJSON by
+    default; see encode_geometry for ?format= and ?zoom=
+    """
     print("Starting to fetch all sectors data...")
     
-    # Check cache first
-    with cache_lock:
-        if sector_cache:
-            print("Returning cached data")
-            return jsonify(sector_cache)
+    mode = request_cover_mode()
+    geometry_format, zoom = request_geometry_encoding()
     
-    results = []
-    failed_sectors = []
+    def build():
+        response_data = all_sectors_data(mode)
+        print(f"Completed: {response_data['total_sectors']} sectors processed successfully")
+        return encode_geometry(response_data, geometry_format, zoom)
     
-    # Process sectors in batches to avoid overwhelming the Overpass API
-    batch_size = 5
-    for i in range(0, len(CHANDIGARH_SECTORS), batch_size):
-        batch = CHANDIGARH_SECTORS[i:i+batch_size]
-        print(f"Processing batch {i//batch_size + 1}: {batch}")
-        
-        # Use threading for parallel processing within each batch
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-            future_to_sector = {
-                executor.submit(calculate_sector_green_cover, sector): sector 
-                for sector in batch
-            }
-            
-            for future in concurrent.futures.as_completed(future_to_sector):
-                sector = future_to_sector[future]
-                try:
-                    result = future.result()
-                    if result:
-                        results.append(result)
-                        print(f"✓ {sector}: {result['green_cover']}%")
-                    else:
-                        failed_sectors.append(sector)
-                        print(f"✗ {sector}: Failed")
-                except Exception as e:
-                    failed_sectors.append(sector)
-                    print(f"✗ {sector}: Exception - {e}")
-        
-        # Add a small delay between batches to be respectful to the API
-        if i + batch_size < len(CHANDIGARH_SECTORS):
-            time.sleep(2)
+    return encoded_json_response(
+        ("all-sectors", mode, geometry_format, zoom),
+        sectors_stamp(CHANDIGARH_SECTORS, mode),
+        build
+    )
+
+# -------------------------------
+# Compact, cached geometry responses
+# -------------------------------
+
+encoded_cache = OrderedDict()
+encoded_lock = Lock()
+
+def request_geometry_encoding():
+    """The (?format=, simplification zoom) of a request"""
+    geometry_format = request.args.get("format", "geojson")
+    if geometry_format not in GEOMETRY_FORMATS:
+        geometry_format = "geojson"
+    zoom = request.args.get("zoom", type=int)
+    return geometry_format, simplify_zoom(zoom)
+
+def encode_geometry(data, geometry_format, zoom):
+    """
+    Replace a response's "geojson" with the requested encoding: "topojson"
+    stores borders shared by neighbouring sectors once, quantized and
+    delta-encoded; both formats are simplified for the map zoom when given.
+    """
+    if geometry_format == "geojson" and zoom is None:
+        return data
+    data = dict(data)
+    collection = data.pop("geojson")
+    topology = build_topology(collection["features"], simplify_tolerance(zoom))
+    if geometry_format == "topojson":
+        data["topojson"] = topology
+    else:
+        data["geojson"] = topology_to_geojson(topology)
+    data["simplified_for_zoom"] = zoom
+    return data
+
+def encoded_json_response(key, stamp, build):
+    """
+    Serve build()'s JSON gzipped and with an ETag. The compressed body is
+    reused while the sectors it came from are unchanged (same stamp), and
+    If-None-Match is answered with 304. Returns None if build() does.
+    """
+    with encoded_lock:
+        entry = encoded_cache.get(key)
+        if entry is not None:
+            encoded_cache.move_to_end(key)
+    
+    if entry is None or stamp is None or entry[0] != stamp:
+        data = build()
+        if data is None:
+            return None
+        entry = (stamp, *encode_json_body(data))
+        # Without a stamp the data was only just computed; cache it next time
+        if stamp is not None:
+            with encoded_lock:
+                encoded_cache[key] = entry
+                while len(encoded_cache) > ENCODED_CACHE_SIZE:
+                    encoded_cache.popitem(last=False)
     
-    # Create combined GeoJSON
+    _, etag, compressed = entry
+    return compressed_response(compressed, etag, "application/json")
+
+def encode_json_body(data):
+    """(etag, gzipped body) of a JSON response, as encoded_json_response serves it"""
+    body = json.dumps(data, separators=(",", ":")).encode()
+    return hashlib.sha1(body).hexdigest(), gzip.compress(body, mtime=0)
+
+def compressed_response(compressed, etag, mimetype):
+    """Serve a gzipped body as-is to clients that accept gzip, answering If-None-Match"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif request.accept_encodings["gzip"]:
+        response = Response(compressed, mimetype=mimetype)
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(gzip.decompress(compressed), mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# -------------------------------
+# Starting from a snapshot
+# -------------------------------
+
+def restore_snapshot(path=SNAPSHOT_PATH):
+    """
+    Seed the boundary cache, the sector cache and the /api/all-sectors
+    responses from a snapshot written by `python snapshot.py export`.
+    Sectors past SECTOR_CACHE_TTL are served as they are while the
+    refresher recomputes them. Caches that are already filled win.
+    """
+    snapshot = load_snapshot(SECTOR_CACHE_VERSION, path)
+    if snapshot is None:
+        return
+    seed_boundaries(snapshot.boundaries())
+    for mode in snapshot.modes:
+        stamp, etag, compressed = snapshot.response(mode)
+        cached, _ = sector_cache.last_modified(mode, SECTOR_CACHE_VERSION)
+        if cached < stamp[0]:
+            sector_cache.seed_many(mode, snapshot.sectors(mode), SECTOR_CACHE_VERSION)
+        # Served as long as the sector cache still holds exactly these results
+        with encoded_lock:
+            encoded_cache[("all-sectors", mode, "geojson", None)] = (stamp, etag, compressed)
+    print(f"Restored {', '.join(snapshot.modes)} from {path}, "
+          f"exported {(time.time() - snapshot.created_at) / 3600:.1f}h ago")
+
+restore_snapshot()
+
+def sector_features(result):
+    """A sector result's features, annotated with its green cover"""
+    features = []
+    for feature in result["geojson"]["features"]:
+        feature["properties"]["green_cover"] = result["green_cover"]
+        features.append(feature)
+    return features
+
+def sector_stat(result):
+    """Summary statistics of a sector result"""
+    return {
+        "sector": result["sector"],
+        "green_cover": result["green_cover"],
+        "tiles_total": result["tiles_total"],
+        "tiles_failed": len(result["failed_tiles"])
+    }
+
+def build_all_sectors_response(results, failed_sectors, mode):
+    """Assemble the combined /api/all-sectors response"""
     all_features = []
     sector_stats = []
     
     for result in results:
-        # Add green_cover to each feature's properties
-        for feature in result["geojson"]["features"]:
-            feature["properties"]["green_cover"] = result["green_cover"]
-            all_features.append(feature)
-        
-        sector_stats.append({
-            "sector": result["sector"],
-            "green_cover": result["green_cover"]
-        })
+        all_features.extend(sector_features(result))
+        sector_stats.append(sector_stat(result))
     
-    combined_geojson = geojson.FeatureCollection(all_features)
-    
-    response_data = {
-        "geojson": combined_geojson,
+    return {
+        "geojson": geojson.FeatureCollection(all_features),
         "sector_stats": sector_stats,
         "total_sectors": len(results),
         "failed_sectors": failed_sectors,
-        "success_rate": f"{len(results)}/{len(CHANDIGARH_SECTORS)}"
+        "success_rate": f"{len(results)}/{len(CHANDIGARH_SECTORS)}",
+        "mode": mode
     }
+
+def stream_sector_records(mode):
+    """
+    Yield one record per sector, cached sectors first and the rest as soon
+    as each is computed, then a summary record. Computed sectors are added
+    to the sector cache.
+    """
+    cached, missing = cached_sector_results(CHANDIGARH_SECTORS, mode)
+    results = []
+    failed_sectors = []
+    for sector in CHANDIGARH_SECTORS:
+        if sector in missing:
+            continue
+        result = cached[sector]
+        if not result:
+            failed_sectors.append(sector)
+            continue
+        results.append(result)
+        yield {"type": "sector", "features": sector_features(result), "stats": sector_stat(result)}
     
-    # Cache the results
-    with cache_lock:
-        sector_cache.update(response_data)
+    if missing:
+        load_sector_boundaries()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+    try:
+        future_to_sector = {
+            executor.submit(compute_missing_sectors, mode, [sector]): sector
+            for sector in missing
+        }
+        for future in concurrent.futures.as_completed(future_to_sector):
+            sector = future_to_sector[future]
+            try:
+                result = future.result()[sector]
+            except Exception as e:
+                print(f"✗ {sector}: Exception - {e}")
+                result = None
+            if not result:
+                failed_sectors.append(sector)
+                continue
+            results.append(result)
+            yield {"type": "sector", "features": sector_features(result), "stats": sector_stat(result)}
+    finally:
+        # Stop queued sectors if the client went away
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    order = {sector: i for i, sector in enumerate(CHANDIGARH_SECTORS)}
+    failed_sectors.sort(key=order.get)
+    response_data = build_all_sectors_response(results, failed_sectors, mode)
+    
+    yield {
+        "type": "summary",
+        **{key: response_data[key] for key in ("total_sectors", "failed_sectors", "success_rate", "mode")}
+    }
+
+@app.route("/api/all-sectors/stream")
+def stream_all_sectors():
+    """
+    Stream all sectors as newline-delimited JSON, or as Server-Sent Events
+    with ?format=sse (or Accept: text/event-stream)
+    """
+    mode = request_cover_mode()
+    sse = (request.args.get("format") == "sse"
+           or "text/event-stream" in request.headers.get("Accept", ""))
+    
+    def generate():
+        for record in stream_sector_records(mode):
+            if sse:
+                yield f"event: {record['type']}\ndata: {json.dumps(record)}\n\n"
+            else:
+                yield json.dumps(record) + "\n"
     
-    print(f"Completed: {len(results)} sectors processed successfully")
-    return jsonify(response_data)
+    mimetype = "text/event-stream" if sse else "application/x-ndjson"
+    # Ask reverse proxies not to buffer, otherwise nothing arrives until the end
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
 
 @app.route("/api/green-cover/<sector_name>")
 def green_cover(sector_name):
     sector_name = sector_name.replace("_", " ")
     print(f"Calculating green cover for: {sector_name}")
     
-    geojson_data = fetch_sector_geojson(sector_name)
-    if not geojson_data:
-        return jsonify({"error": f"Sector '{sector_name}' not found"}), 404
-    
-    polygons = []
-    for feature in geojson_data["features"]:
-        try:
-            geom = shape(feature["geometry"])
-            if isinstance(geom, (Polygon, MultiPolygon)) and geom.is_valid:
-                polygons.append(geom)
-                print(f"Valid polygon: area={geom.area:.6f}, bounds={geom.bounds}")
-            else:
-                print(f"Invalid geometry: {type(geom)}, valid={getattr(geom, 'is_valid', 'N/A')}")
-        except Exception as e:
-            print(f"Error processing geometry: {e}")
-            continue
-    
-    if not polygons:
-        return jsonify({"error": "No valid polygon found"}), 400
-    
-    # Merge polygons and get bounding box
-    if len(polygons) == 1:
-        merged = polygons[0]
-    else:
-        merged = MultiPolygon(polygons)
-    
-    bbox = merged.bounds  # (minx, miny, maxx, maxy)
-    print(f"Bounding box: {bbox}")
+    result = get_sector_result(sector_name, request_cover_mode())
+    if not result:
+        return jsonify({"error": f"No green cover available for sector '{sector_name}'"}), 404
     
+    return jsonify({
+        key: result[key]
+        for key in ("sector", "green_cover", "bbox", "mode", "tiles_total", "failed_tiles")
+    })
+
+@app.route("/api/green-cover/<sector_name>/history")
+def green_cover_history_for_sector(sector_name):
+    """
+    How a sector's green cover changed over time, replayed from the
+    per-tile counts recorded whenever a tile's imagery changed. ?since=
+    takes a Unix timestamp.
+    """
+    from tile_utils import green_cover_history
+
+    key = sector_key(sector_name.replace("_", " "))
+    if key not in CHANDIGARH_SECTORS:
+        return jsonify({"error": f"Unknown sector '{sector_name}'"}), 404
     try:
-        green_percent = calculate_green_cover_from_tiles(bbox, ZOOM_LEVEL, MAPBOX_TOKEN)
-    except Exception as e:
-        print(f"Error calculating green cover: {e}")
-        return jsonify({"error": "Failed to calculate green cover"}), 500
+        since = float(request.args.get("since", 0))
+    except ValueError:
+        return jsonify({"error": "since must be a Unix timestamp"}), 400
     
+    mode = request_cover_mode()
+    sectors, _, _, _ = sector_tile_layout([key], mode)
+    if not sectors:
+        return jsonify({"error": f"No boundary available for sector '{key}'"}), 404
+    _, _, _, tiles, edge, region = sectors[0]
     return jsonify({
-        "sector": sector_name,
-        "green_cover": round(green_percent, 2),
-        "bbox": bbox
+        "sector": key,
+        "mode": mode,
+        "history": green_cover_history(tiles, ZOOM_LEVEL, edge, region, since),
     })
 
 @app.route("/api/sector-data/<sector_name>")
 def get_sector_data(sector_name):
     sector_name = sector_name.replace("_", " ")
+    mode = request_cover_mode()
+    geometry_format, zoom = request_geometry_encoding()
+    key = sector_key(sector_name)
 
-    geojson_data = fetch_sector_geojson(sector_name)
-    if not geojson_data:
-        return jsonify({"error": f"Sector '{sector_name}' not found"}), 404
+    def build():
+        result = get_sector_result(sector_name, mode)
+        if not result:
+            return None
+        # Attach green cover info to response
+        return encode_geometry({
+            field: result[field]
+            for field in ("sector", "green_cover", "geojson", "mode", "tiles_total", "failed_tiles")
+        }, geometry_format, zoom)
 
-    # Calculate green cover using your existing function
-    polygons = []
-    for feature in geojson_data["features"]:
-        geom = shape(feature["geometry"])
-        if isinstance(geom, (Polygon, MultiPolygon)) and geom.is_valid:
-            polygons.append(geom)
+    response = encoded_json_response(
+        ("sector-data", key or sector_name, mode, geometry_format, zoom),
+        sectors_stamp([key], mode) if key else None,
+        build
+    )
+    if response is None:
+        return jsonify({"error": f"No green cover available for sector '{sector_name}'"}), 404
+    return response
 
-    if not polygons:
-        return jsonify({"error": "No valid polygon found"}), 400
+@app.route("/api/green-cover/thresholds", methods=["POST"])
+def green_cover_for_thresholds():
+    """
+    Green cover for custom classification thresholds, computed from the
+    colour histograms stored per tile instead of from imagery. The body
+    holds "thresholds" ({hue_min, hue_max, sat_min, sat_max, val_min,
+    val_max}, defaults as the classifier's), optionally "sectors" (all
+    sectors by default) and "mode".
+    """
+    from tile_utils import (
+        DEFAULT_THRESHOLDS, compute_tile_histograms, summarize_tile_histograms, threshold_selector
+    )
+
+    body = request.get_json(silent=True) or {}
+    mode = body.get("mode", COVER_MODE)
+    if mode not in COVER_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(COVER_MODES)}"}), 400
+    try:
+        thresholds = {**DEFAULT_THRESHOLDS, **body.get("thresholds", {})}
+        selector = threshold_selector(thresholds)
+        requested = body.get("sectors") or CHANDIGARH_SECTORS
+        sector_names = [sector_key(str(name).replace("_", " ")) for name in requested]
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    unknown = [name for name in sector_names if name not in CHANDIGARH_SECTORS]
+    if unknown:
+        return jsonify({"error": f"Unknown sectors: {', '.join(map(str, unknown))}"}), 404
+    
+    sectors, unique_tiles, regions, failed_sectors = sector_tile_layout(sector_names, mode)
+    histograms, failed = compute_tile_histograms(unique_tiles, ZOOM_LEVEL, MAPBOX_TOKEN, regions)
+    
+    sector_stats = []
+    all_tiles, all_edge = set(), []
+    for sector_name, _, bbox, tiles, edge, key in sectors:
+        cover = summarize_tile_histograms(tiles, ZOOM_LEVEL, histograms, failed, selector, edge, key)
+        sector_stats.append({"sector": sector_name, "bbox": bbox, **cover})
+        all_tiles.update(tiles)
+        all_edge.extend((tile, key) for tile in edge)
+    
+    # Sector bounding boxes overlap, so city-wide totals count each tile once
+    city = summarize_tile_histograms(all_tiles, ZOOM_LEVEL, histograms, failed, selector)
+    for tile, key in all_edge:
+        if (tile, key) in histograms:
+            region = histograms[(tile, key)]
+            city["green_pixels"] += int(region[selector].sum())
+            city["total_pixels"] += int(region.sum())
+    city["green_cover"] = round(city["green_pixels"] / city["total_pixels"] * 100, 2) \
+        if city["total_pixels"] else 0.0
+    city["tiles_total"] += len(all_edge)
+    
+    return jsonify({
+        "thresholds": {key: float(value) for key, value in thresholds.items()},
+        "mode": mode,
+        "sectors": sector_stats,
+        "failed_sectors": failed_sectors,
+        "city": city,
+    })
+
+# -------------------------------
+# Background jobs
+# -------------------------------
+
+job_store = JobStore(JOB_STORE_PATH)
+job_manager = JobManager(job_store)
+
+def run_all_sectors_job(params, job):
+    return all_sectors_data(params["mode"], job)
+
+def run_sector_job(params, job):
+    job.report(sectors_done=0, sectors_total=1, force=True)
+    result = get_sector_result(params["sector"], params["mode"], job.tiles)
+    if not result:
+        raise ValueError(f"No green cover available for sector '{params['sector']}'")
+    job.report(sectors_done=1, force=True)
+    return result
+
+def mosaic_region_cover(geom, mode):
+    """Green cover of a region from the city mosaic, or None if it doesn't cover it"""
+    from green_mosaic import get_green_mosaic
+
+    mosaic = get_green_mosaic(ZOOM_LEVEL)
+    if mosaic is None:
+        return None
+    if mode == "polygon":
+        return mosaic.geometry_cover(geom)
+    return mosaic.bbox_cover(geom.bounds)
+
+def run_region_job(params, job):
+    from shapely.geometry import shape
+    from tile_utils import compute_geometry_green_cover, compute_green_cover
+
+    geom = shape(params["geometry"])
+    cover = mosaic_region_cover(geom, params["mode"])
+    if cover is not None:
+        return {"bbox": geom.bounds, "mode": params["mode"], "source": "mosaic", **cover}
+    if "budget" in params:
+        return adaptive_region_cover(geom, params, job.tiles)
+    if params["mode"] == "polygon":
+        cover = compute_geometry_green_cover(geom, params.get("name", "region"), ZOOM_LEVEL,
+                                             MAPBOX_TOKEN, job.tiles)
+    else:
+        cover = compute_green_cover(geom.bounds, ZOOM_LEVEL, MAPBOX_TOKEN, job.tiles)
+    return {"bbox": geom.bounds, "mode": params["mode"], "source": "tiles", **cover}
 
-    merged = MultiPolygon(polygons) if len(polygons) > 1 else polygons[0]
-    bbox = merged.bounds  
+def adaptive_region_cover(geom, params, progress=None):
+    """Green cover of a region estimated within the request's tile or time budget"""
+    from adaptive_cover import adaptive_green_cover
+    from shapely.geometry import box
 
-    green_cover = calculate_green_cover_from_tiles(bbox, ZOOM_LEVEL, MAPBOX_TOKEN)
+    if params["mode"] != "polygon":
+        geom = box(*geom.bounds)
+    budget = params["budget"]
+    cover = adaptive_green_cover(
+        geom, params.get("name", "region"), ZOOM_LEVEL, MAPBOX_TOKEN, budget.get("tiles"),
+        budget.get("seconds"), budget["tolerance"], progress
+    )
+    return {"bbox": geom.bounds, "mode": params["mode"], "source": "adaptive", **cover}
 
-    # Attach green cover info to response
+def parse_region_budget(body):
+    """
+    The optional "tile_budget", "time_budget" (seconds) and "tolerance"
+    (percentage points) of a region request, or None to compute it in full
+    at ZOOM_LEVEL.
+    """
+    from adaptive_cover import ADAPTIVE_TOLERANCE
+
+    if body.get("tile_budget") is None and body.get("time_budget") is None:
+        return None
+    budget = {"tolerance": float(body.get("tolerance", ADAPTIVE_TOLERANCE))}
+    if body.get("tile_budget") is not None:
+        budget["tiles"] = int(body["tile_budget"])
+        if not 0 < budget["tiles"] <= MAX_REGION_TILES:
+            raise ValueError(f"tile_budget must be between 1 and {MAX_REGION_TILES}")
+    if body.get("time_budget") is not None:
+        budget["seconds"] = float(body["time_budget"])
+        if budget["seconds"] <= 0:
+            raise ValueError("time_budget must be positive")
+    if budget["tolerance"] < 0:
+        raise ValueError("tolerance must not be negative")
+    return budget
+
+JOB_TYPES = {
+    "all-sectors": run_all_sectors_job,
+    "sector": run_sector_job,
+    "region": run_region_job,
+}
+
+def parse_job_request(body):
+    """Validate a job submission. Returns (job type, params) or raises ValueError."""
+    from adaptive_cover import plan_first_pass
+    from shapely.geometry import MultiPolygon, Polygon, shape
+    from tile_utils import tiles_for_bbox
+
+    job_type = body.get("type")
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"type must be one of {', '.join(JOB_TYPES)}")
+    mode = body.get("mode", COVER_MODE)
+    if mode not in COVER_MODES:
+        raise ValueError(f"mode must be one of {', '.join(COVER_MODES)}")
+    params = {"mode": mode}
+    
+    if job_type == "sector":
+        if not body.get("sector"):
+            raise ValueError("sector is required")
+        params["sector"] = str(body["sector"]).replace("_", " ")
+    elif job_type == "region":
+        if body.get("bbox"):
+            min_lon, min_lat, max_lon, max_lat = map(float, body["bbox"])
+            geom = Polygon([(min_lon, min_lat), (max_lon, min_lat), (max_lon, max_lat),
+                            (min_lon, max_lat)])
+        elif body.get("geometry"):
+            geom = shape(body["geometry"])
+        else:
+            raise ValueError("region jobs need a geometry or a bbox")
+        if not isinstance(geom, (Polygon, MultiPolygon)) or not geom.is_valid or geom.is_empty:
+            raise ValueError("region must be a valid Polygon or MultiPolygon")
+        budget = parse_region_budget(body)
+        if budget is not None:
+            # Large regions are estimated at a coarser zoom instead of refused,
+            # as long as the estimate's first pass fits its budget
+            plan_first_pass(geom.bounds, ZOOM_LEVEL, budget.get("tiles"), budget.get("seconds"))
+            params["budget"] = budget
+        else:
+            tiles = len(tiles_for_bbox(geom.bounds, ZOOM_LEVEL))
+            if tiles > MAX_REGION_TILES:
+                raise ValueError(f"region covers {tiles} tiles, the limit is {MAX_REGION_TILES}; "
+                                 "give a tile_budget or time_budget to estimate it")
+        params["geometry"] = geom.__geo_interface__
+        params["name"] = str(body.get("name", "region"))
+    return job_type, params
+
+@app.route("/api/jobs", methods=["POST"])
+def submit_job():
+    """
+    Start a green cover computation in the background. The body names the
+    type ("all-sectors", "sector" or "region") plus its parameters; the
+    response holds the job id to poll.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        job_type, params = parse_job_request(body)
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        return jsonify({"error": f"Invalid job: {e}"}), 400
+    
+    try:
+        job_id = job_manager.submit(job_type, params, JOB_TYPES[job_type])
+    except JobQueueFull as e:
+        return jsonify({"error": f"Too many jobs, try again later ({e})"}), 429, {"Retry-After": "30"}
+    
     return jsonify({
-        "sector": sector_name,
-        "green_cover": round(green_cover, 2),
-        "geojson": geojson_data
-    })
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/jobs/{job_id}",
+        "result_url": f"/api/jobs/{job_id}/result"
+    }), 202
+
+@app.route("/api/region-cover", methods=["POST"])
+def region_cover():
+    """
+    Green cover of a region answered straight from the city mosaic (see
+    green_mosaic.py). Takes the body of a region job. Regions the mosaic
+    doesn't cover are estimated within the request's time_budget when it
+    has one, and otherwise get 409 and should be submitted as a job.
+    """
+    from shapely.geometry import shape
+
+    body = request.get_json(silent=True) or {}
+    try:
+        _, params = parse_job_request({**body, "type": "region"})
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        return jsonify({"error": f"Invalid region: {e}"}), 400
+    
+    geom = shape(params["geometry"])
+    cover = mosaic_region_cover(geom, params["mode"])
+    if cover is None:
+        if "seconds" in params.get("budget", {}):
+            try:
+                return jsonify(adaptive_region_cover(geom, params))
+            except ValueError as e:
+                return jsonify({"error": f"Invalid region: {e}"}), 400
+        return jsonify({"error": "Region is not covered by the green mosaic, "
+                                 "submit it to /api/jobs or give a time_budget"}), 409
+    return jsonify({"bbox": geom.bounds, "mode": params["mode"], "source": "mosaic", **cover})
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    """Status and progress of a job"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(job)
+
+@app.route("/api/jobs/<job_id>/result")
+def job_result(job_id):
+    """Result of a finished job; 202 while it is still running"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    if job["status"] in ("queued", "running"):
+        return jsonify(job), 202
+    if job["status"] != "succeeded":
+        return jsonify(job), 409
+    return jsonify(job_store.result(job_id))
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    if job_store.get(job_id) is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    job_manager.cancel(job_id)
+    return jsonify(job_store.get(job_id))
+
+# -------------------------------
+# Vector tiles
+# -------------------------------
+
+# Sector features per mode, rebuilt when boundaries or cached results change
+vector_features = {}
+vector_lock = Lock()
+
+def sector_vector_features(mode):
+    """
+    Return (version, [(id, shapely geometry, properties)]) for every sector
+    boundary, with green cover from the sector cache where it is available.
+    The version changes whenever the boundaries or cached results do.
+    """
+    from shapely.geometry import shape
+
+    boundaries = load_sector_boundaries()
+    count, newest = sector_cache.last_modified(mode, SECTOR_CACHE_VERSION)
+    stamp = f"{boundaries['fetched_at']}:{len(boundaries['sectors'])}:{count}:{newest}"
+    version = hashlib.sha1(f"{SECTOR_CACHE_VERSION}:{mode}:{stamp}".encode()).hexdigest()[:16]
+    
+    with vector_lock:
+        cached = vector_features.get(mode)
+    if cached and cached[0] == version:
+        return cached
+    
+    entries = sector_cache.get_many(mode, CHANDIGARH_SECTORS, SECTOR_CACHE_VERSION, record=False)
+    features = []
+    for sector_name, collection in boundaries["sectors"].items():
+        if not collection:
+            continue
+        entry = entries.get(sector_name)
+        result = entry.result if entry else None
+        for feature in collection["features"]:
+            try:
+                geom = shape(feature["geometry"])
+            except Exception as e:
+                print(f"Error processing geometry for {sector_name}: {e}")
+                continue
+            properties = {"name": sector_name, "mode": mode}
+            if result:
+                properties["green_cover"] = float(result["green_cover"])
+            features.append((feature["properties"].get("id"), geom, properties))
+    
+    cached = (version, features)
+    with vector_lock:
+        vector_features[mode] = cached
+    return cached
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.mvt")
+def sector_vector_tile(z, x, y):
+    """
+    Sector boundaries clipped to one Mapbox Vector Tile, layer "sectors",
+    with name and green_cover properties. Rendered tiles are cached until
+    the boundaries or green cover results change; empty tiles are 204.
+    """
+    from vector_tiles import MVT_MAX_ZOOM, render_vector_tile
+
+    if not (0 <= z <= MVT_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": "Tile out of range"}), 404
+    
+    mode = request_cover_mode()
+    version, features = sector_vector_features(mode)
+    
+    rendered = get_rendered_tiles()
+    kind = f"mvt:{mode}"
+    data = rendered.get(kind, z, x, y, version) if rendered else None
+    if data is None:
+        tile = render_vector_tile("sectors", features, z, x, y)
+        # An empty body stands for an empty tile in the cache
+        data = gzip.compress(tile, mtime=0) if tile else b""
+        if rendered:
+            rendered.put(kind, z, x, y, version, data)
+    
+    if not data:
+        return Response(status=204)
+    return compressed_response(data, hashlib.sha1(data).hexdigest(),
+                               "application/vnd.mapbox-vector-tile")
+
+def city_extent():
+    """Bounding box of every sector boundary, or None while there are none"""
+    _, features = sector_vector_features(COVER_MODE)
+    bounds = [geom.bounds for _, geom, _ in features]
+    if not bounds:
+        return None
+    return (
+        min(b[0] for b in bounds), min(b[1] for b in bounds),
+        max(b[2] for b in bounds), max(b[3] for b in bounds),
+    )
+
+@app.route("/tiles/green/<int:z>/<int:x>/<int:y>.<image_format>")
+def green_overlay(z, x, y, image_format):
+    """
+    Transparent raster overlay of the pixels classified as green, from the
+    same classifier as the green cover counts. Zooms below ZOOM_LEVEL are
+    downsampled from ZOOM_LEVEL masks. Rendered overlays are cached. Only
+    the extent of the sector boundaries is rendered; tiles outside it are 204.
+    """
+    from overlay_tiles import GREEN_OVERLAY_MIN_ZOOM, OVERLAY_FORMATS, green_overlay_tile
+
+    if image_format not in OVERLAY_FORMATS:
+        return jsonify({"error": f"Unsupported format, use one of {', '.join(OVERLAY_FORMATS)}"}), 404
+    if not (GREEN_OVERLAY_MIN_ZOOM <= z <= ZOOM_LEVEL and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": "Tile out of range"}), 404
+    
+    extent = city_extent()
+    data = green_overlay_tile(z, x, y, ZOOM_LEVEL, MAPBOX_TOKEN, extent, image_format) \
+        if extent else None
+    if data is None:
+        return Response(status=204)
+    etag = hashlib.sha1(data).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(data, mimetype=OVERLAY_FORMATS[image_format])
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 @app.route("/api/clear-cache")
 def clear_cache():
-    """Clear the sector cache"""
-    with cache_lock:
-        sector_cache.clear()
-    return jsonify({"message": "Cache cleared successfully"})
+    """
+    Mark every cached sector stale (and clear the boundary cache with
+    ?boundaries=true). Stale sectors keep being served while the background
+    refresher recomputes them.
+    """
+    if request.args.get("boundaries", "false").lower() == "true":
+        clear_boundary_cache()
+    sector_cache.expire()
+    sector_refresher.wake()
+    return jsonify({"message": "Cache cleared successfully, sectors are being refreshed"})
+
+@app.route("/api/tile-cache/stats")
+def tile_cache_stats():
+    """Hit/miss counters and size of the persistent tile store and tile result cache"""
+    store = get_tile_store()
+    if store is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **store.stats(), "results": get_tile_results().stats()})
+
+@app.route("/api/sector-cache/stats")
+def sector_cache_stats():
+    """Hit/miss counters and state of the shared sector result cache"""
+    return jsonify({**sector_cache.stats(), "single_flight": sector_flights.stats()})
+
+@app.route("/metrics")
+def metrics():
+    """
+    Stage latencies, tile and upstream counters and cache events of every
+    worker, in the Prometheus text format
+    """
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route("/api/upstream/stats")
+def upstream_stats():
+    """Current rate and concurrency limits of each upstream host, as adapted so far"""
+    return jsonify(governor_stats())
 
 # Debug endpoint
 @app.route("/api/debug/<sector_name>")
 def debug_sector(sector_name):
     """Debug what data is available for a sector"""
-    overpass_url = "https://overpass-api.de/api/interpreter"
     query = f"""
     [out:json][timeout:30];
     area["name"="Chandigarh"]->.searchArea;
@@ -469,7 +1030,7 @@ def debug_sector(sector_name):
     """
     
     try:
-        response = requests.get(overpass_url, params={'data': query}, timeout=30)
+        response = governed_get(OVERPASS_URL, params={'data': query}, timeout=30)
         data = response.json()
         
         debug_info = {
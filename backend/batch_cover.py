@@ -0,0 +1,274 @@
+"""
+Green cover of many regions in one resumable batch run.
+
+Reads regions from a GeoJSON FeatureCollection (polygons, or their bounding
+boxes with --mode bbox) or from a CSV with name,min_lon,min_lat,max_lon,max_lat
+columns, and computes them a few at a time in this process. All regions
+share the tile store, the tile result cache and the classifier processes,
+so tiles on the border of two regions are fetched and classified once.
+
+Every finished region is appended to the output CSV straight away, and the
+output doubles as the checkpoint: running the same command again skips
+the regions already in it. Regions that failed, or had tiles that could
+not be fetched, are not written, so a rerun retries them.
+
+Run from the backend directory:
+    python batch_cover.py regions.geojson results.csv [--mode polygon] [--workers 4]
+"""
+import argparse
+import concurrent.futures
+import csv
+import json
+import os
+import sys
+import threading
+import time
+
+from shapely.geometry import box, shape
+
+from tile_utils import compute_geometry_green_cover, compute_green_cover, tiles_for_bbox
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+# Regions computed at once. Each one already fetches its tiles concurrently,
+# so a few are enough to keep the fetch and classifier pools busy.
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", 4))
+# Seconds between progress lines
+REPORT_INTERVAL = 10
+
+OUTPUT_FIELDS = [
+    "id", "mode", "zoom", "green_cover", "green_pixels", "total_pixels", "tiles_total",
+    "min_lon", "min_lat", "max_lon", "max_lat", "seconds", "computed_at",
+]
+BBOX_FIELDS = ["min_lon", "min_lat", "max_lon", "max_lat"]
+
+
+# -------------------------------
+# Reading regions
+# -------------------------------
+
+def read_regions(path, id_field="name"):
+    """
+    Return [(region_id, shapely geometry)] from a .geojson/.json
+    FeatureCollection or a .csv of bounding boxes. Region ids come from
+    `id_field` (a feature property or CSV column), else the row number.
+    Raises ValueError on duplicate ids or rows without a usable geometry.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        missing = [field for field in BBOX_FIELDS if rows and field not in rows[0]]
+        if missing:
+            raise ValueError(f"{path}: missing columns {', '.join(missing)}")
+        regions = [
+            (row.get(id_field) or str(i), box(*(float(row[field]) for field in BBOX_FIELDS)))
+            for i, row in enumerate(rows, 1)
+        ]
+    else:
+        with open(path) as f:
+            data = json.load(f)
+        features = data["features"] if data.get("type") == "FeatureCollection" else [data]
+        regions = []
+        for i, feature in enumerate(features, 1):
+            properties = feature.get("properties") or {}
+            region_id = str(properties.get(id_field) or feature.get("id") or i)
+            geom = shape(feature["geometry"])
+            if geom.geom_type not in ("Polygon", "MultiPolygon") or geom.is_empty:
+                raise ValueError(f"{path}: region {region_id} is a {geom.geom_type}, not a polygon")
+            regions.append((region_id, geom))
+
+    seen = set()
+    for region_id, _ in regions:
+        if region_id in seen:
+            raise ValueError(f"{path}: duplicate region id {region_id!r}")
+        seen.add(region_id)
+    return regions
+
+
+# -------------------------------
+# Output and checkpoint
+# -------------------------------
+
+def finished_regions(path):
+    """
+    Ids of the regions already in the output CSV. A line cut short by an
+    interrupted run is removed so appending starts on a clean line.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        if not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames != OUTPUT_FIELDS:
+            raise ValueError(f"{path} was not written by this tool (columns {reader.fieldnames})")
+        return {row["id"] for row in reader}
+
+
+class ResultWriter:
+    """Appends result rows to a CSV, each one flushed to disk before the next."""
+
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=OUTPUT_FIELDS)
+        self._lock = threading.Lock()
+        if new:
+            self._writer.writeheader()
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def write(self, row):
+        with self._lock:
+            self._writer.writerow(row)
+            self._sync()
+
+    def close(self):
+        self._file.close()
+
+
+# -------------------------------
+# Running
+# -------------------------------
+
+class Throughput:
+    """Counts finished regions and classified tiles, and prints a progress line now and then."""
+
+    def __init__(self, regions, interval=REPORT_INTERVAL):
+        self.regions = regions
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.tiles = 0
+        self.started = time.perf_counter()
+        self._reported = self.started
+        self._lock = threading.Lock()
+
+    def finished(self, tiles, ok):
+        with self._lock:
+            self.done += 1
+            self.failed += not ok
+            self.tiles += tiles
+            now = time.perf_counter()
+            if now - self._reported < self.interval and self.done < self.regions:
+                return
+            self._reported = now
+            print(self.line(now), flush=True)
+
+    def line(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        eta = (self.regions - self.done) / rate if rate else float("inf")
+        return (
+            f"{self.done}/{self.regions} regions ({self.failed} failed), "
+            f"{self.tiles / elapsed if elapsed else 0.0:.1f} tiles/s, "
+            f"{rate * 60:.1f} regions/min, ETA {eta / 60:.1f} min"
+        )
+
+
+def compute_region(region_id, geom, mode, zoom, token):
+    """Green cover of one region as an output row, or raise if it is incomplete."""
+    started = time.perf_counter()
+    if mode == "polygon":
+        cover = compute_geometry_green_cover(geom, region_id, zoom, token)
+    else:
+        cover = compute_green_cover(geom.bounds, zoom, token)
+    if cover["failed_tiles"] or not cover["total_pixels"]:
+        first = cover["failed_tiles"][0]["error"] if cover["failed_tiles"] else "no tiles"
+        raise RuntimeError(f"{len(cover['failed_tiles'])} tiles failed ({first})")
+    return {
+        "id": region_id,
+        "mode": mode,
+        "zoom": zoom,
+        "green_cover": cover["green_cover"],
+        "green_pixels": cover["green_pixels"],
+        "total_pixels": cover["total_pixels"],
+        "tiles_total": cover["tiles_total"],
+        **dict(zip(BBOX_FIELDS, (round(v, 7) for v in geom.bounds))),
+        "seconds": round(time.perf_counter() - started, 3),
+        "computed_at": round(time.time()),
+    }
+
+
+def run_batch(regions, output, mode, zoom, token, workers=BATCH_WORKERS):
+    """
+    Compute every region not yet in `output`, appending rows as they finish.
+    Returns (written, failed) where failed maps region ids to errors.
+    """
+    done = finished_regions(output)
+    pending = [(region_id, geom) for region_id, geom in regions if region_id not in done]
+    print(f"{len(regions)} regions, {len(done)} already in {output}, {len(pending)} to compute")
+    if not pending:
+        return 0, {}
+
+    throughput = Throughput(len(pending))
+    writer = ResultWriter(output)
+    failed = {}
+    written = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {
+                executor.submit(compute_region, region_id, geom, mode, zoom, token): (region_id, geom)
+                for region_id, geom in pending
+            }
+            for future in concurrent.futures.as_completed(futures):
+                region_id, geom = futures[future]
+                try:
+                    row = future.result()
+                except Exception as e:
+                    failed[region_id] = str(e) or type(e).__name__
+                    print(f"✗ {region_id}: {failed[region_id]}")
+                    throughput.finished(0, False)
+                    continue
+                writer.write(row)
+                written += 1
+                throughput.finished(row["tiles_total"], True)
+    finally:
+        writer.close()
+    return written, failed
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("regions", help="GeoJSON FeatureCollection or CSV of bounding boxes")
+    parser.add_argument("output", help="CSV to append results to; also the resume checkpoint")
+    parser.add_argument("--mode", choices=("bbox", "polygon"), default="bbox")
+    parser.add_argument("--zoom", type=int, default=17)
+    parser.add_argument("--id-field", default="name", help="property or column naming each region")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="regions computed at once")
+    parser.add_argument("--max-tiles", type=int, default=None,
+                        help="refuse regions whose bounding box needs more tiles than this")
+    args = parser.parse_args()
+
+    token = os.getenv("MAPBOX_TOKEN")
+    if not token:
+        parser.error("MAPBOX_TOKEN is not set")
+    try:
+        regions = read_regions(args.regions, args.id_field)
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(str(e))
+    if args.max_tiles:
+        too_big = [region_id for region_id, geom in regions
+                   if len(tiles_for_bbox(geom.bounds, args.zoom)) > args.max_tiles]
+        if too_big:
+            parser.error(f"regions over {args.max_tiles} tiles: {', '.join(too_big[:10])}")
+
+    started = time.perf_counter()
+    written, failed = run_batch(regions, args.output, args.mode, args.zoom, token, args.workers)
+    print(f"Wrote {written} regions to {args.output} in {time.perf_counter() - started:.1f}s"
+          + (f", {len(failed)} failed (rerun to retry them)" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
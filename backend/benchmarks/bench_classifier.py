@@ -0,0 +1,106 @@
+"""
+Micro-benchmark for the tile classifier.
+
+Compares the float HSV reference against the integer fast path, per tile and
+batched, on synthetic 256x256 tiles and reports tiles/sec and peak memory.
+
+Run from the backend directory:
+    python -m benchmarks.bench_classifier [--tiles 200] [--verify]
+"""
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from tile_utils import (
+    TILE_BATCH_SIZE,
+    GreenClassifier,
+    analyze_tile_image,
+    analyze_tile_image_reference,
+    classify_tiles,
+    green_mask_reference,
+)
+
+
+def synthetic_tiles(count, seed=0):
+    """Noisy tiles with a mix of vegetation, concrete and shadow colours."""
+    rng = np.random.default_rng(seed)
+    palette = np.array([
+        [60, 110, 45], [95, 140, 70], [130, 125, 115],
+        [180, 175, 165], [40, 40, 45], [150, 120, 90],
+    ], dtype=np.int16)
+    tiles = []
+    for _ in range(count):
+        labels = rng.integers(0, len(palette), size=(16, 16))
+        base = np.kron(palette[labels], np.ones((16, 16, 1), dtype=np.int16))
+        noise = rng.integers(-25, 26, size=base.shape, dtype=np.int16)
+        tiles.append(Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)))
+    return tiles
+
+
+def run(name, fn, tiles):
+    fn(tiles[0])  # warm up scratch buffers
+    start = time.perf_counter()
+    counts = [fn(tile)[0] for tile in tiles]
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    fn(tiles[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<10} {len(tiles) / elapsed:10.1f} tiles/s   peak {peak / 1024:8.1f} KiB/tile")
+    return counts
+
+
+def run_batched(tiles, batch_size):
+    list(classify_tiles(enumerate(tiles[:batch_size]), batch_size))  # warm up
+    start = time.perf_counter()
+    counts = [green for _, green, _ in classify_tiles(enumerate(tiles), batch_size)]
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    list(classify_tiles(enumerate(tiles[:batch_size]), batch_size))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    name = f"batch({batch_size})"
+    print(f"{name:<10} {len(tiles) / elapsed:10.1f} tiles/s   peak {peak / 1024:8.1f} KiB/batch")
+    return counts
+
+
+def verify_all_colours():
+    """Compare both classifiers on every one of the 2^24 RGB values."""
+    classifier = GreenClassifier()
+    g, b = np.meshgrid(np.arange(256), np.arange(256), indexing="ij")
+    mismatches = 0
+    for r in range(256):
+        pixels = np.stack([np.full_like(g, r), g, b], axis=-1).astype(np.uint8)
+        mismatches += int(np.count_nonzero(
+            green_mask_reference(pixels) != classifier.green_mask(pixels)
+        ))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tiles", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=TILE_BATCH_SIZE)
+    parser.add_argument("--verify", action="store_true",
+                        help="also check every RGB value for identical results")
+    args = parser.parse_args()
+
+    tiles = synthetic_tiles(args.tiles)
+    reference = run("reference", analyze_tile_image_reference, tiles)
+    fast = run("integer", analyze_tile_image, tiles)
+    batched = run_batched(tiles, args.batch_size)
+    print(f"green counts identical: {reference == fast == batched}")
+
+    if args.verify:
+        print(f"mismatching RGB values: {verify_all_colours()}")
+
+
+if __name__ == "__main__":
+    main()
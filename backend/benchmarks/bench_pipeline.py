@@ -0,0 +1,276 @@
+"""
+End-to-end benchmark of the sector pipeline against a local stand-in.
+
+Tiles and sector boundaries come from benchmarks/standin.py instead of
+Mapbox and Overpass, so runs are offline and repeatable. Each run starts a
+fresh process with empty caches and measures:
+
+    sector  every sector computed on its own (calculate_sector_green_cover)
+    city    GET /api/all-sectors, every sector in one batch
+
+in three passes per fetch concurrency:
+
+    cold         empty caches
+    warm-store   tile store kept, tile and sector results cleared, so every
+                 tile is decoded and classified again without fetching it
+    warm-result  tile store and tile results kept, sector results cleared,
+                 so the pass mostly measures result lookups
+
+It reports tiles/s, p50/p99 latency
+(per sector, or per city request) and peak RSS including the classifier
+processes, and checks green cover against the ratios the stand-in painted.
+
+Run from the backend directory:
+    python -m benchmarks.bench_pipeline [--sectors 12] [--concurrency 8 32]
+    python -m benchmarks.bench_pipeline --save-baseline bench.json
+    python -m benchmarks.bench_pipeline --baseline bench.json [--threshold 0.2]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.standin import StandIn, sector_tiles
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("sector", "city")
+ZOOM_LEVEL = 17  # the zoom app.py analyzes sectors at
+# Metrics compared with a baseline, and whether a larger value is better
+REGRESSION_METRICS = {"tiles_per_sec": True, "p99_ms": False, "peak_rss_mb": False}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, round(q / 100 * (len(values) - 1)))]
+
+
+def peak_rss_mb():
+    """Peak RSS of this process plus that of the live classifier processes, in MiB."""
+    total = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    for child in multiprocessing.active_children():
+        try:
+            with open(f"/proc/{child.pid}/status") as f:
+                total += next(
+                    int(line.split()[1]) for line in f if line.startswith("VmHWM:")
+                ) / 1024
+        except (OSError, StopIteration):
+            pass
+    return round(total, 1)
+
+
+def expected_cover(tiles, zoom):
+    """Green cover, in percent, the stand-in painted into a set of tiles."""
+    from benchmarks.standin import tile_green_pixels
+    from tile_utils import TILE_SIZE
+
+    green = sum(tile_green_pixels(x, y, zoom) for x, y in tiles)
+    return round(100 * green / (len(tiles) * TILE_SIZE * TILE_SIZE), 2)
+
+
+# -------------------------------
+# Measured process
+# -------------------------------
+
+def run_pass(scenario, sector_names, app_module):
+    """One cold or warm pass. Returns (latencies in seconds, results by sector)."""
+    latencies = []
+    results = {}
+    if scenario == "sector":
+        for sector_name in sector_names:
+            start = time.perf_counter()
+            result = app_module.calculate_sector_green_cover(sector_name, "bbox")
+            latencies.append(time.perf_counter() - start)
+            if result:
+                results[sector_name] = result
+    else:
+        client = app_module.app.test_client()
+        start = time.perf_counter()
+        response = client.get("/api/all-sectors?mode=bbox")
+        latencies.append(time.perf_counter() - start)
+        for stat in response.get_json()["sector_stats"]:
+            results[stat["sector"]] = stat
+    return latencies, results
+
+
+def measure(scenario, sector_names):
+    """Run a scenario's cold, warm-store and warm-result passes in this process and return their metrics."""
+    import app as app_module
+    import osm_utils
+    from tile_store import get_tile_results
+
+    if scenario == "city":
+        # The endpoint covers every sector; app shares this list object
+        osm_utils.CHANDIGARH_SECTORS[:] = sector_names
+
+    sectors, unique_tiles, _, _ = app_module.sector_tile_layout(sector_names, "bbox")
+    expected = {
+        name: expected_cover(tiles, app_module.ZOOM_LEVEL) for name, _, _, tiles, _, _ in sectors
+    }
+    tile_count = (
+        sum(len(tiles) for _, _, _, tiles, _, _ in sectors) if scenario == "sector"
+        else len(unique_tiles)
+    )
+
+    metrics = {}
+    for state in ("cold", "warm-store", "warm-result"):
+        if state == "warm-store":
+            get_tile_results().clear()
+        if state != "cold":
+            app_module.sector_cache.clear()
+            app_module.encoded_cache.clear()
+        start = time.perf_counter()
+        latencies, results = run_pass(scenario, sector_names, app_module)
+        elapsed = time.perf_counter() - start
+        wrong = sorted(
+            name for name, cover in expected.items()
+            if name not in results or abs(results[name]["green_cover"] - cover) > 0.01
+        )
+        metrics[state] = {
+            "sectors": len(results),
+            "tiles": tile_count,
+            "seconds": round(elapsed, 3),
+            "tiles_per_sec": round(tile_count / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "peak_rss_mb": peak_rss_mb(),
+            "wrong_cover": wrong,
+        }
+    return metrics
+
+
+# -------------------------------
+# Driver
+# -------------------------------
+
+def run_child(scenario, concurrency, args, tiles, overpass):
+    """Run one scenario in a fresh process with its own empty caches."""
+    with tempfile.TemporaryDirectory(prefix="bench-pipeline-") as cache_dir:
+        env = {
+            **os.environ,
+            "MAPBOX_TOKEN": "bench",
+            # Separate hosts, so each gets the rate governor limits of the one it replaces
+            "MAPBOX_API_URL": tiles.url,
+            "OVERPASS_URL": f"{overpass.url}/api/interpreter",
+            "MAPBOX_RATE_LIMIT": str(args.rate_limit),
+            "TILE_FETCH_CONCURRENCY": str(concurrency),
+            "TILE_STORE_PATH": os.path.join(cache_dir, "tiles.sqlite"),
+            "SECTOR_CACHE_PATH": os.path.join(cache_dir, "sectors.sqlite"),
+            "JOB_STORE_PATH": os.path.join(cache_dir, "jobs.sqlite"),
+            "BOUNDARY_CACHE_PATH": os.path.join(cache_dir, "boundaries.json"),
+            "GREEN_MOSAIC_PATH": os.path.join(cache_dir, "mosaic"),
+            "METRICS_PATH": os.path.join(cache_dir, "metrics.sqlite"),
+            "SNAPSHOT_PATH": "",
+        }
+        if args.workers is not None:
+            env["TILE_PROCESS_WORKERS"] = str(args.workers)
+        command = [
+            sys.executable, "-m", "benchmarks.bench_pipeline",
+            "--child", scenario, "--sectors", str(args.sectors),
+        ]
+        completed = subprocess.run(
+            command, cwd=BACKEND_DIR, env=env, stdout=subprocess.PIPE,
+            stderr=None if args.verbose else subprocess.DEVNULL, text=True,
+        )
+    lines = completed.stdout.strip().splitlines()
+    if args.verbose:
+        print("\n".join(lines[:-1]))
+    if completed.returncode != 0 or not lines:
+        raise RuntimeError(f"{scenario} run failed with exit code {completed.returncode}")
+    return json.loads(lines[-1])
+
+
+def compare(results, baseline, threshold):
+    """Return a line for every metric more than threshold worse than the baseline."""
+    regressions = []
+    for key, metrics in results.items():
+        for metric, higher_is_better in REGRESSION_METRICS.items():
+            old = baseline.get(key, {}).get(metric)
+            new = metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(f"{key} {metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--sectors", type=int, default=12, help="first N sectors (up to 56)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32],
+                        help="TILE_FETCH_CONCURRENCY values to run")
+    parser.add_argument("--workers", type=int, help="TILE_PROCESS_WORKERS (default: CPU count)")
+    parser.add_argument("--latency", type=float, default=30, help="stand-in latency in ms")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="share of tile requests the stand-in answers with 429")
+    parser.add_argument("--rate-limit", type=float, default=1000,
+                        help="MAPBOX_RATE_LIMIT for the stand-in (production default: 30)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the results to PATH")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved run")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown that counts as a regression")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's output")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    from osm_utils import CHANDIGARH_SECTORS
+    sector_names = CHANDIGARH_SECTORS[:args.sectors]
+
+    if args.child:
+        print(json.dumps(measure(args.child, sector_names)))
+        return 0
+
+    tiles = StandIn(latency=args.latency / 1000, throttle_rate=args.throttle_rate).start()
+    overpass = StandIn(latency=args.latency / 1000).start()
+    tiles.prerender(sector_tiles(sector_names, ZOOM_LEVEL), ZOOM_LEVEL)
+    print(f"stand-in tiles at {tiles.url}, Overpass at {overpass.url}, "
+          f"{len(sector_names)} sectors, {args.latency:g} ms latency")
+    print(f"{'run':<24} {'tiles':>6} {'tiles/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'RSS MiB':>8}")
+
+    results = {}
+    failed = False
+    try:
+        for scenario in args.scenarios:
+            for concurrency in args.concurrency:
+                metrics = run_child(scenario, concurrency, args, tiles, overpass)
+                for state, m in metrics.items():
+                    key = f"{scenario}-{state}@{concurrency}"
+                    results[key] = m
+                    print(f"{key:<24} {m['tiles']:>6} {m['tiles_per_sec']:>9.1f} "
+                          f"{m['p50_ms']:>9.1f} {m['p99_ms']:>9.1f} {m['peak_rss_mb']:>8.1f}")
+                    if m["wrong_cover"] or m["sectors"] != len(sector_names):
+                        failed = True
+                        print(f"  ✗ {len(sector_names) - m['sectors']} sectors missing, "
+                              f"wrong cover for: {', '.join(m['wrong_cover']) or 'none'}")
+    finally:
+        tiles.stop()
+        overpass.stop()
+    print(f"stand-in requests: {json.dumps(tiles.stats())}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"⚠️ regression: {line}")
+        if regressions:
+            failed = True
+        else:
+            print(f"✓ within {args.threshold:.0%} of {args.baseline}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+Local stand-in for Mapbox and Overpass, so the tile pipeline can be
+benchmarked offline.
+
+Serves synthetic satellite tiles whose green pixel count is known in
+advance, and a canned Overpass response describing CHANDIGARH_SECTORS as a
+grid of rectangles over the city. Point the backend at it with
+MAPBOX_API_URL and OVERPASS_URL.
+
+Run from the backend directory to browse it by hand:
+    python -m benchmarks.standin [--port 8900] [--latency 30]
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from osm_utils import CHANDIGARH_SECTORS
+from tile_utils import TILE_SIZE, tiles_for_bbox
+
+# Flat colours the classifier reads as vegetation and as built-up land
+GREEN = (50, 140, 60)
+NOT_GREEN = (140, 130, 120)
+# Tiles are painted in BLOCK x BLOCK squares, in an order fixed by a seed
+BLOCK = 4
+
+# Sectors are laid out row by row over roughly Chandigarh's extent
+GRID_COLUMNS = 8
+GRID_ORIGIN = (76.74, 30.78)  # north-west corner (lon, lat)
+SECTOR_SIZE = (0.0085, 0.0105)  # degrees of (lon, lat)
+# Points along each side of a sector, so boundaries look like OSM ways
+SIDE_POINTS = 6
+
+TILE_PATH = re.compile(r"^/styles/v1/[^/]+/[^/]+/tiles/256/(\d+)/(\d+)/(\d+)$")
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+_blocks = TILE_SIZE // BLOCK
+_order = np.random.default_rng(0).permutation(_blocks * _blocks)
+
+
+def tile_green_pixels(x, y, z):
+    """Number of green pixels painted into tile (x, y, z)."""
+    ratio = 0.1 + ((x * 7919 + y * 104729 + z) % 61) / 100
+    return round(ratio * _blocks * _blocks) * BLOCK * BLOCK
+
+
+def render_tile(x, y, z):
+    """PNG bytes of a synthetic tile."""
+    green_blocks = tile_green_pixels(x, y, z) // (BLOCK * BLOCK)
+    labels = np.zeros(_blocks * _blocks, dtype=bool)
+    labels[_order[:green_blocks]] = True
+    labels = np.kron(labels.reshape(_blocks, _blocks), np.ones((BLOCK, BLOCK), dtype=bool))
+    pixels = np.where(labels[..., None], GREEN, NOT_GREEN).astype(np.uint8)
+    buf = BytesIO()
+    Image.fromarray(pixels).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def sector_rectangle(sector_name):
+    """(min_lon, min_lat, max_lon, max_lat) of a sector on the stand-in grid."""
+    index = CHANDIGARH_SECTORS.index(sector_name)
+    row, column = divmod(index, GRID_COLUMNS)
+    min_lon = GRID_ORIGIN[0] + column * SECTOR_SIZE[0]
+    max_lat = GRID_ORIGIN[1] - row * SECTOR_SIZE[1]
+    return (
+        round(min_lon, 7), round(max_lat - SECTOR_SIZE[1], 7),
+        round(min_lon + SECTOR_SIZE[0], 7), round(max_lat, 7),
+    )
+
+
+def overpass_elements(sector_names=CHANDIGARH_SECTORS):
+    """
+    Overpass "out geom" elements for the sectors: one administrative
+    relation each, made of four open outer ways that only join into a ring
+    end to end.
+    """
+    elements = []
+    for number, sector_name in enumerate(sector_names, 1):
+        min_lon, min_lat, max_lon, max_lat = sector_rectangle(sector_name)
+        corners = [(min_lon, min_lat), (max_lon, min_lat), (max_lon, max_lat),
+                   (min_lon, max_lat), (min_lon, min_lat)]
+        members = []
+        for side, ((lon0, lat0), (lon1, lat1)) in enumerate(zip(corners, corners[1:])):
+            way_id = number * 10 + side
+            geometry = [
+                {"lat": round(lat0 + (lat1 - lat0) * i / SIDE_POINTS, 7),
+                 "lon": round(lon0 + (lon1 - lon0) * i / SIDE_POINTS, 7)}
+                for i in range(SIDE_POINTS + 1)
+            ]
+            # Keep shared corners identical after rounding
+            geometry[0], geometry[-1] = {"lat": lat0, "lon": lon0}, {"lat": lat1, "lon": lon1}
+            elements.append({"type": "way", "id": way_id, "geometry": geometry})
+            members.append({"type": "way", "ref": way_id, "role": "outer"})
+        elements.append({
+            "type": "relation",
+            "id": number,
+            "members": members,
+            "tags": {"name": sector_name.replace(" ", "-"), "boundary": "administrative"},
+        })
+    return elements
+
+
+def sector_tiles(sector_names, z):
+    """Every tile (x, y) the bounding boxes of the sectors touch at zoom z."""
+    tiles = set()
+    for sector_name in sector_names:
+        tiles.update(tiles_for_bbox(sector_rectangle(sector_name), z))
+    return tiles
+
+
+class StandIn:
+    """
+    Threaded HTTP server answering tile and Overpass requests. latency is
+    added to every response in seconds; throttle_rate is the share of tile
+    requests answered with 429 and a Retry-After.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, throttle_rate=0.0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.counts = {"tiles": 0, "not_modified": 0, "throttled": 0, "overpass": 0}
+        self._tiles = {}
+        self._lock = threading.Lock()
+        self._overpass = json.dumps({"elements": overpass_elements()}).encode()
+
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                standin.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def prerender(self, tiles, z):
+        """Render tiles ahead of time, so serving them costs no CPU during a run."""
+        for x, y in tiles:
+            self._tile(x, y, z)
+
+    def _tile(self, x, y, z):
+        key = (z, x, y)
+        tile = self._tiles.get(key)
+        if tile is None:
+            data = render_tile(x, y, z)
+            tile = (data, f'"{hashlib.md5(data).hexdigest()}"')
+            with self._lock:
+                self._tiles[key] = tile
+        return tile
+
+    def handle(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        path = request.path.split("?", 1)[0]
+        match = TILE_PATH.match(path)
+        if match:
+            if self.throttle_rate and random.random() < self.throttle_rate:
+                self._count("throttled")
+                return self._send(request, 429, b"", {"Retry-After": "1"})
+            z, x, y = (int(part) for part in match.groups())
+            data, etag = self._tile(x, y, z)
+            if request.headers.get("If-None-Match") == etag:
+                self._count("not_modified")
+                return self._send(request, 304, b"", {"ETag": etag})
+            self._count("tiles")
+            return self._send(request, 200, data, {
+                "Content-Type": "image/png", "ETag": etag, "Last-Modified": LAST_MODIFIED,
+            })
+        if path == "/api/interpreter":
+            self._count("overpass")
+            return self._send(request, 200, self._overpass, {"Content-Type": "application/json"})
+        self._send(request, 404, b"not found", {"Content-Type": "text/plain"})
+
+    def _send(self, request, status, body, headers):
+        request.send_response(status)
+        for name, value in headers.items():
+            request.send_header(name, value)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        if body:
+            request.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=30, help="added latency in ms")
+    parser.add_argument("--throttle-rate", type=float, default=0.0,
+                        help="share of tile requests answered with 429")
+    args = parser.parse_args()
+
+    standin = StandIn(args.host, args.port, args.latency / 1000, args.throttle_rate)
+    print(f"MAPBOX_API_URL={standin.url}")
+    print(f"OVERPASS_URL={standin.url}/api/interpreter")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(standin.stats()))
+
+
+if __name__ == "__main__":
+    main()
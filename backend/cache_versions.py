@@ -0,0 +1,7 @@
+# Versions stamped on cached results. They live apart from the modules they
+# describe, which pull in numpy, PIL and shapely, so the web app can check
+# its caches without loading the image pipeline.
+
+# Bump whenever classification output changes, so cached per-tile results
+# computed by an older classifier are never reused.
+CLASSIFIER_VERSION = 1
@@ -0,0 +1,286 @@
+import math
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+# Grid points across the bounding box of an encoded collection. 1e5 keeps
+# coordinates to well under a metre across a whole city.
+QUANTIZATION = 100000
+# Zoom levels with their own simplified geometry. Requests for other zooms
+# get the next more detailed level; beyond the last one nothing is simplified.
+SIMPLIFY_ZOOMS = (10, 12, 14, 16)
+
+
+def simplify_zoom(zoom):
+    """The simplification level serving a map zoom, or None for full detail."""
+    if zoom is None:
+        return None
+    for level in SIMPLIFY_ZOOMS:
+        if zoom <= level:
+            return level
+    return None
+
+
+def simplify_tolerance(zoom):
+    """Half a 256px map pixel at zoom, in degrees; 0 for full detail."""
+    level = simplify_zoom(zoom)
+    if level is None:
+        return 0.0
+    return 360.0 / (256 * 2 ** level) / 2
+
+
+# -------------------------------
+# Topology
+# -------------------------------
+
+def _polygons(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    return []
+
+
+def _quantize_ring(ring, translate, scale):
+    points = []
+    for x, y, *_ in ring:
+        point = (round((x - translate[0]) / scale[0]), round((y - translate[1]) / scale[1]))
+        if not points or points[-1] != point:
+            points.append(point)
+    if points[0] != points[-1]:
+        points.append(points[0])
+    return points if len(points) >= 4 else None
+
+
+def _find_junctions(rings):
+    """
+    Points where rings meet or part ways: a point is a junction when it
+    is reached from different neighbours in different places.
+    """
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        n = len(ring) - 1
+        for i in range(n):
+            prev_point, next_point = ring[i - 1], ring[i + 1]
+            pair = (prev_point, next_point) if prev_point < next_point else (next_point, prev_point)
+            seen = neighbours.setdefault(ring[i], pair)
+            if seen != pair:
+                junctions.add(ring[i])
+    return junctions
+
+
+def _perpendicular_distances(points, first, last):
+    (x0, y0), (x1, y1) = first, last
+    dx, dy = x1 - x0, y1 - y0
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return [math.hypot(x - x0, y - y0) for x, y in points]
+    return [abs(dy * (x - x0) - dx * (y - y0)) / length for x, y in points]
+
+
+def _douglas_peucker(points, tolerance):
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        distances = _perpendicular_distances(points[start + 1:end], points[start], points[end])
+        index = max(range(len(distances)), key=distances.__getitem__)
+        if distances[index] > tolerance:
+            index += start + 1
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def simplify_arc(arc, tolerance):
+    """
+    Douglas-Peucker simplification that keeps the arc's end points, so
+    arcs shared by neighbouring polygons stay joined. A closed arc (a whole
+    ring) keeps at least its start and the point farthest from it.
+    """
+    if tolerance <= 0 or len(arc) <= 2:
+        return arc
+    if arc[0] != arc[-1]:
+        return _douglas_peucker(arc, tolerance)
+    distances = _perpendicular_distances(arc, arc[0], arc[0])
+    far = max(range(len(arc)), key=distances.__getitem__)
+    return _douglas_peucker(arc[:far + 1], tolerance) + _douglas_peucker(arc[far:], tolerance)[1:]
+
+
+class _ArcIndex:
+    """Deduplicates arcs; an arc used backwards is referenced as ~index."""
+
+    def __init__(self):
+        self.arcs = []
+        self._index = {}
+
+    def add(self, arc):
+        key = tuple(arc)
+        if key in self._index:
+            return self._index[key]
+        reverse = key[::-1]
+        if reverse in self._index:
+            return ~self._index[reverse]
+        self._index[key] = len(self.arcs)
+        self.arcs.append(arc)
+        return self._index[key]
+
+    def add_ring(self, ring):
+        # A ring that meets nothing is one closed arc. Start it at its
+        # smallest point so the same ring in another polygon is shared.
+        points = ring[:-1]
+        start = points.index(min(points))
+        forward = points[start:] + points[:start]
+        backward = forward[:1] + forward[:0:-1]
+        if tuple(backward) < tuple(forward):
+            return ~self.add(backward + backward[:1])
+        return self.add(forward + forward[:1])
+
+
+def _split_ring(ring, junctions, index):
+    points = ring[:-1]
+    cuts = [i for i, point in enumerate(points) if point in junctions]
+    if not cuts:
+        return [index.add_ring(ring)]
+    # Rotate so the ring starts on a junction, then cut at every junction
+    points = points[cuts[0]:] + points[:cuts[0]] + [points[cuts[0]]]
+    arcs = []
+    start = 0
+    for i in range(1, len(points)):
+        if points[i] in junctions or i == len(points) - 1:
+            arcs.append(index.add(points[start:i + 1]))
+            start = i
+    return arcs
+
+
+def _ring_size(arcs, arc_list):
+    return sum(len(arc_list[i if i >= 0 else ~i]) - 1 for i in arcs)
+
+
+def build_topology(features, tolerance=0.0, quantization=QUANTIZATION, name="sectors"):
+    """
+    Encode GeoJSON (Multi)Polygon features as a TopoJSON Topology. Borders
+    shared by neighbouring features are stored once as arcs, coordinates are
+    quantized to a quantization x quantization grid and delta-encoded, and
+    arcs are simplified with `tolerance` (in degrees) when it is positive.
+    Rings that collapse when simplified are dropped.
+    """
+    polygons_by_feature = [_polygons(feature["geometry"]) for feature in features]
+    xs = [x for polygons in polygons_by_feature for polygon in polygons
+          for ring in polygon for x, *_ in ring]
+    ys = [y for polygons in polygons_by_feature for polygon in polygons
+          for ring in polygon for _, y, *_ in ring]
+    if not xs:
+        return {
+            "type": "Topology",
+            "objects": {name: {"type": "GeometryCollection", "geometries": []}},
+            "arcs": [],
+        }
+
+    bbox = [min(xs), min(ys), max(xs), max(ys)]
+    translate = (bbox[0], bbox[1])
+    scale = (
+        (bbox[2] - bbox[0]) / (quantization - 1) or 1.0,
+        (bbox[3] - bbox[1]) / (quantization - 1) or 1.0,
+    )
+
+    quantized = []
+    for polygons in polygons_by_feature:
+        feature_polygons = []
+        for polygon in polygons:
+            rings = [_quantize_ring(ring, translate, scale) for ring in polygon]
+            if rings and rings[0] is not None:
+                feature_polygons.append([ring for ring in rings if ring is not None])
+        quantized.append(feature_polygons)
+
+    junctions = _find_junctions(
+        [ring for polygons in quantized for polygon in polygons for ring in polygon]
+    )
+    index = _ArcIndex()
+    feature_arcs = [
+        [[_split_ring(ring, junctions, index) for ring in polygon] for polygon in polygons]
+        for polygons in quantized
+    ]
+
+    # Simplify the shared arcs themselves, so neighbours stay seamless
+    grid_tolerance = tolerance / max(scale)
+    arcs = [simplify_arc(arc, grid_tolerance) for arc in index.arcs]
+
+    geometries = []
+    for feature, polygons in zip(features, feature_arcs):
+        kept = []
+        for polygon in polygons:
+            if _ring_size(polygon[0], arcs) < 3:
+                continue
+            kept.append([polygon[0]] + [ring for ring in polygon[1:] if _ring_size(ring, arcs) >= 3])
+        geometry = {"properties": dict(feature.get("properties") or {})}
+        if len(kept) == 1:
+            geometry.update(type="Polygon", arcs=kept[0])
+        else:
+            geometry.update(type="MultiPolygon", arcs=kept)
+        geometries.append(geometry)
+
+    encoded = []
+    for arc in arcs:
+        x0, y0 = arc[0]
+        deltas = [[x0, y0]]
+        for x, y in arc[1:]:
+            deltas.append([x - x0, y - y0])
+            x0, y0 = x, y
+        encoded.append(deltas)
+
+    return {
+        "type": "Topology",
+        "bbox": bbox,
+        "transform": {"scale": list(scale), "translate": list(translate)},
+        "objects": {name: {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": encoded,
+    }
+
+
+def topology_to_geojson(topology, name="sectors"):
+    """
+    Decode a Topology from build_topology back into a GeoJSON
+    FeatureCollection, rounding coordinates to the quantization grid.
+    """
+    transform = topology.get("transform")
+    if transform is None:
+        return {"type": "FeatureCollection", "features": []}
+    (sx, sy), (tx, ty) = transform["scale"], transform["translate"]
+    digits = max(0, math.ceil(-math.log10(min(sx, sy))))
+
+    arcs = []
+    for encoded in topology["arcs"]:
+        x = y = 0
+        points = []
+        for dx, dy in encoded:
+            x += dx
+            y += dy
+            points.append([round(x * sx + tx, digits), round(y * sy + ty, digits)])
+        arcs.append(points)
+
+    def ring(arc_ids):
+        coords = []
+        for i in arc_ids:
+            points = arcs[i] if i >= 0 else arcs[~i][::-1]
+            coords.extend(points if not coords else points[1:])
+        return coords
+
+    features = []
+    for geometry in topology["objects"][name]["geometries"]:
+        if geometry["type"] == "Polygon":
+            coordinates = [ring(arc_ids) for arc_ids in geometry["arcs"]]
+        else:
+            coordinates = [[ring(arc_ids) for arc_ids in polygon] for polygon in geometry["arcs"]]
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": geometry["type"], "coordinates": coordinates},
+            "properties": geometry["properties"],
+        })
+    return {"type": "FeatureCollection", "features": features}
@@ -0,0 +1,372 @@
+"""
+City-wide green mosaic.
+
+An offline build step classifies every tile of the city once and stores the
+result as a summed-area table (integral image) of the green mask: entry
+[r, c] holds the number of green pixels above and to the left of pixel
+(r, c). The table is memory-mapped, so a rectangle costs four lookups and a
+polygon four lookups per pixel row, without loading the city into RAM.
+
+Build it from the backend directory:
+    python green_mosaic.py [--bbox MIN_LON MIN_LAT MAX_LON MAX_LAT] [--zoom 17]
+"""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from tile_fetch import iter_fetch
+from tile_utils import (
+    CLASSIFIER_VERSION, TILE_SIZE, TILE_STYLE, deg2num, fetch_tile, get_classifier, tile_bounds,
+    tiles_for_bbox
+)
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+GREEN_MOSAIC_PATH = os.getenv(
+    "GREEN_MOSAIC_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "mosaic"),
+)
+METADATA_FILE = "mosaic.json"
+INTEGRAL_FILE = "integral.npy"
+# The integral image is uint32, so a mosaic holds at most 2**32 - 1 pixels
+# (about 65000 zoom 17 tiles)
+MAX_MOSAIC_PIXELS = 2 ** 32 - 1
+
+
+class MosaicBuildError(Exception):
+    """Raised when tiles of the mosaic could not be fetched or classified."""
+
+
+# -------------------------------
+# Building
+# -------------------------------
+
+def tile_green_mask(data):
+    """Classify an encoded imagery tile into a TILE_SIZE x TILE_SIZE boolean mask."""
+    img = Image.open(BytesIO(data)).convert("RGB")
+    if img.size != (TILE_SIZE, TILE_SIZE):
+        img = img.resize((TILE_SIZE, TILE_SIZE), Image.NEAREST)
+    return get_classifier().green_mask(np.asarray(img, dtype=np.uint8))
+
+
+def build_mosaic(bbox, zoom, mapbox_token, path=GREEN_MOSAIC_PATH, progress=None):
+    """
+    Classify every tile covering bbox (min_lon, min_lat, max_lon, max_lat)
+    at `zoom` and write the integral image of the green mask to `path`.
+    The mosaic is built one row of tiles at a time next to `path` and only
+    replaces the previous mosaic once complete, so readers never see a
+    partial build. progress: optional callback with (tile rows done, total).
+    Raises MosaicBuildError if any tile failed; tiles that did succeed stay
+    in the tile store, so running the build again is cheap.
+    """
+    tiles = tiles_for_bbox(bbox, zoom)
+    x0, y0 = min(x for x, _ in tiles), min(y for _, y in tiles)
+    x1, y1 = max(x for x, _ in tiles), max(y for _, y in tiles)
+    tiles_x, tiles_y = x1 - x0 + 1, y1 - y0 + 1
+    rows, cols = tiles_y * TILE_SIZE, tiles_x * TILE_SIZE
+    if rows * cols > MAX_MOSAIC_PIXELS:
+        raise ValueError(f"{tiles_x}x{tiles_y} tiles is too large for one mosaic")
+
+    building = f"{path}.building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    integral = np.lib.format.open_memmap(
+        os.path.join(building, INTEGRAL_FILE), mode="w+", dtype=np.uint32,
+        shape=(rows + 1, cols + 1),
+    )
+    integral[0] = 0
+    integral[:, 0] = 0
+
+    def fetch(tile):
+        return fetch_tile(tile[0], tile[1], zoom, mapbox_token)
+
+    failed = {}
+    strip = np.empty((TILE_SIZE, cols), dtype=bool)
+    sums = np.empty((TILE_SIZE, cols), dtype=np.uint32)
+    above = np.zeros(cols, dtype=np.uint32)
+    for ty in range(tiles_y):
+        strip[:] = False
+        for (x, y), data, error in iter_fetch([(x0 + tx, y0 + ty) for tx in range(tiles_x)], fetch):
+            if error is None:
+                try:
+                    col = (x - x0) * TILE_SIZE
+                    strip[:, col:col + TILE_SIZE] = tile_green_mask(data)
+                    continue
+                except Exception as e:
+                    error = f"decode error: {e}"
+            failed[(x, y)] = error
+
+        # Row prefix sums, then running down the strip on top of the rows above
+        np.cumsum(strip, axis=1, dtype=np.uint32, out=sums)
+        np.cumsum(sums, axis=0, out=sums)
+        sums += above
+        row = ty * TILE_SIZE
+        integral[row + 1:row + TILE_SIZE + 1, 1:] = sums
+        above[:] = sums[-1]
+        if progress:
+            progress(ty + 1, tiles_y)
+
+    integral.flush()
+    del integral
+    if failed:
+        shutil.rmtree(building, ignore_errors=True)
+        sample = ", ".join(f"{x},{y}: {error}" for (x, y), error in list(failed.items())[:5])
+        raise MosaicBuildError(f"{len(failed)} of {len(tiles)} tiles failed ({sample})")
+
+    west, _, _, north = tile_bounds(x0, y0, zoom)
+    _, south, east, _ = tile_bounds(x1, y1, zoom)
+    metadata = {
+        "zoom": zoom,
+        "x0": x0,
+        "y0": y0,
+        "tiles_x": tiles_x,
+        "tiles_y": tiles_y,
+        "style": TILE_STYLE,
+        "classifier_version": CLASSIFIER_VERSION,
+        "bounds": [west, south, east, north],
+        "green_pixels": int(above[-1]),
+        "built_at": time.time(),
+    }
+    with open(os.path.join(building, METADATA_FILE), "w") as f:
+        json.dump(metadata, f)
+
+    previous = f"{path}.previous"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, previous)
+    os.rename(building, path)
+    shutil.rmtree(previous, ignore_errors=True)
+    return metadata
+
+
+# -------------------------------
+# Queries
+# -------------------------------
+
+def lonlat_to_pixels(coords, zoom):
+    """Vectorized lonlat_to_pixel for an (N, 2) array of lon/lat pairs."""
+    coords = np.asarray(coords, dtype=np.float64)
+    n = 2.0 ** zoom * TILE_SIZE
+    lat = np.radians(coords[:, 1])
+    px = (coords[:, 0] + 180.0) / 360.0 * n
+    py = (1.0 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2.0 * n
+    return px, py
+
+
+def polygon_rings(geom):
+    """Exterior and interior rings of a shapely (Multi)Polygon."""
+    polygons = getattr(geom, "geoms", [geom])
+    for polygon in polygons:
+        if polygon.is_empty:
+            continue
+        yield polygon.exterior
+        yield from polygon.interiors
+
+
+class GreenMosaic:
+    """Read-only view of a mosaic built by build_mosaic."""
+
+    def __init__(self, path=GREEN_MOSAIC_PATH):
+        with open(os.path.join(path, METADATA_FILE)) as f:
+            self.metadata = json.load(f)
+        self.integral = np.load(os.path.join(path, INTEGRAL_FILE), mmap_mode="r")
+        self.zoom = self.metadata["zoom"]
+        self.x0, self.y0 = self.metadata["x0"], self.metadata["y0"]
+        self.tiles_x, self.tiles_y = self.metadata["tiles_x"], self.metadata["tiles_y"]
+        self.rows, self.cols = self.tiles_y * TILE_SIZE, self.tiles_x * TILE_SIZE
+
+    def count(self, row_min, row_max, col_min, col_max):
+        """Green pixels in mosaic rows [row_min, row_max) and columns [col_min, col_max)."""
+        S = self.integral
+        return int(S[row_max, col_max]) - int(S[row_min, col_max]) \
+            - int(S[row_max, col_min]) + int(S[row_min, col_min])
+
+    def covers(self, bbox):
+        """Whether every tile under bbox (min_lon, min_lat, max_lon, max_lat) is in the mosaic."""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        x_min, y_max = deg2num(min_lat, min_lon, self.zoom)
+        x_max, y_min = deg2num(max_lat, max_lon, self.zoom)
+        return (
+            self.x0 <= x_min and x_max < self.x0 + self.tiles_x
+            and self.y0 <= y_min and y_max < self.y0 + self.tiles_y
+        )
+
+    def bbox_cover(self, bbox):
+        """
+        Green cover of every tile under bbox, as compute_green_cover reports
+        it, or None when the bbox isn't covered by the mosaic.
+        """
+        if not self.covers(bbox):
+            return None
+        tiles = tiles_for_bbox(bbox, self.zoom)
+        x_min, y_min = min(x for x, _ in tiles), min(y for _, y in tiles)
+        x_max, y_max = max(x for x, _ in tiles), max(y for _, y in tiles)
+        green = self.count(
+            (y_min - self.y0) * TILE_SIZE, (y_max - self.y0 + 1) * TILE_SIZE,
+            (x_min - self.x0) * TILE_SIZE, (x_max - self.x0 + 1) * TILE_SIZE,
+        )
+        return self._result(green, len(tiles) * TILE_SIZE * TILE_SIZE, len(tiles))
+
+    def spans(self, geom):
+        """
+        Scanline the pixel centres inside a shapely (Multi)Polygon.
+        Returns arrays (rows, starts, ends): pixels [start, end) of each row.
+        """
+        xs, ys = [], []
+        for ring in polygon_rings(geom):
+            px, py = lonlat_to_pixels(ring.coords, self.zoom)
+            xs.append(px - self.x0 * TILE_SIZE)
+            ys.append(py - self.y0 * TILE_SIZE)
+        if not xs:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        # Ring edges, each crossing the centres of rows [first, last)
+        ax = np.concatenate([x[:-1] for x in xs])
+        ay = np.concatenate([y[:-1] for y in ys])
+        bx = np.concatenate([x[1:] for x in xs])
+        by = np.concatenate([y[1:] for y in ys])
+        first = np.ceil(np.minimum(ay, by) - 0.5).astype(np.int64)
+        last = np.ceil(np.maximum(ay, by) - 0.5).astype(np.int64)
+        first = np.clip(first, 0, self.rows)
+        last = np.clip(last, 0, self.rows)
+        crossings = np.maximum(last - first, 0)
+
+        # One (row, x) intersection per edge and row it crosses
+        edge = np.repeat(np.arange(len(first)), crossings)
+        offsets = np.arange(len(edge)) - np.repeat(np.cumsum(crossings) - crossings, crossings)
+        rows = first[edge] + offsets
+        t = (rows + 0.5 - ay[edge]) / (by[edge] - ay[edge])
+        x = ax[edge] + t * (bx[edge] - ax[edge])
+
+        # Even-odd rule: sorted crossings of a row pair up into spans
+        order = np.lexsort((x, rows))
+        rows, x = rows[order][::2], x[order]
+        starts = np.clip(np.ceil(x[::2] - 0.5), 0, self.cols).astype(np.int64)
+        ends = np.clip(np.ceil(x[1::2] - 0.5), 0, self.cols).astype(np.int64)
+        keep = ends > starts
+        return rows[keep], starts[keep], ends[keep]
+
+    def geometry_cover(self, geom):
+        """
+        Green cover of the pixels whose centres lie inside a shapely
+        (Multi)Polygon, or None when it isn't covered by the mosaic.
+        """
+        if not self.covers(geom.bounds):
+            return None
+        rows, starts, ends = self.spans(geom)
+        S = self.integral
+        green = (
+            S[rows + 1, ends].astype(np.int64) - S[rows, ends]
+            - S[rows + 1, starts] + S[rows, starts]
+        ).sum()
+
+        # Tiles touched by a span, marked as column ranges per tile row
+        touched = np.zeros((self.tiles_y, self.tiles_x + 1), dtype=np.int32)
+        np.add.at(touched, (rows // TILE_SIZE, starts // TILE_SIZE), 1)
+        np.add.at(touched, (rows // TILE_SIZE, (ends - 1) // TILE_SIZE + 1), -1)
+        tiles = int(np.count_nonzero(np.cumsum(touched, axis=1)[:, :-1]))
+        return self._result(int(green), int((ends - starts).sum()), tiles)
+
+    @staticmethod
+    def _result(green, total, tiles):
+        return {
+            "green_cover": round((green / total) * 100, 2) if total else 0.0,
+            "green_pixels": green,
+            "total_pixels": total,
+            "tiles_total": tiles,
+            "failed_tiles": [],
+        }
+
+
+_mosaic = None
+_mosaic_stamp = None
+_mosaic_lock = threading.Lock()
+
+
+def get_green_mosaic(zoom):
+    """
+    Return the mosaic at GREEN_MOSAIC_PATH if it was built at `zoom` with
+    the current classifier, else None. A rebuilt mosaic is picked up on the
+    next call.
+    """
+    global _mosaic, _mosaic_stamp
+    try:
+        stamp = os.stat(os.path.join(GREEN_MOSAIC_PATH, METADATA_FILE)).st_mtime_ns
+    except OSError:
+        return None
+    with _mosaic_lock:
+        if stamp != _mosaic_stamp:
+            try:
+                _mosaic = GreenMosaic(GREEN_MOSAIC_PATH)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Could not open green mosaic: {e}")
+                _mosaic = None
+            _mosaic_stamp = stamp
+        mosaic = _mosaic
+    if mosaic is None:
+        return None
+    metadata = mosaic.metadata
+    if (metadata["zoom"], metadata["style"], metadata["classifier_version"]) != \
+            (zoom, TILE_STYLE, CLASSIFIER_VERSION):
+        return None
+    return mosaic
+
+
+# -------------------------------
+# Command line
+# -------------------------------
+
+def city_bbox():
+    """Bounding box of every cached sector boundary."""
+    from shapely.geometry import shape
+    from osm_utils import load_sector_boundaries
+
+    bounds = []
+    for collection in load_sector_boundaries()["sectors"].values():
+        for feature in (collection or {}).get("features", []):
+            bounds.append(shape(feature["geometry"]).bounds)
+    if not bounds:
+        raise MosaicBuildError("No sector boundaries available to size the mosaic")
+    return (
+        min(b[0] for b in bounds), min(b[1] for b in bounds),
+        max(b[2] for b in bounds), max(b[3] for b in bounds),
+    )
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bbox", type=float, nargs=4,
+                        metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"),
+                        help="area to cover (default: every sector boundary)")
+    parser.add_argument("--zoom", type=int, default=17)
+    parser.add_argument("--path", default=GREEN_MOSAIC_PATH)
+    args = parser.parse_args()
+
+    bbox = tuple(args.bbox) if args.bbox else city_bbox()
+    started = time.perf_counter()
+
+    def progress(done, total):
+        print(f"\r{done}/{total} tile rows", end="", flush=True)
+
+    metadata = build_mosaic(bbox, args.zoom, os.getenv("MAPBOX_TOKEN"), args.path, progress)
+    print(
+        f"\nBuilt {metadata['tiles_x']}x{metadata['tiles_y']} tile mosaic at zoom "
+        f"{metadata['zoom']} in {time.perf_counter() - started:.1f}s -> {args.path}"
+    )
+
+
+if __name__ == "__main__":
+    main()
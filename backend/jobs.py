@@ -0,0 +1,279 @@
+import concurrent.futures
+import json
+import os
+import threading
+import time
+import uuid
+
+from tile_store import SQLiteStore
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+JOB_STORE_PATH = os.getenv(
+    "JOB_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "jobs.sqlite"),
+)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Jobs waiting for a free worker, per process, before new ones are refused
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", 16))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", 3600))  # seconds
+# Progress is written (and cancellation checked) at most this often
+JOB_PROGRESS_INTERVAL = 1.0
+# Unfinished jobs are kept alive by their worker; a job whose heartbeat is
+# older than JOB_LOST_AFTER belongs to a worker that went away.
+JOB_HEARTBEAT_INTERVAL = 30
+JOB_LOST_AFTER = 4 * JOB_HEARTBEAT_INTERVAL
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+"""
+
+
+class JobQueueFull(Exception):
+    """Raised when this worker already has JOB_QUEUE_LIMIT jobs waiting."""
+
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a running job once it has been cancelled. Like
+    KeyboardInterrupt it is not an Exception, so error handling in the
+    computation doesn't mistake it for a failed sector or tile.
+    """
+
+
+class JobStore(SQLiteStore):
+    """Job state, progress and results, shared by every worker process through SQLite."""
+
+    schema = SCHEMA
+
+    def create(self, job_type, params):
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        conn.execute(
+            "DELETE FROM jobs WHERE finished_at < ?", (now - JOB_RESULT_TTL,)
+        )
+        conn.execute(
+            "INSERT INTO jobs (id, type, params, status, created_at, heartbeat_at) "
+            "VALUES (?, ?, ?, 'queued', ?, ?)",
+            (job_id, job_type, json.dumps(params), now, now),
+        )
+        return job_id
+
+    def get(self, job_id):
+        """Return the job as a dict without its result, or None if unknown."""
+        row = self._connect().execute(
+            "SELECT id, type, params, status, progress, error, created_at, started_at, "
+            "finished_at, heartbeat_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, job_type, params, status, progress, error, created, started, finished, heartbeat = row
+        if status not in FINISHED and time.time() - heartbeat > JOB_LOST_AFTER:
+            status, error = "failed", "The worker running this job went away"
+        return {
+            "job_id": job_id,
+            "type": job_type,
+            "params": json.loads(params),
+            "status": status,
+            "progress": json.loads(progress),
+            "error": error,
+            "created_at": created,
+            "started_at": started,
+            "finished_at": finished,
+        }
+
+    def result(self, job_id):
+        row = self._connect().execute(
+            "SELECT result FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def start(self, job_id):
+        """Mark a queued job as running. Returns False if it was cancelled meanwhile."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ? "
+            "WHERE id = ? AND status = 'queued' AND cancel_requested = 0",
+            (now, now, job_id),
+        )
+        return cursor.rowcount == 1
+
+    def report(self, job_id, progress):
+        """Store progress and return True if the job has been asked to cancel."""
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ?",
+            (json.dumps(progress), time.time(), job_id),
+        )
+        row = conn.execute(
+            "SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return bool(row and row[0])
+
+    def finish(self, job_id, status, progress, result=None, error=None):
+        now = time.time()
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, progress = ?, result = ?, error = ?, "
+            "finished_at = ?, heartbeat_at = ? WHERE id = ?",
+            (
+                status, json.dumps(progress),
+                json.dumps(result) if result is not None else None,
+                error, now, now, job_id,
+            ),
+        )
+
+    def cancel(self, job_id):
+        """
+        Ask a job to stop. Queued jobs are cancelled right away; running
+        jobs stop at their next progress report.
+        """
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status NOT IN (?, ?, ?)",
+            (job_id,) + FINISHED,
+        )
+        conn.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (now, job_id),
+        )
+
+    def heartbeat(self, job_ids):
+        now = time.time()
+        self._connect().executemany(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ?", [(now, job_id) for job_id in job_ids]
+        )
+
+
+class JobContext:
+    """
+    Handed to a running job to report progress. Every report also checks
+    for cancellation and raises JobCancelled once it has been requested.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.progress = {}
+        self._written_at = 0.0
+
+    def report(self, force=False, **progress):
+        self.progress.update(progress)
+        now = time.time()
+        if not force and now - self._written_at < JOB_PROGRESS_INTERVAL:
+            return
+        self._written_at = now
+        if self.store.report(self.job_id, self.progress):
+            raise JobCancelled()
+
+    def tiles(self, done, total):
+        """Tile progress callback for compute_tile_counts."""
+        self.report(tiles_done=done, tiles_total=total, force=done == total)
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded pool of threads in this worker process. Job
+    state lives in the JobStore, so any worker can report on or cancel a
+    job wherever it runs.
+    """
+
+    def __init__(self, store, workers=JOB_WORKERS, queue_limit=JOB_QUEUE_LIMIT):
+        self.store = store
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = None
+        self._active = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _start(self):
+        # Threads don't survive a fork, so each worker process gets its own pool
+        if self._executor is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._active = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="job"
+        )
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+
+    def submit(self, job_type, params, run):
+        """
+        Queue run(params, context) as a new job and return its id. The
+        return value of run is stored as the job's result.
+        Raises JobQueueFull if too many jobs are already waiting.
+        """
+        with self._lock:
+            self._start()
+            if len(self._active) >= self.workers + self.queue_limit:
+                raise JobQueueFull(f"{len(self._active)} jobs already queued or running")
+            job_id = self.store.create(job_type, params)
+            self._active[job_id] = self._executor.submit(self._run, job_id, params, run)
+        return job_id
+
+    def cancel(self, job_id):
+        self.store.cancel(job_id)
+        with self._lock:
+            future = self._active.get(job_id)
+        # Frees the queue slot at once if the job hadn't started yet
+        if future is not None and future.cancel():
+            self._done(job_id)
+
+    def _run(self, job_id, params, run):
+        context = JobContext(self.store, job_id)
+        try:
+            if not self.store.start(job_id):
+                return
+            try:
+                result = run(params, context)
+            except JobCancelled:
+                self.store.finish(job_id, "cancelled", context.progress)
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                self.store.finish(job_id, "failed", context.progress, error=str(e) or type(e).__name__)
+            else:
+                self.store.finish(job_id, "succeeded", context.progress, result=result)
+        finally:
+            self._done(job_id)
+
+    def _done(self, job_id):
+        with self._lock:
+            self._active.pop(job_id, None)
+
+    def _heartbeat(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(JOB_HEARTBEAT_INTERVAL)
+            with self._lock:
+                job_ids = list(self._active)
+            try:
+                self.store.heartbeat(job_ids)
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+
+    def stats(self):
+        with self._lock:
+            active = len(self._active)
+        return {"active": active, "workers": self.workers, "queue_limit": self.queue_limit}
@@ -0,0 +1,293 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# -------------------------------
+# Configuration
+# -------------------------------
+# Counters and latency histograms of the pipeline stages, rendered in the
+# Prometheus text format by /metrics. Recording is an in-memory update under
+# a lock. Each worker process writes its totals to METRICS_PATH every
+# METRICS_FLUSH_INTERVAL seconds, so any worker can answer a scrape for all
+# of them. Tile classifier processes send theirs back with every batch.
+
+METRICS_PATH = os.getenv(
+    "METRICS_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "metrics.sqlite"),
+)
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 15))
+# Totals of a process that stopped flushing are dropped after this long
+METRICS_PROCESS_TTL = 24 * 3600
+
+# Seconds; spans a decoded tile (~1 ms) to a cold city (minutes)
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300,
+)
+
+METRICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS process_metrics (
+    process TEXT PRIMARY KEY,
+    samples TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# -------------------------------
+# Registry
+# -------------------------------
+
+_definitions = {}  # name -> Counter or Histogram
+_values = {}  # (name, labels) -> float, or [bucket counts..., sum] for histograms
+_lock = threading.Lock()
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Counter:
+    """A monotonically increasing total, per combination of labels."""
+
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        _definitions[name] = self
+
+    def inc(self, amount=1, **labels):
+        key = (self.name, _labels(labels))
+        with _lock:
+            _values[key] = _values.get(key, 0) + amount
+        _maybe_start_flusher()
+
+
+class Histogram:
+    """Observations counted into fixed buckets, per combination of labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        _definitions[name] = self
+
+    def observe(self, value, **labels):
+        key = (self.name, _labels(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            counts = _values.get(key)
+            if counts is None:
+                counts = _values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+        _maybe_start_flusher()
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in a with block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+STAGE_SECONDS = Histogram(
+    "greencover_stage_seconds",
+    "Time spent in each pipeline stage "
+    "(boundaries, tile_fetch, decode, histogram, classify, sector, sectors)",
+)
+TILE_FETCHES = Counter(
+    "greencover_tile_fetches_total",
+    "Tile images obtained, by source (store, downloaded, revalidated, stale, failed)",
+)
+TILE_RESULTS = Counter(
+    "greencover_tile_results_total",
+    "Tiles asked for, by outcome (cached, reused, classified, failed)",
+)
+UPSTREAM_SECONDS = Histogram(
+    "greencover_upstream_request_seconds", "Latency of requests to upstream hosts",
+)
+UPSTREAM_RESPONSES = Counter(
+    "greencover_upstream_responses_total", "Responses from upstream hosts, by HTTP status",
+)
+UPSTREAM_ERRORS = Counter(
+    "greencover_upstream_errors_total", "Upstream requests that got no response",
+)
+UPSTREAM_BYTES = Counter(
+    "greencover_upstream_bytes_total", "Response body bytes received from upstream hosts",
+)
+CACHE_EVENTS = Counter(
+    "greencover_cache_events_total", "Hits, misses and writes of the SQLite caches",
+)
+
+
+def take():
+    """Return this process's samples and start again from zero."""
+    global _values
+    with _lock:
+        values, _values = _values, {}
+    return values
+
+
+def merge(values, into=None):
+    """Add samples (as returned by take) to this process's, or to `into`."""
+    target = _values if into is None else into
+    with _lock:
+        for key, value in values.items():
+            current = target.get(key)
+            if current is None:
+                target[key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                for i, v in enumerate(value):
+                    current[i] += v
+            else:
+                target[key] = current + value
+    return target
+
+
+def snapshot():
+    with _lock:
+        return {key: list(value) if isinstance(value, list) else value
+                for key, value in _values.items()}
+
+
+# -------------------------------
+# Sharing between worker processes
+# -------------------------------
+
+_store = None
+_store_lock = threading.Lock()
+_flusher_pid = None
+_process_id = None
+_shared = False
+
+
+def _encode(values):
+    return json.dumps([[name, labels, value] for (name, labels), value in values.items()])
+
+
+def _decode(samples):
+    return {(name, tuple(tuple(label) for label in labels)): value
+            for name, labels, value in json.loads(samples)}
+
+
+def get_metrics_store():
+    """Return the process-wide metrics store, or None when METRICS_PATH is empty."""
+    global _store
+    if not METRICS_PATH:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                from tile_store import SQLiteStore
+
+                class MetricsStore(SQLiteStore):
+                    schema = METRICS_SCHEMA
+
+                _store = MetricsStore(METRICS_PATH)
+    return _store
+
+
+def share_metrics():
+    """Flush this worker's totals to METRICS_PATH in the background (web workers only)."""
+    global _shared
+    _shared = True
+    _maybe_start_flusher()
+
+
+def _maybe_start_flusher():
+    global _flusher_pid, _process_id
+    # Threads don't survive a fork, so every worker process starts its own
+    if not _shared or _flusher_pid == os.getpid() or not METRICS_PATH:
+        return
+    with _store_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        _process_id = f"{os.getpid()}:{time.time():.0f}"
+    threading.Thread(target=_flush_forever, name="metrics-flush", daemon=True).start()
+
+
+def flush():
+    """Write this process's totals to the metrics store."""
+    store = get_metrics_store()
+    if store is None or _process_id is None:
+        return
+    now = time.time()
+    conn = store._connect()
+    conn.execute(
+        "INSERT OR REPLACE INTO process_metrics (process, samples, updated_at) VALUES (?, ?, ?)",
+        (_process_id, _encode(snapshot()), now),
+    )
+    conn.execute("DELETE FROM process_metrics WHERE updated_at < ?", (now - METRICS_PROCESS_TTL,))
+
+
+def _flush_forever():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"⚠️ Could not flush metrics: {e}")
+
+
+def collect():
+    """Samples of every worker process when shared, else of this process."""
+    store = get_metrics_store() if _shared else None
+    if store is None:
+        return snapshot()
+    flush()
+    total = {}
+    for (samples,) in store._connect().execute("SELECT samples FROM process_metrics"):
+        merge(_decode(samples), total)
+    return total
+
+
+# -------------------------------
+# Text exposition
+# -------------------------------
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(values=None):
+    """Samples in the Prometheus text exposition format (version 0.0.4)."""
+    values = collect() if values is None else values
+    by_name = {}
+    for (name, labels), value in values.items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, metric in _definitions.items():
+        lines.append(f"# HELP {name} {metric.help}")
+        lines.append(f"# TYPE {name} {metric.kind}")
+        for labels, value in sorted(by_name.get(name, [])):
+            if metric.kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ("+Inf",), value[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_number(bound)
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,499 @@
+import copy
+import json
+import os
+import re
+import threading
+import time
+
+import geojson
+
+from metrics import STAGE_SECONDS
+from rate_governor import governed_get
+from single_flight import SingleFlight
+
+OVERPASS_URL = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+
+# Sector boundaries almost never change, so they are kept on disk and only
+# re-downloaded after BOUNDARY_CACHE_TTL. Bump the version whenever the
+# stored format or the way features are assembled changes.
+BOUNDARY_CACHE_VERSION = 3
+BOUNDARY_CACHE_PATH = os.getenv(
+    "BOUNDARY_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "boundaries.json"),
+)
+BOUNDARY_CACHE_TTL = int(os.getenv("BOUNDARY_CACHE_TTL", 30 * 24 * 3600))  # seconds
+# After a failed bulk download, boundaries aren't downloaded again for this long
+BOUNDARY_RETRY_INTERVAL = int(os.getenv("BOUNDARY_RETRY_INTERVAL", 300))  # seconds
+
+# List of all Chandigarh sectors
+CHANDIGARH_SECTORS = [
+    "Sector 1", "Sector 2", "Sector 3", "Sector 4", "Sector 5", "Sector 6",
+    "Sector 7", "Sector 8", "Sector 9", "Sector 10", "Sector 11", "Sector 12",
+    "Sector 13", "Sector 14", "Sector 15", "Sector 16", "Sector 17", "Sector 18",
+    "Sector 19", "Sector 20", "Sector 21", "Sector 22", "Sector 23", "Sector 24",
+    "Sector 25", "Sector 26", "Sector 27", "Sector 28", "Sector 29", "Sector 30",
+    "Sector 31", "Sector 32", "Sector 33", "Sector 34", "Sector 35", "Sector 36",
+    "Sector 37", "Sector 38", "Sector 39", "Sector 40", "Sector 41", "Sector 42",
+    "Sector 43", "Sector 44", "Sector 45", "Sector 46", "Sector 47", "Sector 48",
+    "Sector 49", "Sector 50", "Sector 51", "Sector 52", "Sector 53", "Sector 54",
+    "Sector 55", "Sector 56"
+]
+
+def query_sector_geojson(sector_name):
+    """Query Overpass for a single sector's GeoJSON"""
+    # Convert sector name format for Overpass query (space to dot)
+    query_sector_name = sector_name.replace(" ", ".")
+    
+    # Use your working query pattern but with geometry output
+    query = f"""
+    [out:json][timeout:25];
+    area["name"="Chandigarh"]->.searchArea;
+    (
+      relation["boundary"="administrative"]["name"~"{query_sector_name}"](area.searchArea);
+    );
+    (._;>;);
+    out geom;
+    """
+    
+    try:
+        print(f"Querying for {sector_name} (using {query_sector_name})")
+        response = governed_get(OVERPASS_URL, params={'data': query}, timeout=30)
+        
+        if response.status_code != 200:
+            print(f"Overpass API error: {response.status_code}")
+            return None
+            
+        data = response.json()
+        elements = data.get("elements", [])
+        print(f"Found {len(elements)} elements for {sector_name}")
+        
+        if not elements:
+            print(f"No elements found for {query_sector_name}")
+            return None
+            
+        # Process the response
+        geojson_result = process_overpass_response(elements, sector_name)
+        return geojson_result
+            
+    except Exception as e:
+        print(f"Error fetching sector data for {sector_name}: {e}")
+        return None
+
+def sector_key(name):
+    """Normalize an OSM name like "Sector-17" or "sector 17" to "Sector 17"."""
+    match = re.search(r"sector\W*(\d+)\b", name or "", re.IGNORECASE)
+    return f"Sector {int(match.group(1))}" if match else None
+
+def index_elements(elements):
+    """Separate Overpass elements into ways and nodes by id, plus a list of relations"""
+    ways = {}
+    nodes = {}
+    relations = []
+    
+    for element in elements:
+        if element["type"] == "node":
+            nodes[element["id"]] = (element["lon"], element["lat"])
+        elif element["type"] == "way":
+            ways[element["id"]] = element
+        elif element["type"] == "relation":
+            relations.append(element)
+    
+    return ways, nodes, relations
+
+def relation_feature_collection(relations, ways, nodes, sector_name):
+    """Build a FeatureCollection from the first relation that yields a polygon"""
+    for relation in relations:
+        polygon = build_polygon_from_relation(relation, ways, nodes)
+        if polygon:
+            return geojson.FeatureCollection([
+                geojson.Feature(
+                    geometry=polygon,
+                    properties={
+                        "name": sector_name,
+                        "source": "relation",
+                        "id": relation["id"]
+                    }
+                )
+            ])
+    return None
+
+def process_overpass_response(elements, sector_name):
+    """Process Overpass API response into GeoJSON"""
+    
+    ways, nodes, relations = index_elements(elements)
+    
+    print(f"Found: {len(nodes)} nodes, {len(ways)} ways, {len(relations)} relations")
+    
+    # The name regex also matches e.g. "Sector 10" when asking for "Sector 1",
+    # so try relations whose name is exactly this sector first
+    relations.sort(key=lambda r: sector_key(r.get("tags", {}).get("name")) != sector_name)
+    
+    # First try to process relations
+    result = relation_feature_collection(relations, ways, nodes, sector_name)
+    if result:
+        return result
+    
+    # If no relation worked, try individual ways
+    for way_id, way in ways.items():
+        if "geometry" in way:
+            coords = [(p["lon"], p["lat"]) for p in way["geometry"]]
+            if len(coords) >= 4:
+                try:
+                    # Ensure closed polygon
+                    if coords[0] != coords[-1]:
+                        coords.append(coords[0])
+                    
+                    polygon = geojson.Polygon([coords])
+                    return geojson.FeatureCollection([
+                        geojson.Feature(
+                            geometry=polygon,
+                            properties={
+                                "name": sector_name,
+                                "source": "way",
+                                "id": way_id
+                            }
+                        )
+                    ])
+                except Exception as e:
+                    print(f"Error creating polygon from way: {e}")
+                    continue
+    
+    return None
+
+def split_overpass_response(elements, sector_names):
+    """
+    Split a bulk Overpass response covering many sectors into
+    {sector_name: FeatureCollection}. Sectors without a usable relation
+    are left out.
+    """
+    ways, nodes, relations = index_elements(elements)
+    print(f"Found: {len(nodes)} nodes, {len(ways)} ways, {len(relations)} relations")
+
+    by_sector = {}
+    for relation in relations:
+        key = sector_key(relation.get("tags", {}).get("name"))
+        if key in sector_names:
+            by_sector.setdefault(key, []).append(relation)
+
+    result = {}
+    for sector_name, sector_relations in by_sector.items():
+        collection = relation_feature_collection(sector_relations, ways, nodes, sector_name)
+        if collection:
+            result[sector_name] = collection
+    return result
+
+def query_all_sector_geojson(sector_names=CHANDIGARH_SECTORS):
+    """Fetch every sector boundary with a single Overpass query"""
+    query = """
+    [out:json][timeout:120];
+    area["name"="Chandigarh"]->.searchArea;
+    (
+      relation["boundary"="administrative"]["name"~"sector", i](area.searchArea);
+    );
+    (._;>;);
+    out geom;
+    """
+    
+    try:
+        print(f"Querying boundaries for {len(sector_names)} sectors in one request")
+        response = governed_get(OVERPASS_URL, params={'data': query}, timeout=180)
+        
+        if response.status_code != 200:
+            print(f"Overpass API error: {response.status_code}")
+            return None
+        
+        elements = response.json().get("elements", [])
+        return split_overpass_response(elements, set(sector_names))
+    
+    except Exception as e:
+        print(f"Error fetching bulk sector data: {e}")
+        return None
+
+# -------------------------------
+# Boundary cache
+# -------------------------------
+
+_boundaries = None
+_refresh_failed_at = 0.0
+_boundaries_lock = threading.Lock()
+_boundary_flight = SingleFlight()
+
+def _read_boundary_file():
+    try:
+        with open(BOUNDARY_CACHE_PATH) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != BOUNDARY_CACHE_VERSION:
+        return None
+    return data
+
+def _write_boundary_file(data):
+    directory = os.path.dirname(BOUNDARY_CACHE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write then rename, so other workers never read a half-written file
+    tmp_path = f"{BOUNDARY_CACHE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, BOUNDARY_CACHE_PATH)
+
+def load_sector_boundaries(force_refresh=False):
+    """
+    Return the boundary cache {"fetched_at": ..., "sectors": {name: FeatureCollection}}.
+    Loaded from memory, then from BOUNDARY_CACHE_PATH, and re-downloaded with
+    one bulk query when missing or older than BOUNDARY_CACHE_TTL. If the
+    refresh fails, stale (or no) boundaries are used and the download isn't
+    tried again for BOUNDARY_RETRY_INTERVAL. The returned dict is replaced
+    rather than changed when sectors are added, so treat it as read-only.
+    """
+    global _boundaries
+    with _boundaries_lock:
+        if _boundaries is None and not force_refresh:
+            _boundaries = _read_boundary_file()
+        data = _boundaries
+
+        expired = data is None or time.time() - data["fetched_at"] > BOUNDARY_CACHE_TTL
+        backing_off = time.time() - _refresh_failed_at < BOUNDARY_RETRY_INTERVAL
+        if not force_refresh and not (expired and not backing_off):
+            if data is None:
+                data = _boundaries = _empty_boundaries()
+            return data
+
+    # The download takes minutes when Overpass is slow, so it runs outside
+    # the lock, once for all the callers that need it
+    return _boundary_flight.do("boundaries", _refresh_boundaries)
+
+def _empty_boundaries():
+    return {"version": BOUNDARY_CACHE_VERSION, "fetched_at": 0, "sectors": {}}
+
+def _refresh_boundaries():
+    global _boundaries, _refresh_failed_at
+    sectors = query_all_sector_geojson()
+    with _boundaries_lock:
+        data = _boundaries
+        if sectors is None:
+            _refresh_failed_at = time.time()
+            print(f"⚠️ Sector boundaries not downloaded, retrying in {BOUNDARY_RETRY_INTERVAL}s")
+            if data is None:
+                data = _empty_boundaries()
+        else:
+            _refresh_failed_at = 0.0
+            # Keep sectors that were only found by an individual lookup
+            previous = data["sectors"] if data else {}
+            data = {
+                "version": BOUNDARY_CACHE_VERSION,
+                "fetched_at": time.time(),
+                "sectors": {**previous, **sectors},
+            }
+            _write_boundary_file(data)
+
+        _boundaries = data
+        return data
+
+def seed_boundaries(data):
+    """
+    Use boundaries from a snapshot when there is no boundary cache yet.
+    Returns True if they were used.
+    """
+    global _boundaries
+    if data.get("version") != BOUNDARY_CACHE_VERSION:
+        return False
+    with _boundaries_lock:
+        if _boundaries is not None or _read_boundary_file() is not None:
+            return False
+        _write_boundary_file(data)
+        _boundaries = data
+        return True
+
+def _remember_sector(sector_name, collection):
+    global _boundaries
+    with _boundaries_lock:
+        if _boundaries is None:
+            return
+        # Copy on write: callers iterate the dict they got without the lock
+        _boundaries = dict(_boundaries, sectors={**_boundaries["sectors"], sector_name: collection})
+        if _boundaries["fetched_at"]:
+            _write_boundary_file(_boundaries)
+
+def fetch_sector_geojson(sector_name):
+    """Fetch GeoJSON data for a specific sector, from the boundary cache when possible"""
+    with STAGE_SECONDS.time(stage="boundaries"):
+        collection = load_sector_boundaries()["sectors"].get(sector_name)
+        if collection is not None:
+            # Callers annotate feature properties, so don't hand out the cached copy
+            return copy.deepcopy(collection)
+
+        # Not part of the bulk result: fall back to a per-sector query
+        collection = query_sector_geojson(sector_name)
+        if collection is not None and sector_name in CHANDIGARH_SECTORS:
+            _remember_sector(sector_name, copy.deepcopy(collection))
+        return collection
+
+def clear_boundary_cache():
+    """Forget cached boundaries so the next lookup downloads them again"""
+    global _boundaries, _refresh_failed_at
+    with _boundaries_lock:
+        _boundaries = None
+        _refresh_failed_at = 0.0
+        try:
+            os.remove(BOUNDARY_CACHE_PATH)
+        except OSError:
+            pass
+
+def build_polygon_from_relation(relation, ways, nodes):
+    """
+    Build a Polygon, or a MultiPolygon when the relation has several outer
+    rings, from a relation's members. Each inner ring becomes a hole of the
+    smallest outer ring that contains it.
+    """
+    # shapely is only needed when boundaries are downloaded, keep it out of startup
+    from shapely.geometry import Polygon
+    from shapely.prepared import prep
+
+    try:
+        outer_ways = []
+        inner_ways = []
+        
+        # Collect way IDs for outer and inner roles
+        for member in relation.get("members", []):
+            if member["type"] == "way" and member["ref"] in ways:
+                way = ways[member["ref"]]
+                
+                # Get coordinates from way geometry
+                if "geometry" in way:
+                    coords = [(p["lon"], p["lat"]) for p in way["geometry"]]
+                elif "nodes" in way:
+                    # Fallback: build coordinates from node references
+                    coords = []
+                    for node_id in way["nodes"]:
+                        if node_id in nodes:
+                            coords.append(nodes[node_id])
+                else:
+                    continue
+                
+                if len(coords) >= 2:
+                    role = member.get("role", "")
+                    if role == "outer" or role == "":
+                        outer_ways.append(coords)
+                    elif role == "inner":
+                        inner_ways.append(coords)
+        
+        outer_rings = connect_ways(outer_ways)
+        if not outer_rings:
+            return None
+        
+        # Smallest outer first, so an inner ring goes to the innermost outer
+        # that contains it (e.g. an island inside another outer's hole)
+        outers = sorted(
+            ((Polygon(ring), ring) for ring in outer_rings), key=lambda item: item[0].area
+        )
+        outers = [(prep(polygon), polygon.bounds, ring, []) for polygon, ring in outers]
+        
+        for inner_ring in connect_ways(inner_ways):
+            inner = Polygon(inner_ring)
+            point = inner.representative_point()
+            min_x, min_y, max_x, max_y = inner.bounds
+            for prepared, bounds, _, holes in outers:
+                if (bounds[0] <= min_x and bounds[1] <= min_y and max_x <= bounds[2]
+                        and max_y <= bounds[3] and prepared.contains(point)):
+                    holes.append(orient_ring(inner_ring, clockwise=True))
+                    break
+            else:
+                print(f"Dropping inner ring of relation {relation.get('id')} outside every outer ring")
+        
+        polygons = [[orient_ring(ring, clockwise=False)] + holes for _, _, ring, holes in outers]
+        if len(polygons) == 1:
+            return geojson.Polygon(polygons[0])
+        return geojson.MultiPolygon(polygons)
+            
+    except Exception as e:
+        print(f"Error building polygon from relation: {e}")
+        return None
+
+def orient_ring(ring, clockwise):
+    """Return a closed ring wound as requested (RFC 7946: outer rings counterclockwise)"""
+    # Shoelace formula: positive area means counterclockwise
+    area = sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:]))
+    if (area < 0) != clockwise:
+        return ring[::-1]
+    return ring
+
+def connect_ways(way_list):
+    """
+    Join ways into closed rings by matching their end points, and return
+    every ring. Ways are looked up through an index of their end points,
+    so the work is linear in the number of coordinates. A chain of ways
+    that doesn't close (a gap in the data) is closed straight across, as
+    relations have always been assembled; chains too short to make a ring
+    are dropped. Both are reported.
+    """
+    rings = []
+    open_ways = []
+    for coords in way_list:
+        coords = [tuple(point) for point in coords]
+        if len(coords) >= 4 and coords[0] == coords[-1]:
+            rings.append(coords)
+        elif len(coords) >= 2:
+            open_ways.append(coords)
+
+    # End point -> indexes of the unused ways starting or ending there
+    ends = {}
+    for i, coords in enumerate(open_ways):
+        ends.setdefault(coords[0], []).append(i)
+        ends.setdefault(coords[-1], []).append(i)
+    used = [False] * len(open_ways)
+
+    def take(point):
+        candidates = ends.get(point, [])
+        while candidates:
+            i = candidates.pop()
+            if not used[i]:
+                return i
+        return None
+
+    closed = dropped = 0
+    for start in range(len(open_ways)):
+        if used[start]:
+            continue
+        used[start] = True
+        ring = list(open_ways[start])
+        while ring[0] != ring[-1]:
+            i = take(ring[-1])
+            if i is None:
+                break
+            used[i] = True
+            coords = open_ways[i]
+            if coords[0] == ring[-1]:
+                ring.extend(coords[1:])
+            else:
+                ring.extend(reversed(coords[:-1]))
+        # An open chain may have started mid-way: extend it backwards as well,
+        # collecting the pieces so they are joined once
+        head = []
+        front = ring[0]
+        while front != ring[-1]:
+            i = take(front)
+            if i is None:
+                break
+            used[i] = True
+            coords = open_ways[i]
+            piece = coords[:-1] if coords[-1] == front else coords[:0:-1]
+            head.append(piece)
+            front = piece[0]
+        if head:
+            ring = [point for piece in reversed(head) for point in piece] + ring
+
+        if ring[0] != ring[-1] and len(ring) >= 3:
+            ring.append(ring[0])
+            closed += 1
+        if len(ring) >= 4:
+            rings.append(ring)
+        else:
+            dropped += 1
+
+    if closed:
+        print(f"⚠️ Closed {closed} way chains with a gap straight across")
+    if dropped:
+        print(f"⚠️ Dropped {dropped} way chains too short to form a ring")
+    return rings
@@ -0,0 +1,207 @@
+import hashlib
+import os
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from metrics import TILE_RESULTS
+from tile_fetch import iter_fetch
+from tile_store import get_rendered_tiles, get_tile_results
+from tile_utils import (
+    CLASSIFIER_VERSION, TILE_SIZE, TILE_STYLE, deg2num, fetch_tile, get_classifier,
+)
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+# Lowest zoom served. Each step down doubles the tiles per side that are
+# combined into one overlay tile: zoom 13 covers 16x16 imagery tiles.
+GREEN_OVERLAY_MIN_ZOOM = int(os.getenv("GREEN_OVERLAY_MIN_ZOOM", 13))
+OVERLAY_COLOR = (39, 174, 96)  # the map's "good" green
+OVERLAY_FORMATS = {"png": "image/png", "webp": "image/webp"}
+
+KIND = "green-overlay"
+
+
+# -------------------------------
+# Coverage rasters
+# -------------------------------
+# An overlay tile is a colour with a per-pixel alpha equal to the share of
+# green pixels under it (255 = all green). At the imagery zoom that is just
+# the classifier mask; lower zooms average 2x2 blocks of their children.
+
+def coverage_from_image(img):
+    """
+    Classify a decoded imagery tile into a TILE_SIZE x TILE_SIZE coverage
+    raster. Returns (coverage, green pixels, total pixels), the counts
+    being those analyze_tile_image gives.
+    """
+    pixels = np.asarray(img, dtype=np.uint8)
+    mask = get_classifier().green_mask(pixels).reshape(pixels.shape[:2])
+    green, total = int(np.count_nonzero(mask)), mask.size
+    coverage = np.where(mask, 255, 0).astype(np.uint8)
+    if coverage.shape != (TILE_SIZE, TILE_SIZE):
+        coverage = np.asarray(
+            Image.fromarray(coverage).resize((TILE_SIZE, TILE_SIZE), Image.BOX)
+        )
+    return coverage, green, total
+
+
+def downsample(children):
+    """Combine four child coverage rasters [[nw, ne], [sw, se]] into their parent."""
+    mosaic = np.block(children).astype(np.uint16)
+    blocks = mosaic.reshape(TILE_SIZE, 2, TILE_SIZE, 2).sum(axis=(1, 3))
+    return ((blocks + 2) // 4).astype(np.uint8)
+
+
+def encode_overlay(coverage, image_format="png"):
+    rgba = np.empty(coverage.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = OVERLAY_COLOR
+    rgba[..., 3] = coverage
+    buf = BytesIO()
+    if image_format == "webp":
+        Image.fromarray(rgba, "RGBA").save(buf, "WEBP", quality=80)
+    else:
+        Image.fromarray(rgba, "RGBA").save(buf, "PNG", optimize=True)
+    return buf.getvalue()
+
+
+def decode_overlay(data):
+    """Coverage raster back from a cached PNG overlay (its alpha channel)."""
+    return np.asarray(Image.open(BytesIO(data)).convert("RGBA"))[..., 3].copy()
+
+
+# -------------------------------
+# Rendering
+# -------------------------------
+
+def _render_leaves(leaves, zoom, token, rendered, version):
+    """
+    Fetch imagery tiles concurrently and classify them in the tile
+    pipeline's worker processes, caching their overlays and storing their
+    counts in the tile result cache like any other classified tile.
+    Returns {(x, y): coverage} for the tiles that could be classified.
+    """
+    # tile_pipeline imports this module, so import it lazily
+    from tile_pipeline import coverage_encoded_tiles
+
+    results = get_tile_results()
+    max_age = results.ttl if results else None
+
+    def fetch(tile):
+        return fetch_tile(tile[0], tile[1], zoom, token, max_age)
+
+    def fetched():
+        for (x, y), data, error in iter_fetch(leaves, fetch):
+            if error is not None:
+                print(f"⚠️ No green overlay for tile {x},{y} at zoom {zoom}: {error}")
+                continue
+            yield (x, y), data, []
+
+    coverages = {}
+    counts = {}
+    for (x, y), green, total, coverage, error in coverage_encoded_tiles(fetched()):
+        if error is not None:
+            print(f"⚠️ No green overlay for tile {x},{y} at zoom {zoom}: decode error: {error}")
+            continue
+        coverages[(x, y)] = coverage
+        counts[(x, y)] = (green, total)
+        if rendered:
+            rendered.put(KIND, zoom, x, y, version, encode_overlay(coverage))
+    if results:
+        results.put_many(TILE_STYLE, zoom, CLASSIFIER_VERSION, counts)
+    TILE_RESULTS.inc(len(counts), outcome="classified")
+    return coverages
+
+
+def _leaf_ranges(bbox, zoom):
+    """Inclusive (x, y) ranges of the tiles at zoom covering bbox (min_lon, min_lat, max_lon, max_lat)."""
+    x_min, y_min = deg2num(bbox[3], bbox[0], zoom)
+    x_max, y_max = deg2num(bbox[1], bbox[2], zoom)
+    return (x_min, x_max), (y_min, y_max)
+
+
+def _within(x, y, ranges):
+    (x_min, x_max), (y_min, y_max) = ranges
+    return x_min <= x <= x_max and y_min <= y <= y_max
+
+
+def _coverage(z, x, y, base_zoom, rendered, version, leaves, extent):
+    """
+    Coverage of tile z/x/y and whether every imagery tile under it was
+    available. Imagery tiles outside the extent ranges count as empty.
+    """
+    data = rendered.get(KIND, z, x, y, version) if rendered else None
+    if data is not None:
+        return decode_overlay(data), True
+    if z == base_zoom:
+        coverage = leaves.get((x, y))
+        if coverage is None:
+            return np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint8), not _within(x, y, extent)
+        return coverage, True
+
+    complete = True
+    children = []
+    for dy in (0, 1):
+        row = []
+        for dx in (0, 1):
+            child, child_complete = _coverage(
+                z + 1, 2 * x + dx, 2 * y + dy, base_zoom, rendered, version, leaves, extent
+            )
+            row.append(child)
+            complete = complete and child_complete
+        children.append(row)
+    coverage = downsample(children)
+    # Tiles with missing imagery are rebuilt next time rather than cached
+    if rendered and complete:
+        rendered.put(KIND, z, x, y, version, encode_overlay(coverage))
+    return coverage, complete
+
+
+def green_overlay_tile(z, x, y, base_zoom, token, extent, image_format="png"):
+    """
+    Render the green-mask overlay for tile z/x/y, for zooms between
+    GREEN_OVERLAY_MIN_ZOOM and base_zoom (the zoom the counts are computed
+    at). Lower zooms are built from the base zoom masks, never from
+    lower-resolution imagery, and every level is cached in the rendered
+    tile cache. Only imagery within extent (min_lon, min_lat, max_lon,
+    max_lat), the city, is fetched; the rest of a tile is left empty.
+    Returns encoded image bytes, or None for a tile entirely outside extent.
+    """
+    span = 2 ** (base_zoom - z)
+    ranges = _leaf_ranges(extent, base_zoom)
+    (x_min, x_max), (y_min, y_max) = ranges
+    x_range = (max(x * span, x_min), min(x * span + span - 1, x_max))
+    y_range = (max(y * span, y_min), min(y * span + span - 1, y_max))
+    if x_range[0] > x_range[1] or y_range[0] > y_range[1]:
+        return None
+
+    rendered = get_rendered_tiles()
+    # Tiles along the edge of the extent change with it
+    version = f"{CLASSIFIER_VERSION}:{hashlib.sha1(repr(ranges).encode()).hexdigest()[:8]}"
+    # PNG overlays double as the source of lower zooms; other formats are
+    # converted from them and cached separately
+    kind = KIND if image_format == "png" else f"{KIND}:{image_format}"
+    if rendered:
+        cached = rendered.get(kind, z, x, y, version)
+        if cached is not None:
+            return cached
+
+    # Fetch the imagery under this tile that no cached overlay covers yet,
+    # all at once, before assembling the levels in between
+    present = rendered.present(KIND, base_zoom, version, x_range, y_range) if rendered else set()
+    leaves = [
+        (leaf_x, leaf_y)
+        for leaf_x in range(x_range[0], x_range[1] + 1)
+        for leaf_y in range(y_range[0], y_range[1] + 1)
+        if (leaf_x, leaf_y) not in present
+    ]
+    coverages = _render_leaves(leaves, base_zoom, token, rendered, version)
+
+    coverage, complete = _coverage(z, x, y, base_zoom, rendered, version, coverages, ranges)
+    data = encode_overlay(coverage, image_format)
+    if rendered and complete and kind != KIND:
+        rendered.put(kind, z, x, y, version, data)
+    return data
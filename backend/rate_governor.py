@@ -0,0 +1,361 @@
+import email.utils
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+
+from metrics import UPSTREAM_BYTES, UPSTREAM_ERRORS, UPSTREAM_RESPONSES, UPSTREAM_SECONDS
+from tile_store import SQLiteStore
+
+# -------------------------------
+# Configuration
+# -------------------------------
+# Each upstream host gets a token bucket (requests per second) and a
+# concurrency limit. Both start at a safe value and adapt: they grow while
+# responses are fast and healthy, and shrink on 429/5xx, errors and rising
+# latency. A Retry-After pauses the host for every caller.
+#
+# The bucket, the limits, the pause and the requests in flight are kept in
+# GOVERNOR_PATH, so every worker process draws from the same budget. An
+# empty GOVERNOR_PATH gives each process a budget of its own.
+
+GOVERNOR_PATH = os.getenv(
+    "GOVERNOR_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "governor.sqlite"),
+)
+# A worker that died mid-request frees its slot after this long
+GOVERNOR_SLOT_TTL = 300
+# How often a caller waiting for a slot held by another worker looks again
+GOVERNOR_POLL_INTERVAL = 0.05
+
+MAX_RETRY_AFTER = 60  # never pause a host longer than this on a single Retry-After
+# Latency above this multiple of the best latency seen counts as congestion
+LATENCY_TOLERANCE = 2.0
+# Weight of the newest sample in the smoothed latency
+LATENCY_SMOOTHING = 0.2
+
+# Keyed by host[:port], following MAPBOX_API_URL and OVERPASS_URL when they
+# point somewhere else (a proxy or a local stand-in)
+HOST_LIMITS = {
+    urlparse(os.getenv("MAPBOX_API_URL", "https://api.mapbox.com")).netloc: {
+        "rate": float(os.getenv("MAPBOX_RATE_LIMIT", 30)),
+        "concurrency": 8,
+        "max_concurrency": int(os.getenv("TILE_FETCH_CONCURRENCY", 32)),
+    },
+    urlparse(os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")).netloc: {
+        "rate": float(os.getenv("OVERPASS_RATE_LIMIT", 0.5)),
+        "concurrency": 1,
+        "max_concurrency": 2,
+    },
+}
+DEFAULT_LIMITS = {"rate": 10.0, "concurrency": 4, "max_concurrency": 8}
+
+
+def retry_after_seconds(response):
+    """Parse a Retry-After header (delta-seconds or HTTP date), or return None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+GOVERNOR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS governor_hosts (
+    host TEXT PRIMARY KEY,
+    rate REAL NOT NULL,
+    concurrency REAL NOT NULL,
+    tokens REAL NOT NULL,
+    refilled_at REAL NOT NULL,
+    paused_until REAL NOT NULL,
+    latency REAL,
+    best_latency REAL
+);
+CREATE TABLE IF NOT EXISTS governor_slots (
+    slot TEXT PRIMARY KEY,
+    host TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS governor_slots_host ON governor_slots (host, expires_at);
+"""
+
+
+class GovernorStore(SQLiteStore):
+    """Host governor state shared by every worker process through SQLite."""
+
+    schema = GOVERNOR_SCHEMA
+
+    @contextmanager
+    def host(self, governor, now):
+        """
+        Load a governor's shared state into it and save it back on exit,
+        in one write transaction. Expired slots of dead workers are dropped.
+        Yields the connection, for taking or giving back a slot.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT rate, concurrency, tokens, refilled_at, paused_until, latency, best_latency "
+                "FROM governor_hosts WHERE host = ?", (governor.host,),
+            ).fetchone()
+            if row is not None:
+                governor._load(row)
+            conn.execute(
+                "DELETE FROM governor_slots WHERE host = ? AND expires_at <= ?", (governor.host, now)
+            )
+            governor.in_flight = conn.execute(
+                "SELECT COUNT(*) FROM governor_slots WHERE host = ?", (governor.host,)
+            ).fetchone()[0]
+            yield conn
+            conn.execute(
+                "INSERT OR REPLACE INTO governor_hosts (host, rate, concurrency, tokens, "
+                "refilled_at, paused_until, latency, best_latency) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (governor.host, governor.rate, governor.limit, governor.tokens, governor.refilled_at,
+                 governor.paused_until, governor.latency, governor.best_latency),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def peek(self, governor, now):
+        """Load a governor's shared state into it without changing anything."""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT rate, concurrency, tokens, refilled_at, paused_until, latency, best_latency "
+            "FROM governor_hosts WHERE host = ?", (governor.host,),
+        ).fetchone()
+        if row is not None:
+            governor._load(row)
+        governor.in_flight = conn.execute(
+            "SELECT COUNT(*) FROM governor_slots WHERE host = ? AND expires_at > ?",
+            (governor.host, now),
+        ).fetchone()[0]
+
+
+class HostGovernor:
+    """
+    Rate and concurrency limit for one upstream host. Call acquire() before
+    a request and release() with its outcome and the slot acquire()
+    returned afterwards. With a GovernorStore the limits are shared by
+    every worker using it, else by the threads of this process.
+    """
+
+    def __init__(self, host, rate, concurrency, max_concurrency, min_concurrency=1, store=None):
+        self.host = host
+        self.store = store
+        self.max_rate = rate
+        self.rate = rate
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.limit = float(min(max(concurrency, min_concurrency), self.max_concurrency))
+        self.tokens = min(rate, self.limit)
+        self.refilled_at = time.time()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.latency = None
+        self.best_latency = None
+        self.stats_counts = {"requests": 0, "throttled": 0, "errors": 0, "waited": 0.0}
+        self._cond = threading.Condition()
+
+    def _load(self, row):
+        rate, limit, self.tokens, self.refilled_at, self.paused_until, \
+            self.latency, self.best_latency = row
+        # The configured maximums may have been lowered since the state was saved
+        self.rate = min(rate, self.max_rate)
+        self.limit = min(max(limit, self.min_concurrency), self.max_concurrency)
+
+    @contextmanager
+    def _state(self, now):
+        # Caller holds self._cond
+        if self.store is None:
+            yield None
+        else:
+            with self.store.host(self, now) as conn:
+                yield conn
+
+    def _refill(self, now):
+        burst = max(1.0, self.limit)
+        self.tokens = min(burst, self.tokens + max(0.0, now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def _admit(self, now):
+        """
+        Take a token and a slot if the host allows a request now. Returns
+        (admitted, seconds to wait), waiting None until a slot is released.
+        """
+        self._refill(now)
+        if now < self.paused_until:
+            return False, self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return False, None
+        if self.tokens < 1:
+            return False, (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        self.in_flight += 1
+        return True, 0.0
+
+    def acquire(self):
+        """Block until the host may take another request. Returns the slot to release."""
+        started = time.time()
+        slot = None
+        with self._cond:
+            while True:
+                now = time.time()
+                with self._state(now) as conn:
+                    admitted, wait = self._admit(now)
+                    if admitted and conn is not None:
+                        slot = uuid.uuid4().hex
+                        conn.execute(
+                            "INSERT INTO governor_slots (slot, host, expires_at) VALUES (?, ?, ?)",
+                            (slot, self.host, now + GOVERNOR_SLOT_TTL),
+                        )
+                if admitted:
+                    break
+                if self.store is not None:
+                    # Slots and tokens are also given back by other workers,
+                    # which can't wake us
+                    wait = GOVERNOR_POLL_INTERVAL if wait is None else min(wait, GOVERNOR_POLL_INTERVAL)
+                self._cond.wait(wait)
+            self.stats_counts["requests"] += 1
+            self.stats_counts["waited"] += time.time() - started
+        return slot
+
+    def release(self, latency, status=None, retry_after=None, slot=None):
+        """
+        Report a finished request: its latency in seconds, its HTTP status
+        (None if no response was received), any Retry-After in seconds and
+        the slot acquire() returned.
+        """
+        with self._cond:
+            now = time.time()
+            with self._state(now) as conn:
+                if conn is not None:
+                    conn.execute("DELETE FROM governor_slots WHERE slot = ?", (slot,))
+                    self.in_flight = conn.execute(
+                        "SELECT COUNT(*) FROM governor_slots WHERE host = ?", (self.host,)
+                    ).fetchone()[0]
+                else:
+                    self.in_flight -= 1
+                self._settle(latency, status, retry_after, now)
+            self._cond.notify_all()
+
+    def _settle(self, latency, status, retry_after, now):
+        if status == 429 or retry_after is not None:
+            # Told to slow down: halve both limits and honour Retry-After
+            self.stats_counts["throttled"] += 1
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            self.rate = max(self.max_rate / 32, self.rate / 2)
+            if retry_after is not None:
+                pause = min(retry_after, MAX_RETRY_AFTER)
+                self.paused_until = max(self.paused_until, now + pause)
+        elif status is None or status >= 500:
+            self.stats_counts["errors"] += 1
+            self.limit = max(self.min_concurrency, self.limit * 0.7)
+        else:
+            self.latency = latency if self.latency is None else (
+                LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency
+            )
+            if self.best_latency is None or self.latency < self.best_latency:
+                self.best_latency = self.latency
+            if self.latency > LATENCY_TOLERANCE * self.best_latency:
+                # Responses slowing down means requests are queueing upstream
+                self.limit = max(self.min_concurrency, self.limit * 0.95)
+            else:
+                # Additive increase: about one more slot per window of requests
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def stats(self):
+        """This process's request counters, plus the current (shared) limits."""
+        with self._cond:
+            now = time.time()
+            if self.store is not None:
+                self.store.peek(self, now)
+            return {
+                **self.stats_counts,
+                "waited": round(self.stats_counts["waited"], 3),
+                "concurrency": round(self.limit, 2),
+                "max_concurrency": self.max_concurrency,
+                "rate": round(self.rate, 2),
+                "max_rate": self.max_rate,
+                "in_flight": self.in_flight,
+                "latency": round(self.latency, 4) if self.latency is not None else None,
+                "paused_for": round(max(0.0, self.paused_until - now), 2),
+            }
+
+
+_store = None
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor_store():
+    """Return the shared governor store, or None when GOVERNOR_PATH is empty."""
+    global _store
+    if not GOVERNOR_PATH:
+        return None
+    with _governors_lock:
+        if _store is None:
+            _store = GovernorStore(GOVERNOR_PATH)
+        return _store
+
+
+def get_governor(host):
+    """Return the governor of an upstream host (host[:port])."""
+    store = get_governor_store()
+    with _governors_lock:
+        governor = _governors.get(host)
+        if governor is None:
+            governor = _governors[host] = HostGovernor(
+                host, **HOST_LIMITS.get(host, DEFAULT_LIMITS), store=store
+            )
+        return governor
+
+
+def governed_get(url, session=None, **kwargs):
+    """
+    requests.get (or session.get) through the governor of the URL's host.
+    Returns the response; errors are reported and re-raised. The slot
+    taken from the governor is given back whatever happens.
+    """
+    host = urlparse(url).netloc
+    governor = get_governor(host)
+    slot = governor.acquire()
+    started = time.monotonic()
+    response = None
+    try:
+        response = (session or requests).get(url, **kwargs)
+    except Exception:
+        UPSTREAM_ERRORS.inc(host=host)
+        raise
+    finally:
+        latency = time.monotonic() - started
+        if response is None:
+            governor.release(latency, slot=slot)
+        else:
+            retry_after = retry_after_seconds(response) if response.status_code in (429, 503) else None
+            governor.release(latency, response.status_code, retry_after, slot)
+    UPSTREAM_SECONDS.observe(latency, host=host)
+    UPSTREAM_RESPONSES.inc(host=host, status=response.status_code)
+    UPSTREAM_BYTES.inc(len(response.content), host=host)
+    return response
+
+
+def governor_stats():
+    """Stats of every upstream host contacted so far."""
+    with _governors_lock:
+        governors = dict(_governors)
+    return {host: governor.stats() for host, governor in governors.items()}
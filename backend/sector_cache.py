@@ -0,0 +1,329 @@
+import json
+import os
+import threading
+import time
+
+from tile_store import SQLiteStore
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+SECTOR_CACHE_PATH = os.getenv(
+    "SECTOR_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "sectors.sqlite"),
+)
+SECTOR_CACHE_TTL = int(os.getenv("SECTOR_CACHE_TTL", 24 * 3600))  # seconds
+# Sectors that could not be computed are retried much sooner
+FAILED_SECTOR_TTL = 15 * 60
+# How often the refresher looks for stale sectors when nobody wakes it up
+SECTOR_REFRESH_INTERVAL = float(os.getenv("SECTOR_REFRESH_INTERVAL", 30))
+# Sectors recomputed together, so shared edge tiles are analyzed once
+SECTOR_REFRESH_BATCH = 8
+# A worker that claimed a refresh and died releases it after this long
+SECTOR_REFRESH_LEASE = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sector_results (
+    mode TEXT NOT NULL,
+    sector TEXT NOT NULL,
+    version TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    computed_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    requests INTEGER NOT NULL DEFAULT 0,
+    requested_at REAL NOT NULL DEFAULT 0,
+    refresh_until REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (mode, sector)
+);
+"""
+
+
+class SectorEntry:
+    """A cached sector result; result is None for a sector that could not be computed."""
+
+    __slots__ = ("result", "computed_at", "fresh")
+
+    def __init__(self, result, computed_at, fresh):
+        self.result = result
+        self.computed_at = computed_at
+        self.fresh = fresh
+
+
+class SectorCache(SQLiteStore):
+    """
+    Per-sector green cover results with a TTL, shared by every worker
+    process through SQLite. Expired entries are still returned (marked
+    stale) so they can be served while a refresh runs in the background.
+    Entries computed with another version string are ignored.
+    """
+
+    schema = SCHEMA
+    counters = ("hits", "stale", "misses", "writes", "refreshes")
+    metric_name = "sectors"
+
+    def __init__(self, path=SECTOR_CACHE_PATH, ttl=SECTOR_CACHE_TTL):
+        super().__init__(path)
+        self.ttl = ttl
+
+    def get_many(self, mode, sectors, version, record=True):
+        """
+        Return {sector: SectorEntry} for the cached sectors. With record,
+        the lookup counts as a request, which the refresher uses to decide
+        what to recompute first.
+        """
+        conn = self._connect()
+        now = time.time()
+        marks = ", ".join("?" * len(sectors))
+        # A plain read: only recording the request needs the write lock
+        rows = conn.execute(
+            "SELECT sector, payload, computed_at, expires_at FROM sector_results "
+            f"WHERE mode = ? AND version = ? AND sector IN ({marks})",
+            (mode, version, *sectors),
+        ).fetchall() if sectors else []
+        found = {
+            sector: SectorEntry(json.loads(payload), computed_at, now < expires_at)
+            for sector, payload, computed_at, expires_at in rows
+        }
+        if not record:
+            return found
+        if found:
+            marks = ", ".join("?" * len(found))
+            conn.execute(
+                "UPDATE sector_results SET requests = requests + 1, requested_at = ? "
+                f"WHERE mode = ? AND sector IN ({marks})",
+                (now, mode, *found),
+            )
+        stale = sum(1 for entry in found.values() if not entry.fresh)
+        self._count("hits", len(found) - stale)
+        self._count("stale", stale)
+        self._count("misses", len(sectors) - len(found))
+        return found
+
+    def touch(self, mode, sectors, version):
+        """
+        Record a request for sectors without loading their results. Returns
+        (cached, stale, newest computed_at), which is enough to tell whether
+        a response built from these sectors is still current.
+        """
+        conn = self._connect()
+        now = time.time()
+        marks = ", ".join("?" * len(sectors))
+        conn.execute(
+            "UPDATE sector_results SET requests = requests + 1, requested_at = ? "
+            f"WHERE mode = ? AND version = ? AND sector IN ({marks})",
+            (now, mode, version, *sectors),
+        )
+        cached, stale, newest = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(expires_at <= ?), 0), MAX(computed_at) "
+            f"FROM sector_results WHERE mode = ? AND version = ? AND sector IN ({marks})",
+            (now, mode, version, *sectors),
+        ).fetchone()
+        self._count("hits", cached - stale)
+        self._count("stale", stale)
+        self._count("misses", len(sectors) - cached)
+        return cached, stale, newest
+
+    def last_modified(self, mode, version):
+        """(number of cached sectors, newest computed_at) of a mode, without recording a request."""
+        return tuple(self._connect().execute(
+            "SELECT COUNT(*), MAX(computed_at) FROM sector_results WHERE mode = ? AND version = ?",
+            (mode, version),
+        ).fetchone())
+
+    def put_many(self, mode, results, version, refreshed=False):
+        """Store {sector: result or None} and release any refresh claims on them."""
+        if not results:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sector, result in results.items():
+                ttl = self.ttl if result is not None else min(self.ttl, FAILED_SECTOR_TTL)
+                # Requests are counted again from zero after every refresh
+                conn.execute(
+                    "INSERT INTO sector_results "
+                    "(mode, sector, version, payload, computed_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (mode, sector) DO UPDATE SET version = excluded.version, "
+                    "payload = excluded.payload, computed_at = excluded.computed_at, "
+                    "expires_at = excluded.expires_at, requests = 0, refresh_until = 0",
+                    (mode, sector, version, json.dumps(result), now, now + ttl),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("refreshes" if refreshed else "writes", len(results))
+
+    def seed_many(self, mode, entries, version):
+        """
+        Store {sector: (result or None, computed_at)} from a snapshot, keeping
+        the original computed_at so expiry and refreshes work as if they had
+        been computed here. Sectors already cached with `version` are left
+        alone.
+        Returns the number of sectors added.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            for sector, (result, computed_at) in entries.items():
+                ttl = self.ttl if result is not None else min(self.ttl, FAILED_SECTOR_TTL)
+                conn.execute(
+                    "INSERT INTO sector_results "
+                    "(mode, sector, version, payload, computed_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (mode, sector) DO UPDATE SET version = excluded.version, "
+                    "payload = excluded.payload, computed_at = excluded.computed_at, "
+                    "expires_at = excluded.expires_at, requests = 0, refresh_until = 0 "
+                    "WHERE sector_results.version != excluded.version",
+                    (mode, sector, version, json.dumps(result), computed_at, computed_at + ttl),
+                )
+            added = conn.total_changes - before
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("writes", added)
+        return added
+
+    def claim_stale(self, limit=SECTOR_REFRESH_BATCH):
+        """
+        Claim up to `limit` expired sectors that were requested since they
+        were computed, most urgent first, and return them as (mode, sector)
+        pairs. Urgency grows with both the time past expiry and the number
+        of requests since the last refresh. A claim holds for
+        SECTOR_REFRESH_LEASE seconds so other workers skip these sectors.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT mode, sector FROM sector_results "
+                "WHERE expires_at <= ? AND refresh_until <= ? AND requested_at >= computed_at "
+                "ORDER BY (? - expires_at + 1) * (requests + 1) DESC LIMIT ?",
+                (now, now, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE sector_results SET refresh_until = ? WHERE mode = ? AND sector = ?",
+                [(now + SECTOR_REFRESH_LEASE, mode, sector) for mode, sector in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return rows
+
+    def release(self, pairs):
+        """Give up refresh claims on (mode, sector) pairs without storing a result."""
+        self._connect().executemany(
+            "UPDATE sector_results SET refresh_until = 0 WHERE mode = ? AND sector = ?", pairs
+        )
+
+    def expire(self):
+        """
+        Mark every entry stale and due for a refresh. Entries keep being
+        served until their replacement is computed.
+        """
+        now = time.time()
+        self._connect().execute(
+            "UPDATE sector_results SET expires_at = 0, computed_at = 0, requested_at = ?", (now,)
+        )
+
+    def clear(self):
+        """Remove every cached sector."""
+        self._connect().execute("DELETE FROM sector_results")
+
+    def stats(self):
+        """Hit/miss counters for this process plus the state of the shared cache."""
+        now = time.time()
+        count, expired = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(expires_at <= ?), 0) FROM sector_results", (now,)
+        ).fetchone()
+        stats = self._counter_snapshot()
+        stats.update({"sectors": count, "expired": expired, "ttl": self.ttl})
+        return stats
+
+
+# -------------------------------
+# Background refresh
+# -------------------------------
+
+class SectorRefresher:
+    """
+    Daemon thread that recomputes stale sectors so requests never wait for
+    them. Every worker process runs one; the claims in SectorCache make
+    sure each stale sector is recomputed by a single worker.
+
+    compute(mode, sectors) must return {sector: result or None}.
+    """
+
+    def __init__(self, cache, compute, version, interval=SECTOR_REFRESH_INTERVAL):
+        self.cache = cache
+        self.compute = compute
+        self.version = version
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Threads don't survive a fork, so start one per worker process
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="sector-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def wake(self):
+        """Ask the refresher to look for stale sectors now."""
+        self.start()
+        self._wake.set()
+
+    def refresh_once(self):
+        """Recompute one batch of stale sectors. Returns the number of sectors claimed."""
+        claimed = self.cache.claim_stale()
+        by_mode = {}
+        for mode, sector in claimed:
+            by_mode.setdefault(mode, []).append(sector)
+        for mode, sectors in by_mode.items():
+            try:
+                results = self.compute(mode, sectors)
+            except Exception as e:
+                print(f"Error refreshing {', '.join(sectors)} ({mode}): {e}")
+                self.cache.release([(mode, sector) for sector in sectors])
+                continue
+            self.cache.put_many(mode, results, self.version, refreshed=True)
+            print(f"Refreshed {len(results)} sectors ({mode})")
+        return len(claimed)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                while self.refresh_once():
+                    pass
+            except Exception as e:
+                print(f"Sector refresh failed: {e}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_sector_cache():
+    """Return the process-wide sector result cache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SectorCache()
+    return _cache
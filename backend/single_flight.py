@@ -0,0 +1,164 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+from tile_store import SQLiteStore
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+# A worker holding a lease that died is taken over after this long. Leases
+# are renewed while their computation runs, so this only needs to cover
+# the gap between renewals.
+FLIGHT_LEASE_TTL = 120
+FLIGHT_LEASE_RENEW = 30
+# How often workers waiting on another worker's computation look for its result
+FLIGHT_POLL_INTERVAL = 0.5
+
+LEASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS flight_leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class LeaseStore(SQLiteStore):
+    """Short-lived named leases shared by every worker process through SQLite."""
+
+    schema = LEASE_SCHEMA
+    counters = ("acquired", "contended")
+    metric_name = "leases"
+
+    def acquire(self, key, owner, ttl=FLIGHT_LEASE_TTL):
+        """Take the lease on key unless another live owner holds it. Returns True on success."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "INSERT INTO flight_leases (key, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET owner = excluded.owner, "
+            "expires_at = excluded.expires_at WHERE flight_leases.expires_at <= ?",
+            (key, owner, now + ttl, now),
+        )
+        acquired = cursor.rowcount == 1
+        self._count("acquired" if acquired else "contended")
+        return acquired
+
+    def renew(self, key, owner, ttl=FLIGHT_LEASE_TTL):
+        self._connect().execute(
+            "UPDATE flight_leases SET expires_at = ? WHERE key = ? AND owner = ?",
+            (time.time() + ttl, key, owner),
+        )
+
+    def release(self, key, owner):
+        self._connect().execute(
+            "DELETE FROM flight_leases WHERE key = ? AND owner = ?", (key, owner)
+        )
+
+    def stats(self):
+        stats = self._counter_snapshot()
+        stats["held"] = self._connect().execute(
+            "SELECT COUNT(*) FROM flight_leases WHERE expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+        return stats
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent computations of the same key: the first caller runs
+    the computation and every caller that arrives while it runs gets the
+    same result (or exception) instead of starting its own.
+
+    With a LeaseStore, computations are also coalesced across worker
+    processes. Callers then pass a lookup function that returns the shared
+    result once the worker holding the lease has stored it (or None), and
+    callers in other workers wait for that instead of computing.
+    """
+
+    def __init__(self, leases=None):
+        self.leases = leases
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "followers": 0}
+
+    def do(self, key, compute, lookup=None):
+        """Return compute(), sharing a single run between concurrent callers for key."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._stats["leaders" if leader else "followers"] += 1
+
+        if not leader:
+            call.done.wait()
+            if isinstance(call.error, Exception):
+                raise call.error
+            if call.error is not None:
+                # The leader was interrupted (e.g. its job was cancelled)
+                # rather than failing, so compute it ourselves
+                return self.do(key, compute, lookup)
+            return call.result
+
+        try:
+            if self.leases is not None and lookup is not None:
+                call.result = self._run_shared(key, compute, lookup)
+            else:
+                call.result = compute()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_shared(self, key, compute, lookup):
+        owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        while not self.leases.acquire(key, owner):
+            # Another worker is computing this key; wait for its result
+            time.sleep(FLIGHT_POLL_INTERVAL)
+            result = lookup()
+            if result is not None:
+                return result
+
+        stop = threading.Event()
+        renewer = threading.Thread(
+            target=self._renew, args=(key, owner, stop), name="flight-lease", daemon=True
+        )
+        renewer.start()
+        try:
+            # The previous holder may have finished between our last look and now
+            result = lookup()
+            return result if result is not None else compute()
+        finally:
+            stop.set()
+            self.leases.release(key, owner)
+
+    def _renew(self, key, owner, stop):
+        while not stop.wait(FLIGHT_LEASE_RENEW):
+            try:
+                self.leases.renew(key, owner)
+            except Exception as e:
+                print(f"Could not renew lease on {key}: {e}")
+
+    def stats(self):
+        """Leader/follower counts for this process, plus the shared lease counters."""
+        with self._lock:
+            stats = dict(self._stats, in_flight=len(self._calls))
+        if self.leases is not None:
+            stats["leases"] = self.leases.stats()
+        return stats
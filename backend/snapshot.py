@@ -0,0 +1,212 @@
+"""
+Snapshot bundle for a fast cold start.
+
+`python snapshot.py export` writes what a warm server knows into one
+compact file: the sector boundaries, every cached sector result and the
+gzipped /api/all-sectors body of each cover mode. A worker starting with
+an empty cache maps that file and serves the bundled response right away,
+while the sector refresher recomputes whatever is stale in the background.
+
+Layout: MAGIC, a 4-byte big-endian header length, a JSON header, then the
+blobs the header points to as [offset, length] pairs counted from the end
+of the header. Boundaries and sectors are gzipped JSON; responses are
+stored exactly as they are served.
+
+Run from the backend directory:
+    python snapshot.py export [--path cache/snapshot.bin] [--modes bbox polygon]
+"""
+import argparse
+import gzip
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+# An empty SNAPSHOT_PATH disables restoring from a snapshot
+SNAPSHOT_PATH = os.getenv(
+    "SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "snapshot.bin"),
+)
+MAGIC = b"GCSNAP1\n"
+_LENGTH = struct.Struct(">I")
+
+
+class Snapshot:
+    """
+    A snapshot file mapped into memory. Blobs are only read and decoded
+    when asked for, so opening one costs a header parse.
+    """
+
+    def __init__(self, header, data, start):
+        self.header = header
+        self._data = data
+        self._start = start
+
+    @property
+    def version(self):
+        return self.header["version"]
+
+    @property
+    def created_at(self):
+        return self.header["created_at"]
+
+    @property
+    def modes(self):
+        return list(self.header["modes"])
+
+    def _blob(self, location):
+        offset, length = location
+        return self._data[self._start + offset:self._start + offset + length]
+
+    def boundaries(self):
+        """The boundary cache as load_sector_boundaries returns it."""
+        return json.loads(gzip.decompress(self._blob(self.header["boundaries"])))
+
+    def sectors(self, mode):
+        """{sector: (result or None, computed_at)} of a cover mode."""
+        entries = json.loads(gzip.decompress(self._blob(self.header["modes"][mode]["sectors"])))
+        return {sector: (result, computed_at) for sector, (result, computed_at) in entries.items()}
+
+    def response(self, mode):
+        """(sectors stamp, etag, gzipped body) of the mode's /api/all-sectors response."""
+        entry = self.header["modes"][mode]
+        return tuple(entry["stamp"]), entry["etag"], self._blob(entry["response"])
+
+
+def load_snapshot(version, path=SNAPSHOT_PATH):
+    """
+    Map the snapshot at `path`. Returns None when there is none, or when it
+    was exported from sectors computed another way than `version`.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a snapshot file")
+        start = len(MAGIC) + _LENGTH.size
+        (length,) = _LENGTH.unpack(data[len(MAGIC):start])
+        header = json.loads(data[start:start + length])
+    except (OSError, ValueError, struct.error) as e:
+        print(f"⚠️ Could not read snapshot {path}: {e}")
+        return None
+    if header.get("version") != version:
+        print(f"⚠️ Ignoring snapshot {path}: computed with version {header.get('version')}, "
+              f"now {version}")
+        return None
+    return Snapshot(header, data, start + length)
+
+
+def write_snapshot(path, version, boundaries, modes):
+    """
+    Write a snapshot atomically. `modes` maps each cover mode to (sectors
+    stamp, {sector: (result, computed_at)}, etag, gzipped response body).
+    """
+    blobs = []
+    offset = 0
+
+    def add(blob):
+        nonlocal offset
+        blobs.append(blob)
+        offset += len(blob)
+        return [offset - len(blob), len(blob)]
+
+    header = {
+        "version": version,
+        "created_at": time.time(),
+        "boundaries": add(gzip.compress(json.dumps(boundaries).encode(), mtime=0)),
+        "modes": {},
+    }
+    for mode, (stamp, entries, etag, compressed) in modes.items():
+        header["modes"][mode] = {
+            "stamp": list(stamp),
+            "etag": etag,
+            "sectors": add(gzip.compress(json.dumps(entries).encode(), mtime=0)),
+            "response": add(compressed),
+        }
+    encoded = json.dumps(header).encode()
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write then rename, so a starting worker never maps a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_LENGTH.pack(len(encoded)))
+        f.write(encoded)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+    return len(MAGIC) + _LENGTH.size + len(encoded) + offset
+
+
+# -------------------------------
+# Export
+# -------------------------------
+
+def export_snapshot(path=SNAPSHOT_PATH, modes=None):
+    """
+    Compute any sector missing from the sector cache, then write the
+    snapshot of every cover mode in `modes`. Returns the file size.
+    """
+    import app
+    from osm_utils import CHANDIGARH_SECTORS, load_sector_boundaries
+
+    bundled = {}
+    for mode in modes or app.COVER_MODES:
+        started = time.perf_counter()
+        app.all_sectors_data(mode)
+        # Build the response from exactly the rows the stamp describes
+        entries = app.sector_cache.get_many(
+            mode, CHANDIGARH_SECTORS, app.SECTOR_CACHE_VERSION, record=False
+        )
+        missing = [sector for sector in CHANDIGARH_SECTORS if sector not in entries]
+        if missing:
+            raise RuntimeError(f"{mode}: sectors missing from the cache: {', '.join(missing)}")
+        stamp = (len(entries), max(entry.computed_at for entry in entries.values()))
+        sectors = {sector: (entry.result, entry.computed_at) for sector, entry in entries.items()}
+        # Serialized before build_all_sectors_response annotates the results
+        sectors = json.loads(json.dumps(sectors))
+        results = [entries[sector].result for sector in CHANDIGARH_SECTORS if entries[sector].result]
+        failed_sectors = [sector for sector in CHANDIGARH_SECTORS if not entries[sector].result]
+        etag, compressed = app.encode_json_body(
+            app.build_all_sectors_response(results, failed_sectors, mode)
+        )
+        bundled[mode] = (stamp, sectors, etag, compressed)
+        print(f"✓ {mode}: {len(results)} sectors, {len(failed_sectors)} failed, "
+              f"{len(compressed) / 1024:.0f} KiB response ({time.perf_counter() - started:.1f}s)")
+
+    return write_snapshot(path, app.SECTOR_CACHE_VERSION, load_sector_boundaries(), bundled)
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write a snapshot of the current results")
+    # SNAPSHOT_PATH was read before .env was loaded
+    export.add_argument("--path", default=os.getenv("SNAPSHOT_PATH", SNAPSHOT_PATH),
+                        help="file to write")
+    export.add_argument("--modes", nargs="+", choices=("bbox", "polygon"), default=None,
+                        help="cover modes to include (default: both)")
+    args = parser.parse_args()
+
+    if not args.path:
+        parser.error("no --path given and SNAPSHOT_PATH is empty")
+    size = export_snapshot(args.path, args.modes)
+    print(f"Wrote {args.path} ({size / 1024:.0f} KiB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+"""
+Run from the backend directory:
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+# The stores are opened at import time, so point them away from cache/
+# before any backend module is imported
+_STATE = tempfile.mkdtemp(prefix="green-cover-tests-")
+for name, filename in (
+    ("TILE_STORE_PATH", "tiles.sqlite"),
+    ("SECTOR_CACHE_PATH", "sectors.sqlite"),
+    ("JOB_STORE_PATH", "jobs.sqlite"),
+    ("BOUNDARY_CACHE_PATH", "boundaries.json"),
+    ("METRICS_PATH", "metrics.sqlite"),
+    ("GOVERNOR_PATH", "governor.sqlite"),
+    ("GREEN_MOSAIC_PATH", "mosaic"),
+    ("SNAPSHOT_PATH", "snapshot.bin"),
+):
+    os.environ.setdefault(name, os.path.join(_STATE, filename))
+os.environ.setdefault("MAPBOX_API_URL", "http://127.0.0.1:9")
+# Classify in the test process rather than in a spawned pool
+os.environ.setdefault("TILE_PROCESS_WORKERS", "0")
@@ -0,0 +1,77 @@
+import pytest
+from shapely.geometry import box
+
+import adaptive_cover
+from adaptive_cover import ADAPTIVE_TILE_RATE, plan_first_pass, tile_budget_for
+
+BBOX = (76.74, 30.75, 76.76, 30.77)
+MAX_ZOOM = 17
+PIXELS = 256 * 256
+
+
+def test_tile_budget_for():
+    assert tile_budget_for(tile_budget=50) == 50
+    assert tile_budget_for(tile_budget=50, time_budget=1000) == 50
+    assert tile_budget_for(time_budget=2) == max(1, int(2 * ADAPTIVE_TILE_RATE))
+    assert tile_budget_for(time_budget=0.001) == 1
+    with pytest.raises(ValueError):
+        tile_budget_for()
+
+
+def test_plan_first_pass_rejects_regions_too_large_for_the_budget():
+    assert plan_first_pass(BBOX, MAX_ZOOM, tile_budget=100000) == (100000, MAX_ZOOM)
+    budget, zoom = plan_first_pass(BBOX, MAX_ZOOM, tile_budget=40)
+    assert budget == 40 and adaptive_cover.ADAPTIVE_MIN_ZOOM <= zoom < MAX_ZOOM
+    with pytest.raises(ValueError):
+        plan_first_pass(BBOX, MAX_ZOOM, time_budget=0.01)
+
+
+def fake_counts(green_share):
+    """compute_tile_counts stand-in for imagery whose tiles are green_share(z, x, y) green."""
+    calls = []
+
+    def compute_tile_counts(tiles, zoom, token, regions, progress):
+        calls.append(len(tiles) + len(regions))
+        counts = {tile: (round(green_share(zoom, *tile) * PIXELS), PIXELS) for tile in tiles}
+        region_counts = {
+            (tile, key): (round(green_share(zoom, *tile) * PIXELS), PIXELS)
+            for tile, entries in regions.items() for key, _ in entries
+        }
+        return counts, region_counts, {}
+
+    return compute_tile_counts, calls
+
+
+def test_uniform_region_stops_at_first_pass(monkeypatch):
+    counts, calls = fake_counts(lambda z, x, y: 1.0)
+    monkeypatch.setattr(adaptive_cover, "compute_tile_counts", counts)
+
+    cover = adaptive_cover.adaptive_green_cover(box(*BBOX), "test", MAX_ZOOM, None, tile_budget=40)
+    assert cover["green_cover"] == 100.0
+    assert cover["stopped"] == "tolerance"
+    assert len(calls) == 1
+    assert cover["tiles_total"] <= 40
+
+
+def test_mixed_region_respects_tile_budget(monkeypatch):
+    # Tiles disagree with their parents, so refinement never settles
+    counts, _ = fake_counts(lambda z, x, y: (7 * x + 13 * y + z) % 10 / 10)
+    monkeypatch.setattr(adaptive_cover, "compute_tile_counts", counts)
+
+    cover = adaptive_cover.adaptive_green_cover(
+        box(*BBOX), "test", MAX_ZOOM, None, tile_budget=40, tolerance=0
+    )
+    assert 0 < cover["green_cover"] < 100
+    assert cover["stopped"] == "tile_budget"
+    assert cover["tiles_total"] <= 40
+    assert cover["error_estimate"] > 0
+
+
+@pytest.mark.parametrize("endpoint", ["/api/region-cover", "/api/jobs"])
+def test_budget_too_small_for_region_is_a_bad_request(endpoint):
+    import app
+
+    body = {"type": "region", "bbox": list(BBOX), "time_budget": 0.01}
+    response = app.app.test_client().post(endpoint, json=body)
+    assert response.status_code == 400
+    assert "budget" in response.get_json()["error"]
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+import app
+import osm_utils
+import rate_governor
+from benchmarks.standin import StandIn, tile_green_pixels
+from tile_store import get_tile_results
+from tile_utils import TILE_SIZE
+
+SECTORS = ["Sector 1", "Sector 2", "Sector 3"]
+# Not in the stand-in's grid, so it has no boundary
+MISSING = "Sector 999"
+
+
+@pytest.fixture
+def standin(monkeypatch):
+    # Separate hosts, as with the real services
+    tiles, overpass = StandIn().start(), StandIn().start()
+    monkeypatch.setattr("tile_utils.MAPBOX_API_URL", tiles.url)
+    monkeypatch.setattr(osm_utils, "OVERPASS_URL", f"{overpass.url}/api/interpreter")
+    monkeypatch.setattr(app, "MAPBOX_TOKEN", "test")
+    # The stand-in answers every query with the whole grid, so a lookup of a
+    # single sector would find someone else's boundary
+    monkeypatch.setattr(osm_utils, "query_sector_geojson", lambda sector_name: None)
+    monkeypatch.setitem(rate_governor.HOST_LIMITS, tiles.url.split("://", 1)[1],
+                        {"rate": 1000.0, "concurrency": 8, "max_concurrency": 8})
+    # app shares this list object
+    sectors = osm_utils.CHANDIGARH_SECTORS[:]
+    osm_utils.CHANDIGARH_SECTORS[:] = SECTORS + [MISSING]
+
+    def reset():
+        app.sector_cache.clear()
+        app.encoded_cache.clear()
+        get_tile_results().clear()
+        osm_utils.clear_boundary_cache()
+
+    reset()
+    yield tiles
+    osm_utils.CHANDIGARH_SECTORS[:] = sectors
+    reset()
+    tiles.stop()
+    overpass.stop()
+
+
+def stream(client, **args):
+    response = client.get("/api/all-sectors/stream", query_string={"mode": "bbox", **args})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    body = response.get_data(as_text=True)
+    assert body.endswith("\n")
+    return [json.loads(line) for line in body.splitlines()]
+
+
+def expected_cover(sector_name):
+    sectors, _, _, _ = app.sector_tile_layout([sector_name], "bbox")
+    tiles = sectors[0][3]
+    green = sum(tile_green_pixels(x, y, app.ZOOM_LEVEL) for x, y in tiles)
+    return round(100 * green / (len(tiles) * TILE_SIZE * TILE_SIZE), 2)
+
+
+def test_one_record_per_line_then_a_summary(standin):
+    records = stream(app.app.test_client())
+
+    assert [record["type"] for record in records] == ["sector"] * 3 + ["summary"]
+    sectors = {record["stats"]["sector"]: record for record in records[:-1]}
+    assert sorted(sectors) == SECTORS
+    for sector_name, record in sectors.items():
+        assert record["stats"]["tiles_failed"] == 0
+        assert record["stats"]["green_cover"] == pytest.approx(expected_cover(sector_name), abs=0.01)
+        assert record["features"] and all(
+            feature["type"] == "Feature" for feature in record["features"])
+
+    summary = records[-1]
+    assert summary["total_sectors"] == 3
+    assert summary["failed_sectors"] == [MISSING]
+    assert summary["mode"] == "bbox"
+
+
+def test_cached_sectors_are_streamed_without_fetching_tiles(standin):
+    client = app.app.test_client()
+    first = stream(client)
+    fetched = standin.stats()["tiles"]
+
+    second = stream(client)
+
+    assert standin.stats()["tiles"] == fetched
+    # Cached sectors come first, in sector order
+    assert [record["stats"]["sector"] for record in second[:-1]] == SECTORS
+    assert second[-1] == first[-1]
+
+
+def test_server_sent_events(standin):
+    response = app.app.test_client().get("/api/all-sectors/stream?mode=bbox&format=sse")
+
+    assert response.mimetype == "text/event-stream"
+    events = response.get_data(as_text=True).split("\n\n")
+    assert events[-1] == ""
+    events = [event.split("\n") for event in events[:-1]]
+    assert [event[0] for event in events] == ["event: sector"] * 3 + ["event: summary"]
+    assert all(event[1].startswith("data: ") and len(event) == 2 for event in events)
+    assert json.loads(events[-1][1][len("data: "):])["failed_sectors"] == [MISSING]
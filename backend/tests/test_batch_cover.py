@@ -0,0 +1,103 @@
+import csv
+import json
+
+import pytest
+from shapely.geometry import box
+
+import batch_cover
+from batch_cover import OUTPUT_FIELDS, finished_regions, read_regions, run_batch
+
+REGIONS = [(f"region {i}", box(76.7 + i / 100, 30.7, 76.705 + i / 100, 30.705)) for i in range(6)]
+
+
+@pytest.fixture
+def covers(monkeypatch):
+    """Fake bbox covers; regions listed in `failing` lose a tile. Returns the computed bounds."""
+    computed = []
+    failing = set()
+
+    def compute_green_cover(bounds, zoom, token):
+        region_id = next(region_id for region_id, geom in REGIONS if geom.bounds == bounds)
+        computed.append(region_id)
+        failed = [{"x": 1, "y": 2, "z": zoom, "error": "HTTP 503"}] if region_id in failing else []
+        return {"green_cover": 25.0, "green_pixels": 100, "total_pixels": 400,
+                "tiles_total": 4, "failed_tiles": failed}
+
+    monkeypatch.setattr(batch_cover, "compute_green_cover", compute_green_cover)
+    return computed, failing
+
+
+def rows(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_rerun_only_computes_missing_and_failed_regions(tmp_path, covers):
+    computed, failing = covers
+    output = str(tmp_path / "out.csv")
+    failing.add("region 1")
+
+    written, failed = run_batch(REGIONS[:4], output, "bbox", 17, "token", workers=2)
+
+    assert written == 3 and set(failed) == {"region 1"}
+    assert "503" in failed["region 1"]
+    assert finished_regions(output) == {"region 0", "region 2", "region 3"}
+
+    computed.clear()
+    failing.clear()
+    written, failed = run_batch(REGIONS, output, "bbox", 17, "token", workers=2)
+
+    assert (written, failed) == (3, {})
+    assert sorted(computed) == ["region 1", "region 4", "region 5"]
+    assert sorted(row["id"] for row in rows(output)) == [region_id for region_id, _ in REGIONS]
+    assert all(row["green_cover"] == "25.0" and row["mode"] == "bbox" for row in rows(output))
+
+    computed.clear()
+    assert run_batch(REGIONS, output, "bbox", 17, "token") == (0, {})
+    assert computed == []
+
+
+def test_interrupted_line_is_dropped_and_recomputed(tmp_path, covers):
+    computed, _ = covers
+    output = tmp_path / "out.csv"
+    run_batch(REGIONS[:2], str(output), "bbox", 17, "token", workers=1)
+    # A run killed halfway through writing its last row
+    with open(output, "a") as f:
+        f.write("region 2,bbox,17,25.0,10")
+
+    assert finished_regions(str(output)) == {"region 0", "region 1"}
+    assert output.read_text().endswith("\n")
+
+    computed.clear()
+    run_batch(REGIONS[:3], str(output), "bbox", 17, "token")
+    assert computed == ["region 2"]
+    assert [row["id"] for row in rows(output)][-1] == "region 2"
+    assert all(len(row) == len(OUTPUT_FIELDS) for row in rows(output))
+
+
+def test_foreign_output_is_refused(tmp_path):
+    output = tmp_path / "out.csv"
+    output.write_text("name,value\na,1\n")
+    with pytest.raises(ValueError):
+        finished_regions(str(output))
+
+
+def test_read_regions(tmp_path):
+    regions_csv = tmp_path / "regions.csv"
+    regions_csv.write_text("name,min_lon,min_lat,max_lon,max_lat\n"
+                           "a,76.7,30.7,76.8,30.8\n,76.8,30.7,76.9,30.8\n")
+    assert [(region_id, geom.bounds) for region_id, geom in read_regions(str(regions_csv))] == [
+        ("a", (76.7, 30.7, 76.8, 30.8)), ("2", (76.8, 30.7, 76.9, 30.8)),
+    ]
+
+    feature = {"type": "Feature", "properties": {"name": "a"},
+               "geometry": {"type": "Point", "coordinates": [76.7, 30.7]}}
+    regions_json = tmp_path / "regions.geojson"
+    regions_json.write_text(json.dumps({"type": "FeatureCollection", "features": [feature]}))
+    with pytest.raises(ValueError, match="not a polygon"):
+        read_regions(str(regions_json))
+
+    feature["geometry"] = box(76.7, 30.7, 76.8, 30.8).__geo_interface__
+    regions_json.write_text(json.dumps({"type": "FeatureCollection", "features": [feature, feature]}))
+    with pytest.raises(ValueError, match="duplicate"):
+        read_regions(str(regions_json))
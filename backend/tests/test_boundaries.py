@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+import osm_utils
+
+
+@pytest.fixture
+def boundaries(monkeypatch, tmp_path):
+    """Empty boundary cache whose downloads are answered by `downloads` in turn."""
+    monkeypatch.setattr(osm_utils, "BOUNDARY_CACHE_PATH", str(tmp_path / "boundaries.json"))
+    osm_utils.clear_boundary_cache()
+    downloads = []
+    calls = []
+
+    def query_all_sector_geojson():
+        calls.append(time.time())
+        time.sleep(0.05)
+        return downloads.pop(0) if downloads else None
+
+    monkeypatch.setattr(osm_utils, "query_all_sector_geojson", query_all_sector_geojson)
+    yield downloads, calls
+    osm_utils.clear_boundary_cache()
+
+
+def test_failed_download_is_not_retried_until_the_interval(boundaries, monkeypatch):
+    _, calls = boundaries
+    for _ in range(3):
+        assert osm_utils.load_sector_boundaries()["sectors"] == {}
+    assert len(calls) == 1
+
+    monkeypatch.setattr(osm_utils, "BOUNDARY_RETRY_INTERVAL", 0)
+    osm_utils.load_sector_boundaries()
+    assert len(calls) == 2
+
+
+def test_concurrent_callers_share_one_download(boundaries):
+    downloads, calls = boundaries
+    downloads.append({"Sector 1": {"type": "FeatureCollection", "features": []}})
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(osm_utils.load_sector_boundaries()))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert all(set(result["sectors"]) == {"Sector 1"} for result in results)
+
+
+def test_refresh_keeps_individually_found_sectors(boundaries):
+    downloads, _ = boundaries
+    collection = {"type": "FeatureCollection", "features": []}
+    downloads.extend([{"Sector 1": collection}, {"Sector 2": collection}])
+
+    osm_utils.load_sector_boundaries()
+    osm_utils._remember_sector("Sector 3", collection)
+    data = osm_utils.load_sector_boundaries(force_refresh=True)
+
+    assert set(data["sectors"]) == {"Sector 1", "Sector 2", "Sector 3"}
+    assert osm_utils._read_boundary_file()["sectors"] == data["sectors"]
+
+
+def test_sectors_found_later_do_not_change_boundaries_being_read(boundaries):
+    downloads, _ = boundaries
+    collection = {"type": "FeatureCollection", "features": []}
+    downloads.append({"Sector 1": collection, "Sector 2": collection})
+
+    data = osm_utils.load_sector_boundaries()
+    sectors = iter(data["sectors"].items())
+    next(sectors)
+    osm_utils._remember_sector("Sector 3", collection)
+
+    assert [name for name, _ in sectors] == ["Sector 2"]
+    assert set(osm_utils.load_sector_boundaries()["sectors"]) == {"Sector 1", "Sector 2", "Sector 3"}
@@ -0,0 +1,40 @@
+import numpy as np
+
+from tile_utils import (
+    GreenClassifier, analyze_tile_image, analyze_tile_image_reference, classify_tile_stack,
+    green_mask_reference,
+)
+
+
+def all_colours_with_red(r):
+    g, b = np.meshgrid(np.arange(256), np.arange(256), indexing="ij")
+    return np.stack([np.full_like(g, r), g, b], axis=-1).astype(np.uint8)
+
+
+def test_green_mask_matches_reference_on_every_colour():
+    classifier = GreenClassifier()
+    for r in range(256):
+        pixels = all_colours_with_red(r)
+        assert np.array_equal(classifier.green_mask(pixels), green_mask_reference(pixels)), r
+
+
+def test_buffers_are_reused_across_shapes():
+    rng = np.random.default_rng(0)
+    classifier = GreenClassifier()
+    stack = rng.integers(0, 256, (3, 64, 64, 3), dtype=np.uint8)
+    tile = rng.integers(0, 256, (32, 32, 3), dtype=np.uint8)
+
+    assert np.array_equal(classifier.green_mask(stack), green_mask_reference(stack))
+    assert np.array_equal(classifier.green_mask(tile), green_mask_reference(tile))
+    assert np.array_equal(classifier.green_mask(stack), green_mask_reference(stack))
+
+
+def test_tile_counts_match_reference():
+    rng = np.random.default_rng(1)
+    stack = rng.integers(0, 256, (5, 256, 256, 3), dtype=np.uint8)
+
+    green, total = classify_tile_stack(stack)
+
+    assert total == 256 * 256
+    for tile, count in zip(stack, green):
+        assert analyze_tile_image(tile) == analyze_tile_image_reference(tile) == (count, total)
@@ -0,0 +1,100 @@
+import math
+
+import pytest
+from shapely.geometry import Point, shape
+from shapely.ops import unary_union
+
+from geo_encoding import build_topology, simplify_tolerance, simplify_zoom, topology_to_geojson
+
+
+def feature(geometry, name):
+    return {"type": "Feature", "geometry": geometry, "properties": {"name": name}}
+
+
+def square(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+
+def wavy(x0, y0, x1, y1, points=200):
+    """A rectangle whose right edge wiggles a little, shared with `neighbour`."""
+    edge = [[x1 + 1e-5 * math.sin(i), y0 + (y1 - y0) * i / points] for i in range(points + 1)]
+    return [[x0, y0]] + edge + [[x0, y1], [x0, y0]]
+
+
+def neighbour(x0, y0, x1, y1, x2, points=200):
+    edge = [[x1 + 1e-5 * math.sin(i), y0 + (y1 - y0) * i / points] for i in range(points + 1)]
+    return edge + [[x2, y1], [x2, y0], edge[0]]
+
+
+FEATURES = [
+    feature({"type": "Polygon", "coordinates": [
+        square(76.70, 30.70, 76.72, 30.72), square(76.705, 30.705, 76.71, 30.71),
+    ]}, "with hole"),
+    feature({"type": "Polygon", "coordinates": [square(76.72, 30.70, 76.74, 30.72)]}, "east"),
+    feature({"type": "MultiPolygon", "coordinates": [
+        [square(76.70, 30.73, 76.71, 30.74)], [square(76.73, 30.73, 76.74, 30.74)],
+    ]}, "split"),
+]
+
+
+def test_round_trip_preserves_shapes_and_properties():
+    topology = build_topology(FEATURES)
+    decoded = topology_to_geojson(topology)
+    grid = max(topology["transform"]["scale"])
+
+    assert [f["properties"] for f in decoded["features"]] == [f["properties"] for f in FEATURES]
+    for original, result in zip(FEATURES, decoded["features"]):
+        assert result["geometry"]["type"] == original["geometry"]["type"]
+        a, b = shape(original["geometry"]), shape(result["geometry"])
+        assert b.is_valid
+        # Off by at most the quantization grid
+        assert a.hausdorff_distance(b) <= grid
+        assert a.symmetric_difference(b).area < a.length * grid
+
+
+def test_shared_borders_are_stored_once():
+    topology = build_topology(FEATURES)
+    west, east = topology["objects"]["sectors"]["geometries"][:2]
+    west_arcs = {i for ring in west["arcs"] for i in ring}
+    east_arcs = {i for ring in east["arcs"] for i in ring}
+
+    # The common edge is an arc one feature walks forwards, the other backwards
+    assert any(~i in west_arcs for i in east_arcs)
+
+
+def test_simplified_neighbours_stay_seamless():
+    features = [
+        feature({"type": "Polygon", "coordinates": [wavy(76.70, 30.70, 76.72, 30.72)]}, "west"),
+        feature({"type": "Polygon", "coordinates": [neighbour(76.70, 30.70, 76.72, 30.72, 76.74)]}, "east"),
+    ]
+    full = build_topology(features)
+    simplified = build_topology(features, tolerance=simplify_tolerance(12))
+
+    assert sum(map(len, simplified["arcs"])) < sum(map(len, full["arcs"])) / 4
+    shapes = [shape(f["geometry"]) for f in topology_to_geojson(simplified)["features"]]
+    # No gaps or overlaps opened along the shared border
+    assert unary_union(shapes).area == pytest.approx(sum(s.area for s in shapes), rel=1e-9)
+    assert shapes[0].intersection(shapes[1]).area == pytest.approx(0, abs=1e-12)
+
+
+def test_collapsed_rings_are_dropped():
+    tiny = Point(76.71, 30.71).buffer(1e-6).exterior.coords
+    features = [feature({"type": "Polygon", "coordinates": [
+        square(76.70, 30.70, 76.72, 30.72), [list(p) for p in tiny],
+    ]}, "pinhole")]
+
+    decoded = topology_to_geojson(build_topology(features, tolerance=simplify_tolerance(10)))
+
+    assert len(decoded["features"][0]["geometry"]["coordinates"]) == 1
+
+
+def test_empty_collection():
+    topology = build_topology([])
+    assert topology["objects"]["sectors"]["geometries"] == []
+    assert topology_to_geojson(topology) == {"type": "FeatureCollection", "features": []}
+
+
+def test_simplify_levels():
+    assert simplify_zoom(9) == 10 and simplify_zoom(13) == 14 and simplify_zoom(17) is None
+    assert simplify_tolerance(17) == 0.0
+    assert simplify_tolerance(11) == simplify_tolerance(12) == simplify_tolerance(10) / 4
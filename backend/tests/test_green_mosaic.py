@@ -0,0 +1,156 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+import shapely
+from PIL import Image
+from shapely.geometry import MultiPolygon, Polygon, box
+
+import green_mosaic
+from green_mosaic import GreenMosaic, MosaicBuildError, build_mosaic
+from tile_utils import TILE_SIZE, deg2num, get_classifier, tile_bounds, tiles_for_bbox
+
+ZOOM = 14
+X0, Y0 = deg2num(30.74, 76.77, ZOOM)
+TILES_X, TILES_Y = 3, 2
+GREEN = (50, 140, 60)
+NOT_GREEN = (140, 130, 120)
+
+
+def tile_png(x, y):
+    """A tile of green and built-up blobs, different for every tile."""
+    rng = np.random.default_rng(x * 1000 + y)
+    blobs = rng.random((TILE_SIZE // 8, TILE_SIZE // 8)) < 0.4
+    mask = np.kron(blobs, np.ones((8, 8), dtype=bool))
+    mask ^= rng.random((TILE_SIZE, TILE_SIZE)) < 0.05
+    pixels = np.where(mask[..., None], GREEN, NOT_GREEN).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def truth_mask():
+    """The green mask of the whole mosaic, classified one tile at a time."""
+    mask = np.zeros((TILES_Y * TILE_SIZE, TILES_X * TILE_SIZE), dtype=bool)
+    for ty in range(TILES_Y):
+        for tx in range(TILES_X):
+            img = np.asarray(Image.open(BytesIO(tile_png(X0 + tx, Y0 + ty))).convert("RGB"))
+            mask[ty * TILE_SIZE:(ty + 1) * TILE_SIZE, tx * TILE_SIZE:(tx + 1) * TILE_SIZE] = \
+                get_classifier().green_mask(img)
+    return mask
+
+
+def pixel_to_lonlat(coords):
+    """(N, 2) mosaic pixel coordinates to lon/lat, the inverse of lonlat_to_pixels."""
+    n = 2.0 ** ZOOM * TILE_SIZE
+    px = coords[:, 0] + X0 * TILE_SIZE
+    py = coords[:, 1] + Y0 * TILE_SIZE
+    lon = px / n * 360.0 - 180.0
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * py / n))))
+    return np.column_stack([lon, lat])
+
+
+def to_lonlat(pixel_geom):
+    return shapely.transform(pixel_geom, pixel_to_lonlat)
+
+
+def inset_bbox(x_first, y_first, x_last, y_last):
+    """bbox just inside tiles [x_first, x_last] x [y_first, y_last]."""
+    west, _, _, north = tile_bounds(x_first, y_first, ZOOM)
+    _, south, east, _ = tile_bounds(x_last, y_last, ZOOM)
+    eps = 1e-6
+    return (west + eps, south + eps, east - eps, north - eps)
+
+
+@pytest.fixture(scope="module")
+def mosaic(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("mosaic") / "mosaic")
+    patch = pytest.MonkeyPatch()
+    patch.setattr(green_mosaic, "fetch_tile", lambda x, y, z, token: tile_png(x, y))
+    try:
+        metadata = build_mosaic(inset_bbox(X0, Y0, X0 + TILES_X - 1, Y0 + TILES_Y - 1), ZOOM, None, path)
+    finally:
+        patch.undo()
+    return GreenMosaic(path), metadata, truth_mask()
+
+
+def test_summed_area_table_matches_the_mask(mosaic):
+    view, metadata, truth = mosaic
+    expected = np.zeros((truth.shape[0] + 1, truth.shape[1] + 1), dtype=np.int64)
+    expected[1:, 1:] = truth.cumsum(axis=0).cumsum(axis=1)
+
+    assert (metadata["x0"], metadata["y0"], metadata["tiles_x"], metadata["tiles_y"]) == \
+        (X0, Y0, TILES_X, TILES_Y)
+    assert np.array_equal(np.asarray(view.integral), expected)
+    assert 0 < metadata["green_pixels"] == truth.sum() < truth.size
+    assert view.count(100, 300, 200, 700) == truth[100:300, 200:700].sum()
+
+
+def test_bbox_cover_counts_every_tile_under_the_bbox(mosaic):
+    view, _, truth = mosaic
+    west, south, east, north = tile_bounds(X0 + 1, Y0, ZOOM)
+    # Straddles the edge between the first two tile columns, within the first row
+    bbox = (west - (east - west) / 3, south + (north - south) / 2, west + (east - west) / 3, north - 1e-6)
+    assert tiles_for_bbox(bbox, ZOOM) == [(X0, Y0), (X0 + 1, Y0)]
+
+    cover = view.bbox_cover(bbox)
+
+    assert cover["green_pixels"] == truth[:TILE_SIZE, :2 * TILE_SIZE].sum()
+    assert (cover["total_pixels"], cover["tiles_total"]) == (2 * TILE_SIZE ** 2, 2)
+    outside = tile_bounds(X0 + TILES_X, Y0, ZOOM)
+    assert view.bbox_cover(outside) is None
+
+
+def brute_force(pixel_geom, truth):
+    """Green and total pixels whose centres are inside, and the tiles they fall in."""
+    rows, cols = np.mgrid[:truth.shape[0], :truth.shape[1]]
+    inside = shapely.contains_xy(pixel_geom, cols + 0.5, rows + 0.5)
+    touched = inside.reshape(TILES_Y, TILE_SIZE, TILES_X, TILE_SIZE).any(axis=(1, 3))
+    return int((inside & truth).sum()), int(inside.sum()), int(touched.sum())
+
+
+@pytest.mark.parametrize("pixel_geom", [
+    # Across the edge between the two tile rows
+    Polygon([(30.3, 200.7), (420.2, 230.1), (400.9, 330.4), (60.6, 310.2)]),
+    # With a hole, across all six tiles
+    Polygon([(10.2, 10.7), (750.1, 40.3), (700.6, 500.8), (20.4, 480.3)],
+            [[(200.3, 150.6), (560.7, 170.2), (540.1, 380.9), (230.8, 350.5)]]),
+    # Two parts, one a thin sliver
+    MultiPolygon([
+        Polygon([(520.5, 20.5), (740.2, 60.9), (600.3, 240.7)]),
+        Polygon([(100.1, 400.2), (600.7, 402.6), (600.9, 404.1), (100.3, 403.3)]),
+    ]),
+], ids=["two-rows", "hole", "multipolygon"])
+def test_geometry_cover_matches_a_brute_force_count(mosaic, pixel_geom):
+    view, _, truth = mosaic
+    green, total, tiles = brute_force(pixel_geom, truth)
+
+    cover = view.geometry_cover(to_lonlat(pixel_geom))
+
+    # Centres within rounding distance of an edge may land on either side
+    assert abs(cover["green_pixels"] - green) <= 1
+    assert abs(cover["total_pixels"] - total) <= 1
+    assert cover["tiles_total"] == tiles
+    assert cover["green_cover"] == pytest.approx(green / total * 100, abs=0.01)
+
+
+def test_geometry_outside_the_mosaic_is_not_covered(mosaic):
+    view, _, _ = mosaic
+    assert view.geometry_cover(to_lonlat(box(-300, 10, 100, 100))) is None
+
+
+def test_failed_tiles_keep_the_previous_mosaic(monkeypatch, tmp_path):
+    path = str(tmp_path / "mosaic")
+    bbox = inset_bbox(X0, Y0, X0 + 1, Y0)
+    monkeypatch.setattr(green_mosaic, "fetch_tile", lambda x, y, z, token: tile_png(x, y))
+    build_mosaic(bbox, ZOOM, None, path)
+
+    def fetch_tile(x, y, z, token):
+        if x == X0 + 1:
+            raise RuntimeError("HTTP 503")
+        return tile_png(x, y)
+
+    monkeypatch.setattr(green_mosaic, "fetch_tile", fetch_tile)
+    with pytest.raises(MosaicBuildError, match="1 of 2 tiles failed"):
+        build_mosaic(bbox, ZOOM, None, path)
+    assert GreenMosaic(path).metadata["tiles_x"] == 2
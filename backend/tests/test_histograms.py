@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from tile_utils import (
+    DEFAULT_THRESHOLDS, HUE_BINS, SAT_BINS, VAL_BINS, decode_histogram, encode_histogram,
+    hsv_bin_indices, hsv_bin_indices_reference, threshold_selector, tile_histograms,
+)
+
+
+def all_colours_with_red(r):
+    g, b = np.meshgrid(np.arange(256), np.arange(256), indexing="ij")
+    return np.stack([np.full_like(g, r), g, b], axis=-1).astype(np.uint8)
+
+
+def test_bin_indices_match_reference_on_every_colour():
+    for r in range(256):
+        pixels = all_colours_with_red(r)
+        assert np.array_equal(hsv_bin_indices(pixels), hsv_bin_indices_reference(pixels)), r
+
+
+def test_tile_histograms_count_tile_and_region_pixels():
+    rng = np.random.default_rng(0)
+    tile = rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)
+    region = np.zeros((256, 256), dtype=bool)
+    region[:100] = True
+
+    whole, inside = [decode_histogram(h) for h in tile_histograms(tile, [np.packbits(region).tobytes()])]
+
+    bins = hsv_bin_indices_reference(tile)
+    assert np.array_equal(whole, np.bincount(bins, minlength=len(whole)))
+    assert np.array_equal(inside, np.bincount(bins[region.ravel()], minlength=len(whole)))
+    assert whole.sum() == 256 * 256 and inside.sum() == 100 * 256
+
+
+def test_histogram_round_trip():
+    histogram = np.arange(HUE_BINS * SAT_BINS * VAL_BINS, dtype=np.uint32)
+    assert np.array_equal(decode_histogram(encode_histogram(histogram)), histogram)
+
+
+def selected(selector, hue, sat, val):
+    """Whether the bin holding (hue degrees, sat, val) is selected."""
+    h = min(int(hue / 360 * HUE_BINS), HUE_BINS - 1)
+    s = min(int(sat * SAT_BINS), SAT_BINS - 1)
+    v = min(int(val * VAL_BINS), VAL_BINS - 1)
+    return bool(selector[(h * SAT_BINS + s) * VAL_BINS + v])
+
+
+def test_default_selector_follows_default_thresholds():
+    selector = threshold_selector()
+    assert selector.shape == (HUE_BINS * SAT_BINS * VAL_BINS,)
+    assert np.array_equal(selector, threshold_selector(DEFAULT_THRESHOLDS))
+    assert selected(selector, 100, 0.6, 0.6)
+    assert not selected(selector, 20, 0.6, 0.6)
+    assert not selected(selector, 200, 0.6, 0.6)
+    assert not selected(selector, 100, 0.1, 0.6)
+    assert not selected(selector, 100, 0.6, 0.1)
+
+
+def test_selector_partial_and_wrapping_thresholds():
+    selector = threshold_selector({"hue_min": 60})
+    assert not selected(selector, 50, 0.6, 0.6)
+    assert selected(selector, 150, 0.6, 0.6)
+
+    wrapping = threshold_selector({"hue_min": 300, "hue_max": 30})
+    assert selected(wrapping, 350, 0.6, 0.6)
+    assert selected(wrapping, 10, 0.6, 0.6)
+    assert not selected(wrapping, 100, 0.6, 0.6)
+
+
+@pytest.mark.parametrize("thresholds", [
+    {"hue": 10}, {"hue_min": 400}, {"sat_max": 1.5}, {"val_min": -0.1},
+])
+def test_selector_rejects_bad_thresholds(thresholds):
+    with pytest.raises(ValueError):
+        threshold_selector(thresholds)
@@ -0,0 +1,178 @@
+import threading
+import time
+
+import pytest
+
+from jobs import FINISHED, JobCancelled, JobManager, JobQueueFull, JobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite"))
+
+
+def wait_for(store, job_id, statuses=FINISHED, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = store.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} is still {store.get(job_id)['status']}")
+
+
+def test_submitted_job_runs_to_its_result(store):
+    manager = JobManager(store, workers=1)
+
+    def run(params, context):
+        context.report(force=True, done=0, total=params["n"])
+        context.report(force=True, done=params["n"])
+        return {"sum": params["n"] * 2}
+
+    job_id = manager.submit("double", {"n": 21}, run)
+    job = wait_for(store, job_id)
+
+    assert job["status"] == "succeeded" and job["error"] is None
+    assert job["type"] == "double" and job["params"] == {"n": 21}
+    assert job["progress"] == {"done": 21, "total": 21}
+    assert store.result(job_id) == {"sum": 42}
+    # The slot is freed just after the job is marked finished
+    deadline = time.time() + 5
+    while manager.stats()["active"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert manager.stats()["active"] == 0
+
+
+def test_failed_job_keeps_its_error(store):
+    manager = JobManager(store, workers=1)
+
+    def run(params, context):
+        raise ValueError("no such sector")
+
+    job = wait_for(store, manager.submit("sector", {}, run))
+    assert (job["status"], job["error"]) == ("failed", "no such sector")
+    assert store.result(job["job_id"]) is None
+
+
+def test_cancelling_stops_a_running_job(store):
+    manager = JobManager(store, workers=1)
+    started = threading.Event()
+    steps = []
+
+    def run(params, context):
+        started.set()
+        for step in range(500):
+            try:
+                context.report(force=True, step=step)
+            except Exception:
+                # Computations catch their own errors; cancelling must get past them
+                pytest.fail("JobCancelled was caught as an error")
+            steps.append(step)
+            time.sleep(0.01)
+        return "finished anyway"
+
+    job_id = manager.submit("slow", {}, run)
+    started.wait(5)
+    wait_for(store, job_id, ("running",))
+    manager.cancel(job_id)
+    job = wait_for(store, job_id)
+    stopped_at = len(steps)
+    time.sleep(0.05)
+
+    assert job["status"] == "cancelled" and job["error"] is None
+    assert stopped_at < 500 and len(steps) == stopped_at
+    assert job["progress"]["step"] == stopped_at
+    assert store.result(job_id) is None
+    assert issubclass(JobCancelled, BaseException) and not issubclass(JobCancelled, Exception)
+
+
+def test_cancelling_a_queued_job_frees_its_slot(store):
+    manager = JobManager(store, workers=1, queue_limit=1)
+    release = threading.Event()
+    ran = []
+
+    first = manager.submit("block", {}, lambda params, context: release.wait(5))
+    second = manager.submit("queued", {}, lambda params, context: ran.append(True))
+    with pytest.raises(JobQueueFull):
+        manager.submit("refused", {}, lambda params, context: None)
+
+    manager.cancel(second)
+    assert store.get(second)["status"] == "cancelled"
+    third = manager.submit("accepted", {}, lambda params, context: "ok")
+    release.set()
+
+    assert wait_for(store, first)["status"] == "succeeded"
+    assert wait_for(store, third)["status"] == "succeeded"
+    assert ran == []
+
+
+def test_jobs_of_a_lost_worker_are_reported_failed(store, monkeypatch):
+    job_id = store.create("sector", {})
+    monkeypatch.setattr("jobs.JOB_LOST_AFTER", -1)
+
+    job = store.get(job_id)
+    assert job["status"] == "failed" and "went away" in job["error"]
+
+
+# -------------------------------
+# /api/jobs
+# -------------------------------
+
+@pytest.fixture
+def client(monkeypatch):
+    import app
+
+    release = threading.Event()
+
+    def run_sector_job(params, job):
+        job.report(sectors_done=0, sectors_total=1, force=True)
+        while not release.wait(0.01):
+            job.report(force=True)
+        return {"sector": params["sector"], "green_cover": 12.5}
+
+    monkeypatch.setitem(app.JOB_TYPES, "sector", run_sector_job)
+    yield app.app.test_client(), release
+    release.set()
+
+
+def test_job_endpoints(client):
+    import app
+
+    http, release = client
+    response = http.post("/api/jobs", json={"type": "sector", "sector": "Sector_17"})
+    assert response.status_code == 202
+    body = response.get_json()
+    job_id = body["job_id"]
+    assert body["status_url"] == f"/api/jobs/{job_id}"
+
+    wait_for(app.job_store, job_id, ("running",))
+    status = http.get(body["status_url"]).get_json()
+    assert status["params"] == {"mode": app.COVER_MODE, "sector": "Sector 17"}
+    assert http.get(body["result_url"]).status_code == 202
+
+    release.set()
+    wait_for(app.job_store, job_id)
+    response = http.get(body["result_url"])
+    assert response.status_code == 200
+    assert response.get_json() == {"sector": "Sector 17", "green_cover": 12.5}
+
+
+def test_cancel_endpoint(client):
+    import app
+
+    http, _ = client
+    job_id = http.post("/api/jobs", json={"type": "sector", "sector": "Sector 1"}).get_json()["job_id"]
+    wait_for(app.job_store, job_id, ("running",))
+
+    assert http.delete(f"/api/jobs/{job_id}").status_code == 200
+    assert wait_for(app.job_store, job_id)["status"] == "cancelled"
+    assert http.get(f"/api/jobs/{job_id}/result").status_code == 409
+
+
+def test_unknown_and_invalid_jobs(client):
+    http, _ = client
+    assert http.get("/api/jobs/nope").status_code == 404
+    assert http.get("/api/jobs/nope/result").status_code == 404
+    assert http.delete("/api/jobs/nope").status_code == 404
+    assert http.post("/api/jobs", json={"type": "teleport"}).status_code == 400
+    assert http.post("/api/jobs", json={"type": "sector"}).status_code == 400
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import metrics
+from metrics import Counter, Histogram, merge, render
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def definitions():
+    """Metrics that only exist for the length of a test."""
+    yield Counter("test_requests_total", "Requests, by route"), \
+        Histogram("test_latency_seconds", "Request latency", buckets=(0.1, 1))
+    metrics._definitions.pop("test_requests_total")
+    metrics._definitions.pop("test_latency_seconds")
+
+
+def test_render_counters_and_histograms(definitions):
+    values = {
+        ("test_requests_total", (("route", 'say "hi"\n'),)): 3,
+        ("test_latency_seconds", (("route", "a"),)): [2, 1, 1, 5.5],
+    }
+
+    lines = render(values).splitlines()
+
+    assert "# TYPE test_requests_total counter" in lines
+    assert 'test_requests_total{route="say \\"hi\\"\\n"} 3' in lines
+    assert "# TYPE test_latency_seconds histogram" in lines
+    i = lines.index('test_latency_seconds_bucket{route="a",le="0.1"} 2')
+    assert lines[i:i + 5] == [
+        'test_latency_seconds_bucket{route="a",le="0.1"} 2',
+        'test_latency_seconds_bucket{route="a",le="1"} 3',
+        'test_latency_seconds_bucket{route="a",le="+Inf"} 4',
+        'test_latency_seconds_sum{route="a"} 5.5',
+        'test_latency_seconds_count{route="a"} 4',
+    ]
+
+
+def test_merge_adds_counters_and_histogram_buckets():
+    first = {("c", ()): 2, ("h", ()): [1, 0, 0, 0.05]}
+    second = {("c", ()): 3, ("h", ()): [0, 1, 1, 7.5], ("d", ()): 1}
+
+    total = merge(second, merge(first, {}))
+
+    assert total == {("c", ()): 5, ("h", ()): [1, 1, 1, 7.55], ("d", ()): 1}
+    assert first == {("c", ()): 2, ("h", ()): [1, 0, 0, 0.05]}
+
+
+WORKER = f"""
+import sys
+sys.path.insert(0, {BACKEND!r})
+import metrics
+metrics.share_metrics()
+metrics.UPSTREAM_RESPONSES.inc(3, host="metrics.test", status=200)
+metrics.UPSTREAM_SECONDS.observe(2.0, host="metrics.test")
+metrics.flush()
+"""
+
+
+def test_metrics_endpoint_merges_every_worker():
+    import app
+
+    assert metrics.METRICS_PATH == os.environ["METRICS_PATH"]
+    metrics.UPSTREAM_RESPONSES.inc(2, host="metrics.test", status=200)
+    metrics.UPSTREAM_SECONDS.observe(0.02, host="metrics.test")
+    # Another worker process records into the same metrics database
+    subprocess.run([sys.executable, "-c", WORKER], check=True, cwd=BACKEND)
+
+    response = app.app.test_client().get("/metrics")
+    lines = response.get_data(as_text=True).splitlines()
+
+    assert response.status_code == 200
+    assert 'greencover_upstream_responses_total{host="metrics.test",status="200"} 5' in lines
+    assert 'greencover_upstream_request_seconds_bucket{host="metrics.test",le="0.025"} 1' in lines
+    assert 'greencover_upstream_request_seconds_bucket{host="metrics.test",le="2.5"} 2' in lines
+    assert 'greencover_upstream_request_seconds_count{host="metrics.test"} 2' in lines
+    assert 'greencover_upstream_request_seconds_sum{host="metrics.test"} 2.02' in lines
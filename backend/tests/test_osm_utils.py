@@ -0,0 +1,105 @@
+import pytest
+from shapely.geometry import shape
+
+from osm_utils import build_polygon_from_relation, connect_ways, orient_ring
+
+
+def square(x0, y0, size):
+    return [(x0, y0), (x0 + size, y0), (x0 + size, y0 + size), (x0, y0 + size), (x0, y0)]
+
+
+def split(ring, parts):
+    """Cut a closed ring into `parts` ways sharing end points."""
+    step = (len(ring) - 1) // parts
+    cuts = [i * step for i in range(parts)] + [len(ring) - 1]
+    return [ring[a:b + 1] for a, b in zip(cuts, cuts[1:])]
+
+
+def same_ring(a, b):
+    return shape({"type": "Polygon", "coordinates": [a]}).equals(
+        shape({"type": "Polygon", "coordinates": [b]})
+    )
+
+
+def test_connects_shuffled_and_reversed_ways_into_rings():
+    first = [(0, 0), (1, 0), (2, 0), (2, 1), (2, 2), (1, 2), (0, 2), (0, 1), (0, 0)]
+    second = square(5, 5, 1)
+    ways = split(first, 4) + [square(10, 10, 1)]
+    ways[1] = ways[1][::-1]
+    ways = [ways[2], ways[4], ways[0], ways[3], ways[1]] + [second[:3], second[2:][::-1]]
+
+    rings = connect_ways(ways)
+    assert len(rings) == 3
+    for ring in rings:
+        assert ring[0] == ring[-1]
+    for expected in (first, second, square(10, 10, 1)):
+        assert sum(same_ring(ring, expected) for ring in rings) == 1
+
+
+def test_open_chain_is_closed_across_its_gap():
+    ring = square(0, 0, 2)
+    # The closing side is missing, and the chain is listed from its middle
+    ways = [ring[1:3], ring[2:4], ring[0:2]]
+
+    (closed,) = connect_ways(ways)
+    assert closed[0] == closed[-1]
+    assert same_ring(closed, ring)
+
+
+def test_open_chain_is_extended_backwards_in_order():
+    line = [(i, i % 2) for i in range(9)]
+    ways = [line[i:i + 2] for i in range(8)]
+    # Start in the middle; the pieces before it are found walking backwards,
+    # some of them drawn the other way round
+    ways = [ways[4], ways[5], ways[6], ways[7], ways[3][::-1], ways[2], ways[1][::-1], ways[0]]
+
+    (closed,) = connect_ways(ways)
+    assert closed == line + [line[0]]
+
+
+def test_chains_too_short_for_a_ring_are_dropped(capsys):
+    assert connect_ways([[(0, 0), (1, 1)]]) == []
+    assert "Dropped 1" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("clockwise", [True, False])
+def test_orient_ring(clockwise):
+    for ring in (square(0, 0, 1), square(0, 0, 1)[::-1]):
+        oriented = orient_ring(ring, clockwise)
+        area = sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(oriented, oriented[1:]))
+        assert (area < 0) == clockwise
+
+
+def relation(*members):
+    ways = {}
+    refs = []
+    for i, (role, coords) in enumerate(members):
+        ways[i] = {"geometry": [{"lon": x, "lat": y} for x, y in coords]}
+        refs.append({"type": "way", "ref": i, "role": role})
+    return {"id": 1, "members": refs}, ways
+
+
+def test_relation_with_several_outers_becomes_a_multipolygon_with_holes():
+    big, island, hole = square(0, 0, 10), square(20, 0, 2), square(2, 2, 2)
+    rel, ways = relation(
+        *[("outer", part) for part in split(big, 2)],
+        ("outer", island),
+        ("inner", hole),
+    )
+
+    geometry = build_polygon_from_relation(rel, ways, {})
+    assert geometry["type"] == "MultiPolygon"
+    polygons = sorted(shape(geometry).geoms, key=lambda polygon: polygon.area)
+    assert polygons[0].equals(shape({"type": "Polygon", "coordinates": [island]}))
+    assert polygons[1].area == pytest.approx(100 - 4)
+    assert len(polygons[1].interiors) == 1
+    assert shape(geometry).is_valid
+
+
+def test_relation_with_one_outer_becomes_a_polygon():
+    rel, ways = relation(("outer", square(0, 0, 1)))
+    geometry = build_polygon_from_relation(rel, ways, {})
+    assert geometry["type"] == "Polygon"
+    # RFC 7946: exterior rings counterclockwise
+    ring = geometry["coordinates"][0]
+    assert sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:])) > 0
@@ -0,0 +1,31 @@
+import numpy as np
+from PIL import Image
+
+from overlay_tiles import coverage_from_image, downsample, green_overlay_tile
+from tile_utils import TILE_SIZE, analyze_tile_image, deg2num
+
+CITY = (76.74, 30.70, 76.81, 30.78)
+
+
+def test_coverage_counts_match_the_classifier():
+    rng = np.random.default_rng(1)
+    img = Image.fromarray(rng.integers(0, 256, (TILE_SIZE, TILE_SIZE, 3), dtype=np.uint8))
+
+    coverage, green, total = coverage_from_image(img)
+    assert (green, total) == analyze_tile_image(img)
+    assert np.count_nonzero(coverage == 255) == green
+    assert np.count_nonzero(coverage) == green
+
+
+def test_downsample_averages_children():
+    full = np.full((TILE_SIZE, TILE_SIZE), 255, dtype=np.uint8)
+    empty = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+    parent = downsample([[full, empty], [empty, empty]])
+    assert parent.shape == (TILE_SIZE, TILE_SIZE)
+    assert parent[0, 0] == 255 and parent[-1, -1] == 0
+    assert parent[: TILE_SIZE // 2, : TILE_SIZE // 2].min() == 255
+
+
+def test_tiles_outside_the_extent_are_not_rendered():
+    x, y = deg2num(48.85, 2.35, 13)
+    assert green_overlay_tile(13, x, y, 17, None, CITY) is None
@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import rate_governor
+from rate_governor import GovernorStore, HostGovernor, get_governor, governed_get
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = b""
+
+
+class Session:
+    def __init__(self, outcome):
+        self.outcome = outcome
+
+    def get(self, url, **kwargs):
+        if isinstance(self.outcome, BaseException):
+            raise self.outcome
+        return self.outcome
+
+
+@pytest.mark.parametrize("error", [
+    requests.ConnectionError("refused"), ValueError("bad content"), KeyboardInterrupt(),
+])
+def test_slot_is_released_whatever_the_request_raises(error):
+    governor = get_governor("release.test")
+    with pytest.raises(type(error)):
+        governed_get("http://release.test/tile", session=Session(error))
+    assert governor.in_flight == 0
+
+
+def test_slot_is_released_on_response():
+    governor = get_governor("ok.test")
+    assert governed_get("http://ok.test/tile", session=Session(Response(200))).status_code == 200
+    assert governor.in_flight == 0
+    assert governor.stats()["requests"] == 1
+
+
+def test_retry_after_pauses_the_host():
+    governor = get_governor("throttled.test")
+    response = Response(429, {"Retry-After": "5"})
+    governed_get("http://throttled.test/tile", session=Session(response))
+    stats = governor.stats()
+    assert stats["in_flight"] == 0
+    assert stats["throttled"] == 1
+    assert 4 < stats["paused_for"] <= 5
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two governors of one host on the same store, as two worker processes have."""
+    store = GovernorStore(str(tmp_path / "governor.sqlite"))
+    return [HostGovernor("shared.test", rate=100, concurrency=1, max_concurrency=1, store=store)
+            for _ in range(2)]
+
+
+def test_concurrency_is_shared_between_workers(workers):
+    first, second = workers
+    slot = first.acquire()
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (second.release(0.01, 200, slot=second.acquire()),
+                                              acquired.set()))
+    thread.start()
+
+    assert not acquired.wait(0.3)
+    first.release(0.01, 200, slot=slot)
+    assert acquired.wait(2)
+    thread.join()
+    assert first.stats()["in_flight"] == second.stats()["in_flight"] == 0
+
+
+def test_rate_is_shared_between_workers(tmp_path):
+    store = GovernorStore(str(tmp_path / "governor.sqlite"))
+    first, second = [HostGovernor("rate.test", rate=5, concurrency=4, max_concurrency=4, store=store)
+                     for _ in range(2)]
+    started = time.time()
+    for _ in range(5):
+        for governor in (first, second):
+            governor.release(0.01, 200, slot=governor.acquire())
+
+    # Ten requests at 5/s from a burst of 4 take over a second, not half that
+    assert time.time() - started > 1.0
+
+
+def test_retry_after_pauses_every_worker(workers):
+    first, second = workers
+    first.release(0.01, 429, retry_after=0.5, slot=first.acquire())
+
+    assert second.stats()["paused_for"] > 0.3
+    started = time.time()
+    second.release(0.01, 200, slot=second.acquire())
+    assert time.time() - started > 0.3
+
+
+def test_slots_of_dead_workers_expire(workers, monkeypatch):
+    first, second = workers
+    monkeypatch.setattr(rate_governor, "GOVERNOR_SLOT_TTL", 0.2)
+    first.acquire()  # never released
+
+    started = time.time()
+    second.release(0.01, 200, slot=second.acquire())
+    assert 0.15 < time.time() - started < 2
@@ -0,0 +1,114 @@
+import sqlite3
+import time
+
+import pytest
+
+from sector_cache import FAILED_SECTOR_TTL, SectorCache
+
+MODE = "bbox"
+VERSION = "v1"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SectorCache(str(tmp_path / "sectors.sqlite"), ttl=3600)
+
+
+def result(sector):
+    return {"sector": sector, "green_cover": 42.0}
+
+
+def test_put_and_get_many(cache):
+    cache.put_many(MODE, {"Sector 1": result("Sector 1"), "Sector 2": None}, VERSION)
+
+    found = cache.get_many(MODE, ["Sector 1", "Sector 2", "Sector 3"], VERSION)
+
+    assert set(found) == {"Sector 1", "Sector 2"}
+    assert found["Sector 1"].result == result("Sector 1") and found["Sector 1"].fresh
+    assert found["Sector 2"].result is None and found["Sector 2"].fresh
+    assert cache.get_many("polygon", ["Sector 1"], VERSION) == {}
+    assert cache.get_many(MODE, ["Sector 1"], "v2") == {}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["writes"]) == (2, 3, 2)
+
+
+def test_failed_sectors_expire_sooner(cache):
+    cache.put_many(MODE, {"Sector 1": result("Sector 1"), "Sector 2": None}, VERSION)
+
+    rows = dict(cache._connect().execute("SELECT sector, expires_at - computed_at FROM sector_results"))
+
+    assert rows["Sector 1"] == pytest.approx(3600)
+    assert rows["Sector 2"] == pytest.approx(FAILED_SECTOR_TTL)
+
+
+def test_touch_reports_cached_stale_and_newest(cache):
+    cache.put_many(MODE, {"Sector 1": result("Sector 1")}, VERSION)
+    time.sleep(0.01)
+    cache.put_many(MODE, {"Sector 2": result("Sector 2")}, VERSION)
+    newest = cache.last_modified(MODE, VERSION)[1]
+
+    assert cache.touch(MODE, ["Sector 1", "Sector 2", "Sector 3"], VERSION) == (2, 0, newest)
+
+    cache.expire()
+    assert cache.touch(MODE, ["Sector 1", "Sector 2"], VERSION) == (2, 2, 0)
+
+
+def test_expired_entries_are_served_stale_and_claimed_once(cache):
+    cache.put_many(MODE, {"Sector 1": result("Sector 1"), "Sector 2": result("Sector 2")}, VERSION)
+    cache.expire()
+
+    found = cache.get_many(MODE, ["Sector 1"], VERSION)
+    assert found["Sector 1"].result == result("Sector 1") and not found["Sector 1"].fresh
+
+    claimed = cache.claim_stale()
+    assert sorted(claimed) == [(MODE, "Sector 1"), (MODE, "Sector 2")]
+    # Sector 1 was requested again, so it is the more urgent one
+    assert claimed[0] == (MODE, "Sector 1")
+    assert cache.claim_stale() == []
+
+    cache.put_many(MODE, {"Sector 1": result("Sector 1")}, VERSION, refreshed=True)
+    cache.release([(MODE, "Sector 2")])
+    assert cache.get_many(MODE, ["Sector 1"], VERSION)["Sector 1"].fresh
+    assert cache.claim_stale() == [(MODE, "Sector 2")]
+
+
+def test_seed_many_keeps_current_entries(cache):
+    cache.put_many(MODE, {"Sector 1": result("Sector 1")}, VERSION)
+    computed_at = time.time() - 60
+
+    added = cache.seed_many(MODE, {
+        "Sector 1": ({"sector": "Sector 1", "green_cover": 0.0}, computed_at),
+        "Sector 2": (result("Sector 2"), computed_at),
+    }, VERSION)
+
+    found = cache.get_many(MODE, ["Sector 1", "Sector 2"], VERSION)
+    assert added == 1
+    assert found["Sector 1"].result == result("Sector 1")
+    assert found["Sector 2"].computed_at == computed_at and found["Sector 2"].fresh
+
+    # Entries of another version are replaced
+    assert cache.seed_many(MODE, {"Sector 1": (None, computed_at)}, "v2") == 1
+    assert cache.get_many(MODE, ["Sector 1"], "v2")["Sector 1"].result is None
+
+
+def test_reads_do_not_wait_for_writers(cache):
+    cache.put_many(MODE, {"Sector 1": result("Sector 1")}, VERSION)
+    writer = sqlite3.connect(cache.path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.time()
+        assert set(cache.get_many(MODE, ["Sector 1"], VERSION, record=False)) == {"Sector 1"}
+        assert time.time() - started < 1
+    finally:
+        writer.execute("ROLLBACK")
+        writer.close()
+
+
+def test_recorded_lookups_count_requests(cache):
+    cache.put_many(MODE, {"Sector 1": result("Sector 1"), "Sector 2": result("Sector 2")}, VERSION)
+    cache.get_many(MODE, ["Sector 1", "Sector 3"], VERSION)
+    cache.get_many(MODE, ["Sector 1"], VERSION)
+    cache.get_many(MODE, ["Sector 2"], VERSION, record=False)
+
+    requests = dict(cache._connect().execute("SELECT sector, requests FROM sector_results"))
+    assert requests == {"Sector 1": 2, "Sector 2": 0}
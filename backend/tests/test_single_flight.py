@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+import single_flight
+from single_flight import LeaseStore, SingleFlight
+
+
+@pytest.fixture
+def leases(tmp_path):
+    return LeaseStore(str(tmp_path / "leases.sqlite"))
+
+
+def test_lease_is_exclusive_until_released_or_expired(leases):
+    assert leases.acquire("key", "a")
+    assert not leases.acquire("key", "b")
+    # Only the owner can release it
+    leases.release("key", "b")
+    assert not leases.acquire("key", "b")
+    leases.release("key", "a")
+    assert leases.acquire("key", "b")
+
+    assert leases.acquire("other", "a", ttl=0.05)
+    time.sleep(0.1)
+    assert leases.acquire("other", "b")
+
+    stats = leases.stats()
+    assert (stats["acquired"], stats["contended"], stats["held"]) == (4, 2, 2)
+
+
+def test_concurrent_callers_share_one_computation():
+    flight = SingleFlight()
+    started = threading.Event()
+    finish = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        finish.wait(5)
+        return "result"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", compute)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("key", compute)))
+                 for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.stats()["followers"] < 3:
+        time.sleep(0.01)
+    finish.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "followers": 3, "in_flight": 0}
+    # Once finished, the next caller computes again
+    assert flight.do("key", compute) == "result" and len(calls) == 2
+
+
+def test_followers_get_the_leaders_error():
+    flight = SingleFlight()
+    started = threading.Event()
+    finish = threading.Event()
+
+    def compute():
+        started.set()
+        finish.wait(5)
+        raise RuntimeError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", compute)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    while flight.stats()["followers"] < 1:
+        time.sleep(0.01)
+    finish.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(errors) == 2 and errors[0] is errors[1]
+
+
+def test_waits_for_the_result_of_another_worker(leases, monkeypatch):
+    monkeypatch.setattr(single_flight, "FLIGHT_POLL_INTERVAL", 0.01)
+    flight = SingleFlight(leases)
+    leases.acquire("key", "other worker")
+    stored = []
+
+    def lookup():
+        return stored[0] if stored else None
+
+    threading.Timer(0.1, stored.append, ["theirs"]).start()
+
+    assert flight.do("key", lambda: "ours", lookup) == "theirs"
+
+
+def test_takes_over_the_lease_of_a_dead_worker(leases, monkeypatch):
+    monkeypatch.setattr(single_flight, "FLIGHT_POLL_INTERVAL", 0.01)
+    flight = SingleFlight(leases)
+    leases.acquire("key", "dead worker", ttl=0.1)
+
+    assert flight.do("key", lambda: "ours", lambda: None) == "ours"
+    # The lease is released once the computation is done
+    assert leases.stats()["held"] == 0
@@ -0,0 +1,102 @@
+import gzip
+import json
+import time
+
+import pytest
+
+import osm_utils
+from snapshot import load_snapshot, write_snapshot
+
+BOUNDARIES = {"version": osm_utils.BOUNDARY_CACHE_VERSION, "fetched_at": time.time(),
+              "sectors": {"Sector 1": {"type": "FeatureCollection", "features": []}}}
+
+
+def bundle(sectors, computed_at):
+    entries = {sector: ({"sector": sector, "green_cover": 30.0}, computed_at) for sector in sectors}
+    body = json.dumps({"sectors": sorted(sectors), "from": "snapshot"}).encode()
+    return (len(entries), computed_at), entries, "etag-" + str(len(entries)), gzip.compress(body, mtime=0)
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.bin")
+    bbox = bundle(["Sector 1", "Sector 2"], 1234.5)
+
+    size = write_snapshot(path, "v1", BOUNDARIES, {"bbox": bbox})
+    snapshot = load_snapshot("v1", path)
+
+    assert size == (tmp_path / "snapshot.bin").stat().st_size
+    assert snapshot.version == "v1" and snapshot.modes == ["bbox"]
+    assert time.time() - snapshot.created_at < 60
+    assert snapshot.boundaries() == BOUNDARIES
+    assert snapshot.sectors("bbox") == {
+        sector: (result, computed_at) for sector, (result, computed_at) in bbox[1].items()
+    }
+    assert snapshot.response("bbox") == (bbox[0], bbox[2], bbox[3])
+
+
+def test_unusable_snapshots_are_ignored(tmp_path):
+    path = tmp_path / "snapshot.bin"
+    assert load_snapshot("v1", str(path)) is None
+    assert load_snapshot("v1", "") is None
+
+    write_snapshot(str(path), "v1", BOUNDARIES, {})
+    assert load_snapshot("v2", str(path)) is None
+
+    path.write_bytes(b"not a snapshot at all")
+    assert load_snapshot("v1", str(path)) is None
+
+
+@pytest.fixture
+def app_state(monkeypatch, tmp_path):
+    import app
+
+    monkeypatch.setattr(osm_utils, "BOUNDARY_CACHE_PATH", str(tmp_path / "boundaries.json"))
+    osm_utils.clear_boundary_cache()
+    app.sector_cache.clear()
+    with app.encoded_lock:
+        app.encoded_cache.clear()
+    yield app
+    osm_utils.clear_boundary_cache()
+    app.sector_cache.clear()
+    with app.encoded_lock:
+        app.encoded_cache.clear()
+
+
+def test_restore_serves_the_bundled_response(app_state, tmp_path):
+    app = app_state
+    path = str(tmp_path / "snapshot.bin")
+    stamp, entries, etag, compressed = bbox = bundle(app.CHANDIGARH_SECTORS, time.time() - 60)
+    write_snapshot(path, app.SECTOR_CACHE_VERSION, BOUNDARIES, {"bbox": bbox})
+
+    app.restore_snapshot(path)
+
+    assert osm_utils.load_sector_boundaries() == BOUNDARIES
+    cached = app.sector_cache.get_many("bbox", app.CHANDIGARH_SECTORS, app.SECTOR_CACHE_VERSION)
+    assert {sector: (entry.result, entry.computed_at) for sector, entry in cached.items()} == entries
+
+    client = app.app.test_client()
+    response = client.get("/api/all-sectors?mode=bbox", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.get_data() == compressed
+    assert response.headers["ETag"] == f'"{etag}"'
+    response = client.get("/api/all-sectors?mode=bbox", headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+
+
+def test_restore_keeps_filled_caches(app_state, tmp_path):
+    app = app_state
+    path = str(tmp_path / "snapshot.bin")
+    sector = app.CHANDIGARH_SECTORS[0]
+    mine = {"sector": sector, "green_cover": 55.0}
+    app.sector_cache.put_many("bbox", {sector: mine}, app.SECTOR_CACHE_VERSION)
+    newer = dict(BOUNDARIES, fetched_at=BOUNDARIES["fetched_at"] + 1)
+    osm_utils.seed_boundaries(newer)
+    write_snapshot(path, app.SECTOR_CACHE_VERSION, BOUNDARIES,
+                   {"bbox": bundle(app.CHANDIGARH_SECTORS, time.time() - 60)})
+
+    app.restore_snapshot(path)
+
+    assert osm_utils.load_sector_boundaries() == newer
+    cached = app.sector_cache.get_many("bbox", app.CHANDIGARH_SECTORS, app.SECTOR_CACHE_VERSION)
+    assert len(cached) == len(app.CHANDIGARH_SECTORS)
+    assert cached[sector].result == mine
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+import tile_fetch
+from benchmarks.standin import StandIn
+from rate_governor import get_governor
+from tile_fetch import TileFetchError, get_with_retries, iter_fetch
+
+TILE = "/styles/v1/test/style/tiles/256/17/93600/54000"
+
+
+@pytest.fixture
+def standin():
+    server = StandIn().start()
+    yield server
+    server.stop()
+
+
+def host(server):
+    return server.url.split("://", 1)[1]
+
+
+def test_retry_after_pauses_the_host_then_the_request_is_retried(standin):
+    standin.throttle_rate = 1.0
+
+    def stop_throttling():
+        while standin.stats()["throttled"] == 0:
+            time.sleep(0.005)
+        standin.throttle_rate = 0.0
+
+    threading.Thread(target=stop_throttling, daemon=True).start()
+    started = time.time()
+    response = get_with_retries(standin.url + TILE, retries=2)
+
+    assert response.status_code == 200 and response.content.startswith(b"\x89PNG")
+    assert standin.stats()["throttled"] == 1 and standin.stats()["tiles"] == 1
+    # The stand-in answers 429 with Retry-After: 1
+    assert time.time() - started >= 0.9
+    assert get_governor(host(standin)).stats()["throttled"] == 1
+
+
+def test_the_last_response_is_returned_when_retries_run_out(standin, monkeypatch):
+    standin.throttle_rate = 1.0
+    monkeypatch.setattr("rate_governor.MAX_RETRY_AFTER", 0.05)
+
+    response = get_with_retries(standin.url + TILE, retries=2)
+
+    assert response.status_code == 429
+    assert standin.stats()["throttled"] == 3
+
+
+def test_other_errors_are_not_retried(standin):
+    response = get_with_retries(standin.url + "/no/such/path", retries=3)
+
+    assert response.status_code == 404
+    assert get_governor(host(standin)).stats()["requests"] == 1
+
+
+def test_connection_errors_back_off_then_raise(monkeypatch):
+    monkeypatch.setattr(tile_fetch, "TILE_FETCH_BACKOFF", 0.05)
+    server = StandIn().start()
+    url = server.url
+    server.stop()
+
+    started = time.time()
+    with pytest.raises(TileFetchError, match="ConnectionError"):
+        get_with_retries(url + TILE, retries=2)
+    # Backoff of 0.05 and 0.1 seconds, each jittered by 0.5-1.5x
+    assert time.time() - started >= 0.07
+    assert get_governor(host(server)).stats()["requests"] == 3
+
+
+def test_iter_fetch_yields_every_key_once():
+    def fetch(key):
+        if key % 3 == 0:
+            raise TileFetchError(f"tile {key} failed")
+        time.sleep(0.001 * (10 - key))
+        return f"data {key}"
+
+    results = {key: (data, error) for key, data, error in iter_fetch(range(10), fetch)}
+
+    assert set(results) == set(range(10))
+    for key, (data, error) in results.items():
+        if key % 3 == 0:
+            assert (data, error) == (None, f"tile {key} failed")
+        else:
+            assert (data, error) == (f"data {key}", None)
@@ -0,0 +1,88 @@
+from io import BytesIO
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import tile_pipeline
+from tile_pipeline import classify_encoded_tiles, coverage_encoded_tiles
+
+
+def encoded_tiles(count, seed=0):
+    """(key, PNG bytes, regions) items with random pixels, every third one clipped to a region."""
+    rng = np.random.default_rng(seed)
+    region = np.zeros((256, 256), dtype=bool)
+    region[:, :100] = True
+    items = []
+    for i in range(count):
+        buffer = BytesIO()
+        Image.fromarray(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8)).save(buffer, "PNG")
+        regions = [np.packbits(region).tobytes()] if i % 3 == 0 else []
+        items.append((i, buffer.getvalue(), regions))
+    items.append((count, b"not a png", []))
+    return items
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Run the pipeline with one spawned classifier process."""
+    monkeypatch.setattr(tile_pipeline, "TILE_PROCESS_WORKERS", 1)
+    monkeypatch.setattr(tile_pipeline, "_pool", None)
+    yield tile_pipeline.get_process_pool()
+    tile_pipeline._pool.shutdown()
+
+
+def without_error_text(results):
+    # Decoder messages name object addresses, which differ between processes
+    return [result[:-1] + (result[-1] is not None,) for result in results]
+
+
+def run_locally(monkeypatch, run, *args, **kwargs):
+    with monkeypatch.context() as patch:
+        patch.setattr(tile_pipeline, "TILE_PROCESS_WORKERS", 0)
+        return list(run(*args, **kwargs))
+
+
+def test_process_pool_counts_match_in_process(pool, monkeypatch):
+    tiles = encoded_tiles(7)
+
+    shared = list(classify_encoded_tiles(tiles, batch_size=3, histograms=True))
+    local = run_locally(monkeypatch, classify_encoded_tiles, tiles, batch_size=3, histograms=True)
+
+    assert [result[0] for result in shared] == [key for key, _, _ in tiles]
+    assert without_error_text(shared) == without_error_text(local)
+    assert shared[0][3] and shared[-1][5] is not None
+
+
+def test_process_pool_coverage_matches_in_process(pool, monkeypatch):
+    tiles = encoded_tiles(4, seed=1)
+
+    shared = list(coverage_encoded_tiles(tiles, batch_size=2))
+    local = run_locally(monkeypatch, coverage_encoded_tiles, tiles, batch_size=2)
+
+    assert len(shared) == len(local) == len(tiles)
+    for a, b in zip(shared, local):
+        assert a[:3] == b[:3] and (a[4] is None) == (b[4] is None)
+        assert (a[3] is None and b[3] is None) or np.array_equal(a[3], b[3])
+    assert shared[-1][4] is not None
+
+
+def test_failed_submit_frees_the_segment(monkeypatch):
+    created = []
+
+    class SharedMemory(shared_memory.SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self.name)
+
+    class BrokenPool:
+        def submit(self, *args):
+            raise RuntimeError("pool is broken")
+
+    monkeypatch.setattr(shared_memory, "SharedMemory", SharedMemory)
+    with pytest.raises(RuntimeError):
+        tile_pipeline._submit(BrokenPool(), encoded_tiles(1), tile_pipeline._classify_shared_batch)
+
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=created[0])
@@ -0,0 +1,128 @@
+
+import sqlite3
+import time
+
+import pytest
+
+from tile_store import LOOKUP_CHUNK, RenderedTileCache, TileResultCache, TileStore
+
+STYLE = "test/style"
+Z = 17
+
+
+@pytest.fixture
+def stores(tmp_path):
+    path = str(tmp_path / "tiles.sqlite")
+    return TileStore(path), TileResultCache(path, ttl=60, history_limit=3)
+
+
+def age(results, table, seconds):
+    results._connect().execute(f"UPDATE {table} SET computed_at = computed_at - ?", (seconds,))
+
+
+def test_results_are_current_within_the_ttl(stores):
+    tiles, results = stores
+    tiles.put(Z, 1, 2, STYLE, b"imagery")
+    results.put_many(STYLE, Z, 1, {(1, 2): (10, 100)})
+
+    assert results.get_many(STYLE, Z, 1, [(1, 2), (3, 4)]) == {(1, 2): (10, 100)}
+    assert results.get_many(STYLE, Z, 2, [(1, 2)]) == {}
+
+
+def test_newer_imagery_invalidates_results_regardless_of_ttl(stores):
+    tiles, results = stores
+    tiles.put(Z, 1, 2, STYLE, b"imagery")
+    results.put_many(STYLE, Z, 1, {(1, 2): (10, 100)})
+    time.sleep(0.01)
+    tiles.put(Z, 1, 2, STYLE, b"new imagery")
+
+    assert results.get_many(STYLE, Z, 1, [(1, 2)]) == {}
+
+
+def test_old_results_stay_current_while_imagery_is_confirmed_unchanged(stores):
+    tiles, results = stores
+    tiles.put(Z, 1, 2, STYLE, b"imagery")
+    results.put_many(STYLE, Z, 1, {(1, 2): (10, 100)})
+    age(results, "tile_results", 3600)
+    tiles._connect().execute(
+        "UPDATE tiles SET fetched_at = fetched_at - 3600, changed_at = changed_at - 3600"
+    )
+    assert results.get_many(STYLE, Z, 1, [(1, 2)]) == {}
+
+    # Same bytes downloaded again: changed_at doesn't move
+    tiles.put(Z, 1, 2, STYLE, b"imagery")
+    assert results.get_many(STYLE, Z, 1, [(1, 2)]) == {(1, 2): (10, 100)}
+
+
+def test_lookups_span_several_chunks(stores):
+    _, results = stores
+    count = 2 * LOOKUP_CHUNK + 7
+    results.put_many(STYLE, Z, 1, {(x, 0): (x, 1000) for x in range(count)})
+    results.put_regions(STYLE, Z, 1, {((x, 0), "a"): (x, 500) for x in range(0, count, 2)})
+
+    assert results.get_many(STYLE, Z, 1, [(x, 0) for x in range(count + 5)]) == {
+        (x, 0): (x, 1000) for x in range(count)
+    }
+    regions = results.get_regions(STYLE, Z, 1, [((x, 0), "a") for x in range(count)])
+    assert regions == {((x, 0), "a"): (x, 500) for x in range(0, count, 2)}
+    assert results.get_regions(STYLE, Z, 1, [((0, 0), "b")]) == {}
+
+
+def test_history_skips_repeated_counts_and_keeps_the_latest(stores):
+    _, results = stores
+    for green in (1, 1, 2, 3, 3, 4, 5):
+        results.put_many(STYLE, Z, 1, {(1, 2): (green, 100)})
+        time.sleep(0.002)
+
+    rows = results.history(STYLE, Z, 1, [((1, 2), "")])
+    assert [green for _, _, green, _ in rows] == [3, 4, 5]
+    assert [at for at, _, _, _ in rows] == sorted(at for at, _, _, _ in rows)
+    assert results.history(STYLE, Z, 1, [((1, 2), "")], since=rows[-1][0]) == [rows[-1]]
+
+
+def test_rendered_tiles_are_evicted_least_recently_used_first(tmp_path):
+    path = str(tmp_path / "tiles.sqlite")
+    tiles = TileStore(path)
+    tiles.put(Z, 0, 0, STYLE, b"i" * 500)
+    rendered = RenderedTileCache(path, max_bytes=1000)
+    for x in range(4):
+        rendered.put("overlay", Z, x, 0, "v1", bytes(200))
+        rendered._connect().execute(
+            "UPDATE rendered_tiles SET accessed_at = accessed_at - ? WHERE x = ?", (100 - x, x)
+        )
+    # Replacing a tile counts its new size only
+    rendered.put("overlay", Z, 3, 0, "v2", bytes(300))
+    assert rendered.stats()["bytes"] == 900
+
+    assert rendered.get("overlay", Z, 0, 0, "v1") is not None  # now the most recently used
+    rendered.put("vector", Z, 0, 0, "v1", bytes(300))
+
+    present = {(kind, x) for kind, x in rendered._connect().execute(
+        "SELECT kind, x FROM rendered_tiles")}
+    assert present == {("overlay", 0), ("overlay", 3), ("vector", 0)}
+    assert rendered.stats()["bytes"] == 800 and rendered.stats()["evictions"] == 2
+    # Raw imagery has its own cap
+    assert tiles.stats()["bytes"] == 500 and tiles.get(Z, 0, 0, STYLE) is not None
+
+    rendered.clear("vector")
+    assert rendered.stats()["bytes"] == 500
+
+
+def test_rendered_tiles_from_before_the_cap_are_dropped(tmp_path):
+    path = str(tmp_path / "tiles.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE rendered_tiles (kind TEXT NOT NULL, z INTEGER NOT NULL, "
+        "x INTEGER NOT NULL, y INTEGER NOT NULL, version TEXT NOT NULL, data BLOB NOT NULL, "
+        "created_at REAL NOT NULL, PRIMARY KEY (kind, z, x, y))"
+    )
+    conn.execute("INSERT INTO rendered_tiles VALUES ('overlay', 17, 1, 2, 'v1', x'00', 0)")
+    conn.commit()
+    conn.close()
+
+    rendered = RenderedTileCache(path)
+
+    assert rendered.get("overlay", 17, 1, 2, "v1") is None
+    rendered.put("overlay", 17, 1, 2, "v1", b"tile")
+    assert rendered.get("overlay", 17, 1, 2, "v1") == b"tile"
+    assert rendered.stats()["bytes"] == 4
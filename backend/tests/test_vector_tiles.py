@@ -0,0 +1,169 @@
+import struct
+
+from shapely.geometry import Polygon, box
+
+from tile_utils import tile_bounds
+from vector_tiles import MVT_BUFFER, MVT_EXTENT, render_vector_tile
+
+
+# -------------------------------
+# A minimal MVT reader, enough to check what the encoder writes
+# -------------------------------
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, pos
+
+
+def read_fields(data):
+    """[(field number, value)], with length-delimited values as bytes."""
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, pos = read_varint(data, pos)
+        elif wire_type == 1:
+            (value,) = struct.unpack_from("<d", data, pos)
+            pos += 8
+        elif wire_type == 2:
+            length, pos = read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        else:
+            raise ValueError(f"unexpected wire type {wire_type}")
+        fields.append((number, value))
+    return fields
+
+
+def read_packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def unzigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+def read_rings(commands):
+    rings, x, y, i = [], 0, 0, 0
+    while i < len(commands):
+        command, count = commands[i] & 7, commands[i] >> 3
+        i += 1
+        if command == 7:
+            continue
+        if command == 1:
+            rings.append([])
+        for _ in range(count):
+            x += unzigzag(commands[i])
+            y += unzigzag(commands[i + 1])
+            rings[-1].append((x, y))
+            i += 2
+    return rings
+
+
+def read_value(data):
+    number, value = read_fields(data)[0]
+    return value.decode() if number == 1 else bool(value) if number == 7 else value
+
+
+def decode_tile(data):
+    (number, layer), = read_fields(data)
+    assert number == 3
+    fields = read_fields(layer)
+    keys = [v.decode() for n, v in fields if n == 3]
+    values = [read_value(v) for n, v in fields if n == 4]
+    features = []
+    for n, body in fields:
+        if n != 2:
+            continue
+        feature = dict(read_fields(body))
+        tags = read_packed(feature[2])
+        features.append({
+            "id": feature.get(1),
+            "type": feature[3],
+            "properties": {keys[k]: values[v] for k, v in zip(tags[::2], tags[1::2])},
+            "rings": read_rings(read_packed(feature[4])),
+        })
+    return {
+        "name": dict(fields)[1].decode(),
+        "version": dict(fields)[15],
+        "extent": dict(fields)[5],
+        "features": features,
+    }
+
+
+def ring_area(ring):
+    # Positive means clockwise on screen, as y grows downwards
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+
+
+# -------------------------------
+# Tests
+# -------------------------------
+
+Z, X, Y = 14, 11682, 6758
+
+
+def tile_fraction_box(x0, y0, x1, y1):
+    """A lon/lat box over a fraction of tile Z/X/Y, y counted from the top."""
+    lon_min, lat_min, lon_max, lat_max = tile_bounds(X, Y, Z)
+    return box(lon_min + (lon_max - lon_min) * x0, lat_max - (lat_max - lat_min) * y1,
+               lon_min + (lon_max - lon_min) * x1, lat_max - (lat_max - lat_min) * y0)
+
+
+def test_layer_header_and_properties():
+    features = [
+        (1, tile_fraction_box(0.1, 0.1, 0.4, 0.4),
+         {"name": "Sector 1", "green_cover": 41.5, "tiles": 12, "offset": -3, "ok": True, "none": None}),
+        (2, tile_fraction_box(0.6, 0.6, 0.9, 0.9), {"name": "Sector 2", "ok": True}),
+    ]
+
+    tile = decode_tile(render_vector_tile("sectors", features, Z, X, Y))
+
+    assert (tile["name"], tile["version"], tile["extent"]) == ("sectors", 2, MVT_EXTENT)
+    assert [f["id"] for f in tile["features"]] == [1, 2]
+    assert all(f["type"] == 3 for f in tile["features"])
+    assert tile["features"][0]["properties"] == {
+        "name": "Sector 1", "green_cover": 41.5, "tiles": 12, "offset": -3, "ok": True,
+    }
+    assert tile["features"][1]["properties"] == {"name": "Sector 2", "ok": True}
+
+
+def test_geometry_is_projected_and_wound_per_spec():
+    outer = tile_fraction_box(0.25, 0.25, 0.75, 0.75)
+    hole = tile_fraction_box(0.4, 0.4, 0.6, 0.6)
+    polygon = Polygon(outer.exterior.coords, [hole.exterior.coords])
+
+    (feature,) = decode_tile(render_vector_tile("sectors", [(7, polygon, {})], Z, X, Y))["features"]
+    exterior, interior = feature["rings"]
+
+    assert sorted(exterior) == sorted([(1024, 1024), (3072, 1024), (3072, 3072), (1024, 3072)])
+    assert sorted(interior) == sorted([(1638, 1638), (2458, 1638), (2458, 2458), (1638, 2458)])
+    assert ring_area(exterior) > 0 > ring_area(interior)
+
+
+def test_geometry_is_clipped_to_the_buffered_tile():
+    lon_min, lat_min, lon_max, lat_max = tile_bounds(X, Y, Z)
+    around = box(lon_min - 1, lat_min - 1, lon_max + 1, lat_max + 1)
+
+    (feature,) = decode_tile(render_vector_tile("sectors", [(1, around, {})], Z, X, Y))["features"]
+
+    low, high = -MVT_BUFFER, MVT_EXTENT + MVT_BUFFER
+    (ring,) = feature["rings"]
+    assert sorted(ring) == [(low, low), (low, high), (high, low), (high, high)]
+
+
+def test_no_tile_without_features():
+    lon_min, lat_min, lon_max, lat_max = tile_bounds(X, Y, Z)
+    elsewhere = box(lon_max + 1, lat_min, lon_max + 2, lat_max)
+    assert render_vector_tile("sectors", [(1, elsewhere, {})], Z, X, Y) is None
@@ -0,0 +1,115 @@
+import concurrent.futures
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rate_governor import governed_get, retry_after_seconds
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+# Upper bound on tile requests in flight; the rate governor adapts below it
+TILE_FETCH_CONCURRENCY = int(os.getenv("TILE_FETCH_CONCURRENCY", 32))
+TILE_FETCH_RETRIES = int(os.getenv("TILE_FETCH_RETRIES", 3))
+TILE_FETCH_TIMEOUT = float(os.getenv("TILE_FETCH_TIMEOUT", 20))
+TILE_FETCH_BACKOFF = float(os.getenv("TILE_FETCH_BACKOFF", 0.5))  # seconds
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TileFetchError(Exception):
+    """Raised when a tile could not be fetched after all retries."""
+
+
+_session = None
+_executor = None
+_init_lock = threading.Lock()
+
+
+def get_session():
+    """Shared keep-alive session with a connection pool sized for the fetch pool."""
+    global _session
+    if _session is None:
+        with _init_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=max(TILE_FETCH_CONCURRENCY, 10),
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def _get_executor():
+    # One pool per process bounds the number of tile requests in flight,
+    # even when several sectors are computed concurrently.
+    global _executor
+    if _executor is None:
+        with _init_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=TILE_FETCH_CONCURRENCY, thread_name_prefix="tile-fetch"
+                )
+    return _executor
+
+
+def _backoff(attempt):
+    return TILE_FETCH_BACKOFF * (2 ** attempt) * (0.5 + random.random())
+
+
+def get_with_retries(url, headers=None, retries=TILE_FETCH_RETRIES, timeout=TILE_FETCH_TIMEOUT,
+                     params=None):
+    """
+    GET a URL over the shared session and through the rate governor of its
+    host, retrying connection errors and 429/5xx responses with exponential
+    backoff. A Retry-After header from the server pauses the whole host
+    instead, so every caller waits it out.
+    Returns the last response; raises TileFetchError if no response was received.
+    """
+    session = get_session()
+    last_error = None
+    for attempt in range(retries + 1):
+        try:
+            response = governed_get(url, session, headers=headers, params=params, timeout=timeout)
+        except requests.RequestException as e:
+            last_error = e
+            if attempt < retries:
+                time.sleep(_backoff(attempt))
+            continue
+
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+        # The governor already paused the host for a Retry-After
+        if response.status_code not in (429, 503) or retry_after_seconds(response) is None:
+            time.sleep(_backoff(attempt))
+
+    raise TileFetchError(f"{type(last_error).__name__}: {last_error}")
+
+
+def iter_fetch(keys, fetch_one):
+    """
+    Run fetch_one(key) for every key on the shared fetch pool and yield
+    (key, data, error) tuples as they complete. Exactly one of data and
+    error is None.
+    """
+    executor = _get_executor()
+    futures = {executor.submit(fetch_one, key): key for key in keys}
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            key = futures[future]
+            try:
+                yield key, future.result(), None
+            except Exception as e:
+                yield key, None, str(e) or type(e).__name__
+    finally:
+        # If the consumer stops early, don't leave queued work behind
+        for future in futures:
+            future.cancel()
@@ -0,0 +1,284 @@
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from io import BytesIO
+from multiprocessing import shared_memory
+
+from PIL import Image
+
+import metrics
+from metrics import STAGE_SECONDS
+from overlay_tiles import coverage_from_image
+from tile_utils import TILE_BATCH_SIZE, classify_tile_regions, classify_tiles, tile_histograms
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+# Processes used to decode and classify tiles. 0 keeps everything in the
+# calling thread, which is what you want for one-off scripts and tests.
+TILE_PROCESS_WORKERS = int(os.getenv("TILE_PROCESS_WORKERS", os.cpu_count() or 1))
+# Batches queued per worker before the fetch side is made to wait
+MAX_BATCHES_PER_WORKER = 2
+
+
+# -------------------------------
+# Worker side
+# -------------------------------
+
+def _attach(name):
+    """Attach to a segment owned by the parent without taking over its cleanup."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: pool workers share the parent's resource tracker,
+        # so registering the segment again is a no-op there
+        return shared_memory.SharedMemory(name=name)
+
+
+def _decode(data):
+    return Image.open(BytesIO(data)).convert("RGB")
+
+
+def _classify_items(items, batch_size=TILE_BATCH_SIZE, histograms=False):
+    """
+    Decode and classify (data, regions) items, where data is the encoded
+    image and regions a list of bit-packed region masks. Returns one
+    (green, total, region_counts, histograms, error) tuple per item, with
+    the encoded colour histograms of the tile and of each region when
+    `histograms` is set (an empty list otherwise). Tiles
+    without regions are classified in stacks; tiles with regions need their
+    full green mask, so they are classified one at a time.
+    Decode and histogram time is recorded per tile; classification time
+    per tile is the batch's share.
+    """
+    results = [None] * len(items)
+    encoded = [[] for _ in items]
+    started = time.perf_counter()
+    other = 0.0  # seconds spent decoding and building histograms
+    classified = 0
+
+    def decoded():
+        nonlocal other, classified
+        for i, (data, regions) in enumerate(items):
+            try:
+                t0 = time.perf_counter()
+                img = _decode(data)
+                t1 = time.perf_counter()
+                if histograms:
+                    encoded[i] = tile_histograms(img, regions)
+                t2 = time.perf_counter()
+                STAGE_SECONDS.observe(t1 - t0, stage="decode")
+                if histograms:
+                    STAGE_SECONDS.observe(t2 - t1, stage="histogram")
+                other += t2 - t0
+                classified += 1
+                if regions:
+                    results[i] = classify_tile_regions(img, regions) + (encoded[i], None)
+                else:
+                    yield i, img
+            except Exception as e:
+                results[i] = (0, 0, [], [], str(e) or type(e).__name__)
+
+    for i, green, total in classify_tiles(decoded(), batch_size):
+        results[i] = (green, total, [], encoded[i], None)
+    if classified:
+        share = (time.perf_counter() - started - other) / classified
+        for _ in range(classified):
+            STAGE_SECONDS.observe(share, stage="classify")
+    return results
+
+
+def _coverage_items(items):
+    """
+    Decode and classify (data, regions) items into overlay coverage rasters
+    (see overlay_tiles). Returns one (green, total, coverage, error) tuple
+    per item; regions are ignored.
+    """
+    results = []
+    for data, _ in items:
+        try:
+            t0 = time.perf_counter()
+            img = _decode(data)
+            t1 = time.perf_counter()
+            coverage, green, total = coverage_from_image(img)
+            STAGE_SECONDS.observe(t1 - t0, stage="decode")
+            STAGE_SECONDS.observe(time.perf_counter() - t1, stage="classify")
+            results.append((green, total, coverage, None))
+        except Exception as e:
+            results.append((0, 0, None, str(e) or type(e).__name__))
+    return results
+
+
+def _read_shared(name, spans):
+    """(data, regions) items described by spans, each ((offset, length), [(mask_offset, mask_length), ...])."""
+    shm = _attach(name)
+    try:
+        return [
+            (
+                bytes(shm.buf[offset:offset + length]),
+                [bytes(shm.buf[o:o + n]) for o, n in masks],
+            )
+            for (offset, length), masks in spans
+        ]
+    finally:
+        shm.close()
+
+
+def _classify_shared_batch(name, spans, histograms=False):
+    """
+    Decode and classify the tiles described by spans from the shared memory
+    segment `name`. Pixel data never leaves this process; only the counts,
+    histograms and this process's metrics are sent back.
+    """
+    return _classify_items(_read_shared(name, spans), histograms=histograms), metrics.take()
+
+
+def _coverage_shared_batch(name, spans):
+    """Overlay coverage rasters of the tiles described by spans, plus this process's metrics."""
+    return _coverage_items(_read_shared(name, spans)), metrics.take()
+
+
+# -------------------------------
+# Parent side
+# -------------------------------
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Process pool for decode/classify work, or None when TILE_PROCESS_WORKERS is 0."""
+    global _pool
+    if TILE_PROCESS_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn, not fork: the parent runs fetch threads holding locks
+                _pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=TILE_PROCESS_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+
+def _submit(pool, batch, worker, *args):
+    size = sum(len(data) + sum(len(mask) for mask in regions) for _, data, regions in batch)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    spans = []
+    offset = 0
+
+    def put(chunk):
+        nonlocal offset
+        chunk = memoryview(chunk).cast("B")
+        shm.buf[offset:offset + len(chunk)] = chunk
+        span = (offset, len(chunk))
+        offset += len(chunk)
+        return span
+
+    try:
+        for _, data, regions in batch:
+            spans.append((put(data), [put(mask) for mask in regions]))
+        future = pool.submit(worker, shm.name, spans, *args)
+    except BaseException:
+        # Nothing will collect this batch, so the segment would outlive us
+        shm.close()
+        shm.unlink()
+        raise
+    return future, shm, [key for key, _, _ in batch]
+
+
+def _collect(future, shm, keys):
+    try:
+        results, samples = future.result()
+    finally:
+        shm.close()
+        shm.unlink()
+    metrics.merge(samples)
+    for key, result in zip(keys, results):
+        yield (key,) + tuple(result)
+
+
+def _run_local(batch, classify):
+    results = classify([(data, regions) for _, data, regions in batch])
+    for (key, _, _), result in zip(batch, results):
+        yield (key,) + tuple(result)
+
+
+def classify_encoded_tiles(tiles, batch_size=TILE_BATCH_SIZE, histograms=False):
+    """
+    Decode and classify an iterable of (key, encoded image bytes, regions)
+    items, regions being a possibly empty list of bit-packed region masks.
+    Yields (key, green, total, region_counts, histograms, error) tuples,
+    error being None on success, region_counts holding (green, total) per
+    region and histograms the encoded colour histograms of the tile and of
+    each region. Histograms cost several times the classification itself,
+    so they are only built when `histograms` is set.
+
+    With a process pool, encoded bytes are packed into a shared memory
+    segment per batch and the workers send back only counts and compressed
+    histograms, so decoding and classification run in parallel with the
+    fetch threads instead of competing with them for the GIL.
+    """
+    classify = functools.partial(_classify_items, histograms=histograms)
+    return _run_batches(tiles, batch_size, classify, _classify_shared_batch, histograms)
+
+
+def coverage_encoded_tiles(tiles, batch_size=TILE_BATCH_SIZE):
+    """
+    Decode and classify an iterable of (key, encoded image bytes, regions)
+    items into overlay coverage rasters, the same way classify_encoded_tiles
+    counts them. Yields (key, green, total, coverage, error) tuples.
+    """
+    return _run_batches(tiles, batch_size, _coverage_items, _coverage_shared_batch)
+
+
+def _run_batches(tiles, batch_size, classify, worker, *args):
+    """
+    Run classify over batches of tiles in this thread, or `worker` over
+    them in the process pool with the batch in shared memory.
+    """
+    pool = get_process_pool()
+    if pool is None:
+        batch = []
+        for item in tiles:
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield from _run_local(batch, classify)
+                batch = []
+        yield from _run_local(batch, classify)
+        return
+
+    max_in_flight = MAX_BATCHES_PER_WORKER * TILE_PROCESS_WORKERS
+    in_flight = []
+    batch = []
+    try:
+        for item in tiles:
+            batch.append(item)
+            if len(batch) < batch_size:
+                continue
+            in_flight.append(_submit(pool, batch, worker, *args))
+            batch = []
+            while len(in_flight) >= max_in_flight:
+                yield from _collect(*in_flight.pop(0))
+            # Hand back whatever has already finished without blocking
+            while in_flight and in_flight[0][0].done():
+                yield from _collect(*in_flight.pop(0))
+        if batch:
+            in_flight.append(_submit(pool, batch, worker, *args))
+        while in_flight:
+            yield from _collect(*in_flight.pop(0))
+    finally:
+        for future, shm, _ in in_flight:
+            future.cancel()
+            try:
+                future.result()
+            except BaseException:
+                pass
+            shm.close()
+            shm.unlink()
+
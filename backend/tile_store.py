@@ -0,0 +1,753 @@
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import CACHE_EVENTS
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+TILE_STORE_PATH = os.getenv(
+    "TILE_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "tiles.sqlite"),
+)
+TILE_STORE_MAX_MB = float(os.getenv("TILE_STORE_MAX_MB", 2048))
+# Separate cap for tiles rendered by this app, so overlays and vector tiles
+# never push raw imagery out of the store
+RENDERED_TILES_MAX_MB = float(os.getenv("RENDERED_TILES_MAX_MB", 256))
+TILE_STORE_TTL = int(os.getenv("TILE_STORE_TTL", 30 * 24 * 3600))  # seconds
+# Tile results older than this are checked against the provider before
+# reuse; they are only recomputed if the imagery actually changed.
+TILE_RESULT_TTL = int(os.getenv("TILE_RESULT_TTL", 24 * 3600))  # seconds
+# Counts kept per tile (and region) in the count history; older ones are dropped
+TILE_HISTORY_LIMIT = int(os.getenv("TILE_HISTORY_LIMIT", 100))
+
+# Only bump accessed_at when it is older than this, so hot reads don't turn
+# into a write per tile. LRU order is therefore accurate to about a minute.
+ACCESS_TOUCH_INTERVAL = 60
+# Evict down to this fraction of the cap so we don't evict on every insert.
+EVICT_LOW_WATERMARK = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    style TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    changed_at REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (style, z, x, y)
+);
+CREATE INDEX IF NOT EXISTS tiles_accessed_at ON tiles (accessed_at);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('total_bytes', 0);
+"""
+
+
+def ensure_tiles_table(conn):
+    """Create the tiles table, adding changed_at to stores created before it existed."""
+    conn.executescript(SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(tiles)")}
+    if "changed_at" not in columns:
+        try:
+            conn.execute("ALTER TABLE tiles ADD COLUMN changed_at REAL NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            return  # another worker got there first
+        conn.execute("UPDATE tiles SET changed_at = fetched_at")
+
+
+class TileEntry:
+    """A stored tile plus the validators needed to revalidate it."""
+
+    __slots__ = ("data", "etag", "last_modified", "fetched_at", "fresh")
+
+    def __init__(self, data, etag, last_modified, fetched_at, fresh):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.fresh = fresh
+
+
+class SQLiteStore:
+    """
+    Base for the SQLite-backed caches in this module. Safe to share between
+    threads and between gunicorn worker processes: every thread gets its own
+    connection and the database runs in WAL mode.
+    """
+
+    schema = ""
+    counters = ()
+    # Counters are also exported as greencover_cache_events_total{cache=...}
+    metric_name = None
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {key: 0 for key in self.counters}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript(self.schema)
+
+    def _connect(self):
+        # Connections must not cross a fork, so remember which process opened them
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+        if self.metric_name:
+            CACHE_EVENTS.inc(amount, cache=self.metric_name, event=key)
+
+    def _counter_snapshot(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+class TileStore(SQLiteStore):
+    """Persistent store of raw tile images, keyed by (style, z, x, y)."""
+
+    schema = SCHEMA
+    counters = ("hits", "misses", "stale", "writes", "evictions")
+    metric_name = "tiles"
+
+    def __init__(self, path=TILE_STORE_PATH, max_bytes=None, ttl=TILE_STORE_TTL):
+        super().__init__(path)
+        ensure_tiles_table(self._connect())
+        self.max_bytes = int(TILE_STORE_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.ttl = ttl
+
+    def get(self, z, x, y, style, max_age=None):
+        """
+        Return a TileEntry (possibly stale) or None if the tile is not stored.
+        max_age: treat tiles fetched longer ago than this as stale even if
+                 they are within the store's TTL
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT data, etag, last_modified, fetched_at, accessed_at FROM tiles "
+            "WHERE style = ? AND z = ? AND x = ? AND y = ?",
+            (style, z, x, y),
+        ).fetchone()
+        if row is None:
+            self._count("misses")
+            return None
+
+        data, etag, last_modified, fetched_at, accessed_at = row
+        now = time.time()
+        if now - accessed_at > ACCESS_TOUCH_INTERVAL:
+            conn.execute(
+                "UPDATE tiles SET accessed_at = ? WHERE style = ? AND z = ? AND x = ? AND y = ?",
+                (now, style, z, x, y),
+            )
+
+        ttl = self.ttl if max_age is None else min(self.ttl, max_age)
+        fresh = now - fetched_at < ttl
+        self._count("hits" if fresh else "stale")
+        return TileEntry(data, etag, last_modified, fetched_at, fresh)
+
+    def put(self, z, x, y, style, data, etag=None, last_modified=None):
+        """
+        Store (or replace) a tile and evict least recently used tiles if over
+        the cap. changed_at only moves when the bytes differ from the stored
+        copy, so results computed from it stay valid across a re-download.
+        """
+        conn = self._connect()
+        now = time.time()
+        size = len(data)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = conn.execute(
+                "SELECT size, data, changed_at FROM tiles "
+                "WHERE style = ? AND z = ? AND x = ? AND y = ?",
+                (style, z, x, y),
+            ).fetchone()
+            changed_at = old[2] if old and bytes(old[1]) == bytes(data) else now
+            conn.execute(
+                "INSERT OR REPLACE INTO tiles "
+                "(style, z, x, y, data, size, etag, last_modified, fetched_at, accessed_at, changed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (style, z, x, y, sqlite3.Binary(data), size, etag, last_modified, now, now, changed_at),
+            )
+            delta = size - (old[0] if old else 0)
+            conn.execute(
+                "UPDATE store_meta SET value = value + ? WHERE key = 'total_bytes'", (delta,)
+            )
+            evicted = self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("writes")
+        if evicted:
+            self._count("evictions", evicted)
+
+    def revalidated(self, z, x, y, style):
+        """Mark a stale tile as fresh again after the provider answered 304 Not Modified."""
+        now = time.time()
+        self._connect().execute(
+            "UPDATE tiles SET fetched_at = ?, accessed_at = ? "
+            "WHERE style = ? AND z = ? AND x = ? AND y = ?",
+            (now, now, style, z, x, y),
+        )
+
+    def _evict(self, conn):
+        total = conn.execute(
+            "SELECT value FROM store_meta WHERE key = 'total_bytes'"
+        ).fetchone()[0]
+        if self.max_bytes <= 0 or total <= self.max_bytes:
+            return 0
+
+        target = int(self.max_bytes * EVICT_LOW_WATERMARK)
+        freed = 0
+        victims = []
+        for style, z, x, y, size in conn.execute(
+            "SELECT style, z, x, y, size FROM tiles ORDER BY accessed_at ASC"
+        ):
+            victims.append((style, z, x, y))
+            freed += size
+            if total - freed <= target:
+                break
+
+        conn.executemany(
+            "DELETE FROM tiles WHERE style = ? AND z = ? AND x = ? AND y = ?", victims
+        )
+        conn.execute(
+            "UPDATE store_meta SET value = value - ? WHERE key = 'total_bytes'", (freed,)
+        )
+        return len(victims)
+
+    def clear(self):
+        """Remove every stored tile."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM tiles")
+        conn.execute("UPDATE store_meta SET value = 0 WHERE key = 'total_bytes'")
+        conn.execute("COMMIT")
+
+    def stats(self):
+        """Hit/miss counters for this process plus the size of the shared store."""
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+        total = conn.execute(
+            "SELECT value FROM store_meta WHERE key = 'total_bytes'"
+        ).fetchone()[0]
+        stats = self._counter_snapshot()
+        lookups = stats["hits"] + stats["misses"] + stats["stale"]
+        stats.update({
+            "hit_ratio": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+            "tiles": count,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+        })
+        return stats
+
+
+RESULTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tile_results (
+    style TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    green INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    computed_at REAL NOT NULL,
+    PRIMARY KEY (style, z, x, y, version)
+);
+CREATE TABLE IF NOT EXISTS tile_region_results (
+    style TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    region TEXT NOT NULL,
+    green INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    computed_at REAL NOT NULL,
+    PRIMARY KEY (style, z, x, y, version, region)
+);
+CREATE TABLE IF NOT EXISTS tile_histograms (
+    style TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    region TEXT NOT NULL,
+    histogram BLOB NOT NULL,
+    computed_at REAL NOT NULL,
+    PRIMARY KEY (style, z, x, y, version, region)
+);
+CREATE TABLE IF NOT EXISTS tile_count_history (
+    style TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    region TEXT NOT NULL,
+    green INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (style, z, x, y, version, region, recorded_at)
+);
+"""
+
+# A result is current if it was computed from the stored imagery (none
+# arrived since) and it is either younger than the TTL or its imagery has
+# been confirmed unchanged within the TTL
+CURRENT_RESULT = (
+    "(t.changed_at IS NULL OR t.changed_at <= r.computed_at) "
+    "AND (r.computed_at > ? OR t.fetched_at > ?)"
+)
+# (tile, region) pairs looked up per query, well within SQLite's variable limit
+LOOKUP_CHUNK = 250
+
+
+class TileResultCache(SQLiteStore):
+    """
+    Per-tile classification results (green, total), keyed by tile and
+    classifier version so a classifier change never reuses old counts.
+    Results older than the TTL stay valid as long as the tile store has
+    confirmed their imagery unchanged within the TTL, and newer imagery
+    invalidates a result at any age. Stored counts that differ from the
+    last recorded one are also appended to a history table, which keeps
+    the latest TILE_HISTORY_LIMIT counts per tile and region.
+    """
+
+    schema = RESULTS_SCHEMA
+    counters = ("hits", "misses", "writes")
+    metric_name = "tile_results"
+
+    def __init__(self, path=TILE_STORE_PATH, ttl=TILE_RESULT_TTL, history_limit=TILE_HISTORY_LIMIT):
+        super().__init__(path)
+        # Results are checked against the imagery in the tiles table
+        ensure_tiles_table(self._connect())
+        self.ttl = ttl
+        self.history_limit = history_limit
+
+    def _select_pairs(self, conn, select, table, style, z, version, pairs, where="", params=()):
+        """
+        Run `select` (columns of `table` r, after the pair's x, y and region)
+        for (tile, region) pairs, LOOKUP_CHUNK pairs per query. Region None
+        means `table` has no region column. Yields ((x, y), region, *columns).
+        """
+        pairs = list(pairs)
+        for start in range(0, len(pairs), LOOKUP_CHUNK):
+            chunk = pairs[start:start + LOOKUP_CHUNK]
+            regional = chunk[0][1] is not None
+            values = ", ".join(["(?, ?, ?)"] * len(chunk))
+            rows = conn.execute(
+                f"WITH wanted (x, y, region) AS (VALUES {values}) "
+                f"SELECT w.x, w.y, w.region, {select} FROM wanted w JOIN {table} r "
+                "ON r.style = ? AND r.z = ? AND r.x = w.x AND r.y = w.y AND r.version = ? "
+                + ("AND r.region = w.region " if regional else "")
+                + where,
+                [value for (x, y), region in chunk for value in (x, y, region)]
+                + [style, z, version, *params],
+            )
+            for x, y, region, *columns in rows:
+                yield (x, y), region, *columns
+
+    def _lookup(self, table, columns, style, z, version, pairs):
+        oldest = time.time() - self.ttl
+        found = {}
+        rows = self._select_pairs(
+            self._connect(), columns, table, style, z, version, pairs,
+            "LEFT JOIN tiles t ON t.style = r.style AND t.z = r.z AND t.x = r.x AND t.y = r.y "
+            f"WHERE {CURRENT_RESULT}",
+            (oldest, oldest),
+        )
+        for tile, region, *row in rows:
+            found[(tile, region)] = tuple(row)
+        self._count("hits", len(found))
+        self._count("misses", len(pairs) - len(found))
+        return found
+
+    def get_many(self, style, z, version, tiles):
+        """Return {(x, y): (green, total)} for the tiles with a current stored result."""
+        found = self._lookup(
+            "tile_results", "r.green, r.total", style, z, version, [(tile, None) for tile in tiles]
+        )
+        return {tile: row for (tile, _), row in found.items()}
+
+    def _record(self, conn, style, z, version, rows, now):
+        # Recomputing a tile usually gives the counts already recorded, which
+        # add nothing to its history
+        latest = (
+            "SELECT green, total FROM tile_count_history WHERE style = ? AND z = ? AND x = ? "
+            "AND y = ? AND version = ? AND region = ? ORDER BY recorded_at DESC"
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO tile_count_history "
+            "(style, z, x, y, version, region, green, total, recorded_at) "
+            "SELECT ?, ?, ?, ?, ?, ?, ?, ?, ? "
+            f"WHERE NOT EXISTS (SELECT 1 FROM ({latest} LIMIT 1) WHERE green = ? AND total = ?)",
+            [
+                (style, z, x, y, version, region, green, total, now,
+                 style, z, x, y, version, region, green, total)
+                for x, y, region, green, total in rows
+            ],
+        )
+        conn.executemany(
+            "DELETE FROM tile_count_history WHERE style = ? AND z = ? AND x = ? AND y = ? "
+            "AND version = ? AND region = ? "
+            f"AND recorded_at < ({latest.replace('green, total', 'recorded_at')} LIMIT 1 OFFSET ?)",
+            [
+                (style, z, x, y, version, region, style, z, x, y, version, region,
+                 self.history_limit - 1)
+                for x, y, region, _, _ in rows
+            ],
+        )
+
+    def put_many(self, style, z, version, results):
+        """Store {(x, y): (green, total)} results."""
+        if not results:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO tile_results "
+                "(style, z, x, y, version, green, total, computed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (style, z, x, y, version, green, total, now)
+                    for (x, y), (green, total) in results.items()
+                ],
+            )
+            self._record(conn, style, z, version, [
+                (x, y, "", green, total) for (x, y), (green, total) in results.items()
+            ], now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("writes", len(results))
+
+    def get_regions(self, style, z, version, pairs):
+        """
+        Return {((x, y), region): (green, total)} for the (tile, region)
+        pairs with a current stored result. A region result counts only the
+        pixels of the tile that fall inside that region's polygon.
+        """
+        return self._lookup("tile_region_results", "r.green, r.total", style, z, version, pairs)
+
+    def put_regions(self, style, z, version, results):
+        """Store {((x, y), region): (green, total)} results."""
+        if not results:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO tile_region_results "
+                "(style, z, x, y, version, region, green, total, computed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (style, z, x, y, version, region, green, total, now)
+                    for ((x, y), region), (green, total) in results.items()
+                ],
+            )
+            self._record(conn, style, z, version, [
+                (x, y, region, green, total) for ((x, y), region), (green, total) in results.items()
+            ], now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("writes", len(results))
+
+    def get_histograms(self, style, z, version, pairs):
+        """
+        Return {((x, y), region): histogram bytes} for the (tile, region)
+        pairs with a current stored colour histogram. Region "" is the whole
+        tile. Histograms don't depend on the classifier, so `version` is the
+        histogram layout version rather than the classifier's.
+        """
+        found = self._lookup("tile_histograms", "r.histogram", style, z, version, pairs)
+        return {pair: row[0] for pair, row in found.items()}
+
+    def put_histograms(self, style, z, version, histograms):
+        """Store {((x, y), region): histogram bytes}."""
+        if not histograms:
+            return
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO tile_histograms "
+                "(style, z, x, y, version, region, histogram, computed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (style, z, x, y, version, region, sqlite3.Binary(data), now)
+                    for ((x, y), region), data in histograms.items()
+                ],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("writes", len(histograms))
+
+    def history(self, style, z, version, pairs, since=0):
+        """
+        Return every count recorded for the (tile, region) pairs since
+        `since`, as (recorded_at, ((x, y), region), green, total) tuples in
+        time order. Region "" is the whole tile.
+        """
+        rows = [
+            (recorded_at, (tile, region), green, total)
+            for tile, region, recorded_at, green, total in self._select_pairs(
+                self._connect(), "r.recorded_at, r.green, r.total", "tile_count_history",
+                style, z, version, pairs, "WHERE r.recorded_at >= ?", (since,),
+            )
+        ]
+        rows.sort(key=lambda row: row[0])
+        return rows
+
+    def clear(self):
+        """Remove every stored result. The count history is kept."""
+        conn = self._connect()
+        conn.execute("DELETE FROM tile_results")
+        conn.execute("DELETE FROM tile_region_results")
+        conn.execute("DELETE FROM tile_histograms")
+
+    def stats(self):
+        """Hit/miss counters for this process plus the number of stored results."""
+        stats = self._counter_snapshot()
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["results"] = self._connect().execute(
+            "SELECT COUNT(*) FROM tile_results"
+        ).fetchone()[0]
+        stats["ttl"] = self.ttl
+        return stats
+
+
+RENDERED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rendered_tiles (
+    kind TEXT NOT NULL,
+    z INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (kind, z, x, y)
+);
+CREATE TABLE IF NOT EXISTS store_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO store_meta (key, value) VALUES ('rendered_bytes', 0);
+"""
+
+
+def ensure_rendered_table(conn):
+    """Create the rendered tiles index, replacing a table from before rendered tiles were capped."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(rendered_tiles)")}
+    if "accessed_at" not in columns:
+        # Rendered tiles can always be rendered again, so start over rather than migrate
+        conn.execute("DROP TABLE IF EXISTS rendered_tiles")
+        conn.executescript(RENDERED_SCHEMA)
+        conn.execute("UPDATE store_meta SET value = 0 WHERE key = 'rendered_bytes'")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS rendered_tiles_accessed_at ON rendered_tiles (accessed_at)"
+    )
+
+
+class RenderedTileCache(SQLiteStore):
+    """
+    Tiles rendered by this app (vector tiles, overlays), keyed by kind and
+    z/x/y. Each tile remembers the version of the data it was rendered from;
+    a tile rendered from other data is a miss and gets replaced. Least
+    recently used tiles are evicted past RENDERED_TILES_MAX_MB.
+    """
+
+    schema = RENDERED_SCHEMA
+    counters = ("hits", "misses", "writes", "evictions")
+    metric_name = "rendered_tiles"
+
+    def __init__(self, path=TILE_STORE_PATH, max_bytes=None):
+        super().__init__(path)
+        ensure_rendered_table(self._connect())
+        self.max_bytes = int(RENDERED_TILES_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+
+    def get(self, kind, z, x, y, version):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT data, accessed_at FROM rendered_tiles "
+            "WHERE kind = ? AND z = ? AND x = ? AND y = ? AND version = ?",
+            (kind, z, x, y, version),
+        ).fetchone()
+        self._count("hits" if row else "misses")
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > ACCESS_TOUCH_INTERVAL:
+            conn.execute(
+                "UPDATE rendered_tiles SET accessed_at = ? WHERE kind = ? AND z = ? AND x = ? AND y = ?",
+                (now, kind, z, x, y),
+            )
+        return row[0]
+
+    def present(self, kind, z, version, x_range, y_range):
+        """Return the set of (x, y) tiles cached within the inclusive x and y ranges."""
+        return set(self._connect().execute(
+            "SELECT x, y FROM rendered_tiles WHERE kind = ? AND z = ? AND version = ? "
+            "AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?",
+            (kind, z, version, *x_range, *y_range),
+        ).fetchall())
+
+    def put(self, kind, z, x, y, version, data):
+        """Store (or replace) a rendered tile and evict least recently used ones if over the cap."""
+        conn = self._connect()
+        now = time.time()
+        size = len(data)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = conn.execute(
+                "SELECT size FROM rendered_tiles WHERE kind = ? AND z = ? AND x = ? AND y = ?",
+                (kind, z, x, y),
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO rendered_tiles "
+                "(kind, z, x, y, version, data, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, z, x, y, version, sqlite3.Binary(data), size, now, now),
+            )
+            conn.execute(
+                "UPDATE store_meta SET value = value + ? WHERE key = 'rendered_bytes'",
+                (size - (old[0] if old else 0),),
+            )
+            evicted = self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._count("writes")
+        if evicted:
+            self._count("evictions", evicted)
+
+    def _evict(self, conn):
+        total = self._total(conn)
+        if self.max_bytes <= 0 or total <= self.max_bytes:
+            return 0
+
+        target = int(self.max_bytes * EVICT_LOW_WATERMARK)
+        freed = 0
+        victims = []
+        for kind, z, x, y, size in conn.execute(
+            "SELECT kind, z, x, y, size FROM rendered_tiles ORDER BY accessed_at ASC"
+        ):
+            victims.append((kind, z, x, y))
+            freed += size
+            if total - freed <= target:
+                break
+
+        conn.executemany(
+            "DELETE FROM rendered_tiles WHERE kind = ? AND z = ? AND x = ? AND y = ?", victims
+        )
+        conn.execute(
+            "UPDATE store_meta SET value = value - ? WHERE key = 'rendered_bytes'", (freed,)
+        )
+        return len(victims)
+
+    def _total(self, conn):
+        return conn.execute(
+            "SELECT value FROM store_meta WHERE key = 'rendered_bytes'"
+        ).fetchone()[0]
+
+    def clear(self, kind=None):
+        """Remove rendered tiles, of one kind or of every kind."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        if kind is None:
+            conn.execute("DELETE FROM rendered_tiles")
+        else:
+            conn.execute("DELETE FROM rendered_tiles WHERE kind = ?", (kind,))
+        conn.execute(
+            "UPDATE store_meta SET value = (SELECT COALESCE(SUM(size), 0) FROM rendered_tiles) "
+            "WHERE key = 'rendered_bytes'"
+        )
+        conn.execute("COMMIT")
+
+    def stats(self):
+        conn = self._connect()
+        stats = self._counter_snapshot()
+        stats.update({
+            "tiles": conn.execute("SELECT COUNT(*) FROM rendered_tiles").fetchone()[0],
+            "bytes": self._total(conn),
+            "max_bytes": self.max_bytes,
+        })
+        return stats
+
+
+_store = None
+_results = None
+_rendered = None
+_store_lock = threading.Lock()
+
+
+def get_tile_store():
+    """Return the process-wide tile store, or None when TILE_STORE_PATH is empty."""
+    global _store
+    if not TILE_STORE_PATH:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TileStore()
+    return _store
+
+
+def get_tile_results():
+    """Return the process-wide tile result cache, or None when TILE_STORE_PATH is empty."""
+    global _results
+    if not TILE_STORE_PATH:
+        return None
+    if _results is None:
+        with _store_lock:
+            if _results is None:
+                _results = TileResultCache()
+    return _results
+
+
+def get_rendered_tiles():
+    """Return the process-wide rendered tile cache, or None when TILE_STORE_PATH is empty."""
+    global _rendered
+    if not TILE_STORE_PATH:
+        return None
+    if _rendered is None:
+        with _store_lock:
+            if _rendered is None:
+                _rendered = RenderedTileCache()
+    return _rendered
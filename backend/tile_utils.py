@@ -1,8 +1,40 @@
+import hashlib
 import math
-import requests
-from PIL import Image
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from PIL import Image, ImageDraw
 from io import BytesIO
 import numpy as np
+from shapely.geometry import MultiPolygon, Polygon, box
+from shapely.prepared import prep
+from cache_versions import CLASSIFIER_VERSION
+from metrics import STAGE_SECONDS, TILE_FETCHES, TILE_RESULTS
+from tile_store import get_tile_results, get_tile_store
+from tile_fetch import TileFetchError, get_with_retries, iter_fetch
+from single_flight import SingleFlight
+
+TILE_STYLE = "mapbox/satellite-v9"
+MAPBOX_API_URL = os.getenv("MAPBOX_API_URL", "https://api.mapbox.com")
+TILE_BATCH_SIZE = int(os.getenv("TILE_BATCH_SIZE", 16))
+TILE_SIZE = 256
+# Rasterized polygon masks kept in memory, one 8 KiB bit-packed mask per entry
+REGION_MASK_CACHE_SIZE = int(os.getenv("REGION_MASK_CACHE_SIZE", 4096))
+# Tiles classified per vectorized step inside a stack. Small blocks keep the
+# classifier's scratch buffers in cache; 256x256 tiles are already large
+# enough that bigger blocks don't amortize any more dispatch overhead.
+CLASSIFY_BLOCK_TILES = 2
+# Colour histograms stored per tile: 5° hue bins and 0.05 saturation and
+# value bins. Bump HISTOGRAM_VERSION whenever the binning changes.
+HISTOGRAM_VERSION = 1
+HUE_BINS, SAT_BINS, VAL_BINS = 72, 20, 20
+# The thresholds the classifier hard-codes, see green_mask_reference
+DEFAULT_THRESHOLDS = {
+    "hue_min": 35.0, "hue_max": 160.0,
+    "sat_min": 0.25, "sat_max": 1.0,
+    "val_min": 0.2, "val_max": 1.0,
+}
 
 # -------------------------------
 # Tile conversion helpers
@@ -29,19 +61,185 @@ def tile_bounds(x, y, z):
 
 def get_tile_url(x, y, z, token):
     """Mapbox Satellite tile URL."""
-    return f"https://api.mapbox.com/styles/v1/mapbox/satellite-v9/tiles/256/{z}/{x}/{y}?access_token={token}"
+    return f"{MAPBOX_API_URL}/styles/v1/{TILE_STYLE}/tiles/256/{z}/{x}/{y}?access_token={token}"
+
+
+# Neighbouring sectors computed at the same time want the same edge tiles
+_tile_flights = SingleFlight()
+
+
+def fetch_tile(x, y, z, token, max_age=None):
+    """
+    Return the raw bytes of a tile, going to Mapbox only when the local tile
+    store has no fresh copy. Stale copies are revalidated with a conditional
+    request and served as-is if the provider is unreachable. Concurrent
+    fetches of the same tile share one request.
+    max_age: revalidate stored copies older than this many seconds, even
+             when the tile store would still consider them fresh
+    Raises TileFetchError if the tile could not be obtained.
+    """
+    return _tile_flights.do(
+        (TILE_STYLE, z, x, y, max_age), lambda: _fetch_tile(x, y, z, token, max_age)
+    )
+
+
+def _fetch_tile(x, y, z, token, max_age=None):
+    with STAGE_SECONDS.time(stage="tile_fetch"):
+        data, source = _fetch_tile_data(x, y, z, token, max_age)
+    if data is None:
+        TILE_FETCHES.inc(source="failed")
+        raise TileFetchError(source)
+    TILE_FETCHES.inc(source=source)
+    return data
+
+
+def _fetch_tile_data(x, y, z, token, max_age=None):
+    """(data, source) of a tile, or (None, error) if it could not be obtained."""
+    store = get_tile_store()
+    entry = store.get(z, x, y, TILE_STYLE, max_age) if store else None
+    if entry and entry.fresh:
+        return entry.data, "store"
+
+    headers = {}
+    if entry:
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+
+    try:
+        response = get_with_retries(get_tile_url(x, y, z, token), headers=headers)
+    except TileFetchError as e:
+        if entry:
+            return entry.data, "stale"
+        return None, str(e)
+
+    if response.status_code == 304 and entry:
+        store.revalidated(z, x, y, TILE_STYLE)
+        return entry.data, "revalidated"
+    if response.status_code == 200:
+        if store:
+            store.put(
+                z, x, y, TILE_STYLE, response.content,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+        return response.content, "downloaded"
+    if entry:
+        return entry.data, "stale"
+    return None, f"HTTP {response.status_code}"
+
+
+def tiles_for_bbox(bbox, zoom):
+    """List the (x, y) tiles covering bbox (min_lon, min_lat, max_lon, max_lat)."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x_min, y_max = deg2num(min_lat, min_lon, zoom)
+    x_max, y_min = deg2num(max_lat, max_lon, zoom)
+    return [
+        (x, y)
+        for x in range(min(x_min, x_max), max(x_min, x_max) + 1)
+        for y in range(min(y_min, y_max), max(y_min, y_max) + 1)
+    ]
+
+
+# -------------------------------
+# Polygon-aware tile selection
+# -------------------------------
+
+def lonlat_to_pixel(lon, lat, zoom):
+    """Convert longitude/latitude to global Web Mercator pixel coordinates."""
+    n = 2.0 ** zoom * TILE_SIZE
+    lat_rad = math.radians(lat)
+    px = (lon + 180.0) / 360.0 * n
+    py = (1.0 - math.log(math.tan(lat_rad) + (1 / math.cos(lat_rad))) / math.pi) / 2.0 * n
+    return px, py
+
+
+def tiles_for_geometry(geom, zoom):
+    """
+    Split the tiles under a shapely (Multi)Polygon into those lying fully
+    inside it and those crossing its boundary. Tiles of the bounding box
+    that don't touch the geometry at all are left out.
+    Returns (interior, edge) lists of (x, y).
+    """
+    prepared = prep(geom)
+    interior = []
+    edge = []
+    for x, y in tiles_for_bbox(geom.bounds, zoom):
+        tile_box = box(*tile_bounds(x, y, zoom))
+        if prepared.contains(tile_box):
+            interior.append((x, y))
+        elif prepared.intersects(tile_box):
+            edge.append((x, y))
+    return interior, edge
+
+
+def region_key(name, geom):
+    """Cache key for a named region, changing whenever its geometry does."""
+    digest = hashlib.sha1(geom.wkb).hexdigest()[:12]
+    return f"{name}:{digest}"
+
+
+def rasterize_region(geom, x, y, zoom):
+    """Rasterize the part of geom inside tile (x, y) to a bit-packed 256x256 mask."""
+    clipped = geom.intersection(box(*tile_bounds(x, y, zoom)).buffer(1e-9))
+    if isinstance(clipped, Polygon):
+        polygons = [clipped]
+    elif isinstance(clipped, MultiPolygon):
+        polygons = list(clipped.geoms)
+    else:
+        polygons = [g for g in getattr(clipped, "geoms", []) if isinstance(g, Polygon)]
+
+    def to_pixels(ring):
+        points = []
+        for lon, lat in ring.coords:
+            px, py = lonlat_to_pixel(lon, lat, zoom)
+            points.append((px - x * TILE_SIZE, py - y * TILE_SIZE))
+        return points
+
+    canvas = Image.new("1", (TILE_SIZE, TILE_SIZE), 0)
+    draw = ImageDraw.Draw(canvas)
+    for polygon in polygons:
+        if polygon.is_empty:
+            continue
+        draw.polygon(to_pixels(polygon.exterior), fill=1)
+        for interior in polygon.interiors:
+            draw.polygon(to_pixels(interior), fill=0)
+    return np.packbits(np.asarray(canvas, dtype=bool))
+
+
+_region_masks = OrderedDict()
+_region_masks_lock = threading.Lock()
+
+
+def get_region_mask(key, geom, x, y, zoom):
+    """Bit-packed mask of region `key` over tile (x, y), cached per (key, z, x, y)."""
+    cache_key = (key, zoom, x, y)
+    with _region_masks_lock:
+        mask = _region_masks.get(cache_key)
+        if mask is not None:
+            _region_masks.move_to_end(cache_key)
+            return mask
+
+    mask = rasterize_region(geom, x, y, zoom)
+    with _region_masks_lock:
+        _region_masks[cache_key] = mask
+        while len(_region_masks) > REGION_MASK_CACHE_SIZE:
+            _region_masks.popitem(last=False)
+    return mask
 
 
 # -------------------------------
 # Improved Green Cover Detection
 # -------------------------------
 
-def analyze_tile_image(img):
+def green_mask_reference(pixels):
     """
-    Analyze a satellite tile image using HSV-based vegetation detection.
-    Returns number of green pixels and total pixels.
+    Float HSV vegetation mask for an (..., 3) uint8 RGB array.
+    This is the original classifier; the integer fast path below must
+    agree with it on every RGB value.
     """
-    pixels = np.array(img) / 255.0  # normalize RGB to 0-1
+    pixels = pixels / 255.0  # normalize RGB to 0-1
     r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
 
     # Compute HSV values (vectorized)
@@ -50,59 +248,719 @@ def analyze_tile_image(img):
     delta = maxc - minc
 
     # Hue calculation
-    hue = np.zeros_like(maxc)
-    mask = delta != 0
-    hue[mask & (maxc == r)] = ((g - b) / delta)[mask & (maxc == r)]
-    hue[mask & (maxc == g)] = (2.0 + (b - r) / delta)[mask & (maxc == g)]
-    hue[mask & (maxc == b)] = (4.0 + (r - g) / delta)[mask & (maxc == b)]
-    hue = (hue / 6.0) % 1.0  # normalize hue to 0-1
-    hue_deg = hue * 360  # convert to degrees
-
-    # Saturation and Value
-    saturation = np.where(maxc == 0, 0, delta / maxc)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hue = np.zeros_like(maxc)
+        mask = delta != 0
+        hue[mask & (maxc == r)] = ((g - b) / delta)[mask & (maxc == r)]
+        hue[mask & (maxc == g)] = (2.0 + (b - r) / delta)[mask & (maxc == g)]
+        hue[mask & (maxc == b)] = (4.0 + (r - g) / delta)[mask & (maxc == b)]
+        hue = (hue / 6.0) % 1.0  # normalize hue to 0-1
+        hue_deg = hue * 360  # convert to degrees
+
+        # Saturation and Value
+        saturation = np.where(maxc == 0, 0, delta / maxc)
     value = maxc
 
     # Green detection mask: Hue ~35°-160°, moderately saturated and bright
-    green_mask = (hue_deg >= 35) & (hue_deg <= 160) & (saturation > 0.25) & (value > 0.2)
+    return (hue_deg >= 35) & (hue_deg <= 160) & (saturation > 0.25) & (value > 0.2)
+
+
+def analyze_tile_image_reference(img):
+    """Float HSV implementation of analyze_tile_image, kept for verification and benchmarks."""
+    pixels = np.array(img)
+    green_mask = green_mask_reference(pixels)
+    return int(np.sum(green_mask)), pixels.shape[0] * pixels.shape[1]
+
+
+def _build_threshold_tables():
+    """
+    Tabulate the float classifier's decisions on its exact boundaries.
+
+    With M = max(r, g, b), m = min(r, g, b) and d = M - m, the green test is
+      S/V:  depends only on (M, m)
+      hue:  red is max    -> 12 * (g - b) >= 7 * d   (hue >= 35°)
+            green is max  ->  3 * (b - r) <= 2 * d   (hue <= 160°)
+            blue is max   ->  never green
+    Away from equality these integer tests are exact. On equality the float
+    result depends on rounding, but the pixel is then fully determined by
+    (M, m), so we evaluate the reference once per (M, m) and fold the outcome
+    into the right-hand side of each inequality.
+    """
+    M, m = np.meshgrid(np.arange(256), np.arange(256), indexing="ij")
+    d = M - m
+    valid = d > 0
+
+    # Saturation/value only look at max and min, so any ordering will do
+    sv_ok = green_mask_reference(np.stack([m, M, m], axis=-1).astype(np.uint8))
+    sv_ok &= valid
+
+    # Red-is-max tie: r = M, b = m, g = m + 7d/12
+    r_tie = valid & (d % 12 == 0)
+    g_val = np.where(r_tie, m + 7 * d // 12, m)
+    r_tie_green = green_mask_reference(np.stack([M, g_val, m], axis=-1).astype(np.uint8))
+    r_thresh = 7 * d + np.where(r_tie & r_tie_green, 0, 1)
+
+    # Green-is-max tie: g = M, r = m, b = m + 2d/3
+    g_tie = valid & (d % 3 == 0)
+    b_val = np.where(g_tie, m + 2 * d // 3, m)
+    g_tie_green = green_mask_reference(np.stack([m, M, b_val], axis=-1).astype(np.uint8))
+    g_thresh = 2 * d - np.where(g_tie & g_tie_green, 0, 1)
+
+    return (
+        sv_ok.ravel(),
+        r_thresh.astype(np.int16).ravel(),
+        g_thresh.astype(np.int16).ravel(),
+    )
+
+
+_SV_OK, _RED_THRESH, _GREEN_THRESH = _build_threshold_tables()
+
+
+class GreenClassifier:
+    """
+    Integer-only vegetation classifier over uint8 RGB arrays.
+    Gives exactly the same mask as green_mask_reference, but works on the
+    raw bytes and reuses its scratch buffers between calls, so classifying
+    a tile allocates almost nothing. Not thread-safe; use one per thread.
+    """
+
+    _BUFFERS = (
+        ("_max", np.uint8), ("_min", np.uint8), ("_idx", np.intp),
+        ("_diff", np.int16), ("_lhs", np.int16), ("_rhs", np.int16),
+        ("_case", bool), ("_tmp", bool), ("_mask", bool),
+    )
+
+    def __init__(self):
+        self._capacity = 0
+        self._flat = {}
+
+    def _ensure_buffers(self, shape):
+        # Buffers only ever grow, so alternating between a single tile and a
+        # stack of tiles doesn't reallocate; each call gets reshaped views.
+        size = int(np.prod(shape))
+        if size > self._capacity:
+            self._capacity = size
+            self._flat = {name: np.empty(size, dtype=dtype) for name, dtype in self._BUFFERS}
+        for name, _ in self._BUFFERS:
+            setattr(self, name, self._flat[name][:size].reshape(shape))
+
+    def green_mask(self, pixels):
+        """
+        Return the boolean green mask for an (..., 3) uint8 RGB array.
+        The returned array is a scratch buffer, overwritten by the next call.
+        """
+        r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+        self._ensure_buffers(r.shape)
+        M, m, idx = self._max, self._min, self._idx
+        diff, lhs, rhs = self._diff, self._lhs, self._rhs
+        case, tmp, mask = self._case, self._tmp, self._mask
+
+        np.maximum(r, g, out=M)
+        np.maximum(M, b, out=M)
+        np.minimum(r, g, out=m)
+        np.minimum(m, b, out=m)
+        np.copyto(idx, M)
+        np.left_shift(idx, 8, out=idx)
+        np.add(idx, m, out=idx)
+        np.subtract(M, m, out=diff)
+
+        # Green is max (and blue isn't): 3 * (b - r) <= g_thresh
+        np.equal(g, M, out=case)
+        np.less(b, M, out=tmp)
+        np.logical_and(case, tmp, out=case)
+        np.subtract(b, r, out=lhs, dtype=np.int16)
+        np.multiply(lhs, 3, out=lhs)
+        np.take(_GREEN_THRESH, idx, out=rhs)
+        np.less_equal(lhs, rhs, out=mask)
+        np.logical_and(mask, case, out=mask)
+
+        # Red is max (and neither green nor blue): 12 * (g - b) >= r_thresh
+        np.equal(r, M, out=case)
+        np.less(g, M, out=tmp)
+        np.logical_and(case, tmp, out=case)
+        np.less(b, M, out=tmp)
+        np.logical_and(case, tmp, out=case)
+        np.subtract(g, b, out=lhs, dtype=np.int16)
+        np.multiply(lhs, 12, out=lhs)
+        np.take(_RED_THRESH, idx, out=rhs)
+        np.greater_equal(lhs, rhs, out=tmp)
+        np.logical_and(tmp, case, out=tmp)
+        np.logical_or(mask, tmp, out=mask)
+
+        # Saturation and value
+        np.take(_SV_OK, idx, out=tmp)
+        np.logical_and(mask, tmp, out=mask)
+        return mask
+
+
+_classifiers = threading.local()
+
+
+def get_classifier():
+    """Return this thread's GreenClassifier."""
+    classifier = getattr(_classifiers, "classifier", None)
+    if classifier is None:
+        classifier = _classifiers.classifier = GreenClassifier()
+    return classifier
+
+
+def analyze_tile_image(img):
+    """
+    Analyze a satellite tile image using HSV-based vegetation detection.
+    Returns number of green pixels and total pixels.
+    """
+    pixels = np.asarray(img, dtype=np.uint8)
+    green_mask = get_classifier().green_mask(pixels)
+    return int(np.count_nonzero(green_mask)), pixels.shape[0] * pixels.shape[1]
+
+
+def classify_tile_regions(img, regions):
+    """
+    Classify one tile and also count green pixels inside each region mask.
+    regions: bit-packed masks as returned by rasterize_region.
+    Returns (green, total, [(region_green, region_total), ...]).
+    """
+    pixels = np.asarray(img, dtype=np.uint8)
+    green_mask = get_classifier().green_mask(pixels)
+    shape = green_mask.shape
+    region_counts = []
+    for packed in regions:
+        region = np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=shape[0] * shape[1])
+        region = region.view(bool).reshape(shape)
+        region_counts.append((
+            int(np.count_nonzero(green_mask & region)),
+            int(np.count_nonzero(region)),
+        ))
+    return int(np.count_nonzero(green_mask)), shape[0] * shape[1], region_counts
+
+
+def classify_tile_stack(stack):
+    """
+    Classify an (N, H, W, 3) uint8 stack of tiles in one vectorized pass.
+    Returns an array of green pixel counts per tile and the pixel count of one tile.
+    """
+    stack = np.asarray(stack, dtype=np.uint8)
+    classifier = get_classifier()
+    green = np.empty(len(stack), dtype=np.int64)
+    for start in range(0, len(stack), CLASSIFY_BLOCK_TILES):
+        block = stack[start:start + CLASSIFY_BLOCK_TILES]
+        green_mask = classifier.green_mask(block)
+        green[start:start + len(block)] = np.count_nonzero(
+            green_mask.reshape(len(block), -1), axis=1
+        )
+    return green, stack.shape[1] * stack.shape[2]
+
+
+def iter_tile_batches(tiles, batch_size=TILE_BATCH_SIZE):
+    """
+    Group an iterable of (key, image) pairs into stacks of same-sized tiles.
+    Yields (keys, stack) where stack is an (n, H, W, 3) uint8 array. The
+    stack buffer is reused for the next batch, so consume it before resuming.
+    """
+    buffers = {}
+    pending = {}
+    for key, img in tiles:
+        pixels = np.asarray(img, dtype=np.uint8)
+        buffer = buffers.get(pixels.shape)
+        if buffer is None:
+            buffer = buffers[pixels.shape] = np.empty((batch_size,) + pixels.shape, dtype=np.uint8)
+        keys = pending.setdefault(pixels.shape, [])
+        buffer[len(keys)] = pixels
+        keys.append(key)
+        if len(keys) == batch_size:
+            yield keys, buffer
+            pending[pixels.shape] = []
 
-    green_pixels = np.sum(green_mask)
-    total_pixels = pixels.shape[0] * pixels.shape[1]
+    for shape, keys in pending.items():
+        if keys:
+            yield keys, buffers[shape][:len(keys)]
 
-    return int(green_pixels), total_pixels
+
+def classify_tiles(tiles, batch_size=TILE_BATCH_SIZE):
+    """Yield (key, green, total) for an iterable of (key, image) pairs, classified in batches."""
+    for keys, stack in iter_tile_batches(tiles, batch_size):
+        green, total = classify_tile_stack(stack)
+        for key, count in zip(keys, green.tolist()):
+            yield key, count, total
+
+
+# -------------------------------
+# Colour histograms
+# -------------------------------
+# Each tile also gets a quantized hue/saturation/value histogram, so green
+# cover can be recomputed for other thresholds without touching imagery.
+
+def hsv_bin_indices_reference(pixels):
+    """
+    Float implementation of hsv_bin_indices, kept for verification. The
+    lookup tables below are built from the same float32 expressions.
+    """
+    rgb = pixels.reshape(-1, 3).astype(np.float32)
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    maxc = rgb.max(axis=1)
+    delta = maxc - rgb.min(axis=1)
+
+    # Same hue cases as green_mask_reference, where later cases win ties
+    with np.errstate(divide="ignore", invalid="ignore"):
+        hue = np.where(maxc == b, 4.0 + (r - g) / delta,
+                       np.where(maxc == g, 2.0 + (b - r) / delta, (g - b) / delta))
+        hue = np.where(delta == 0, 0.0, hue / 6.0 % 1.0)
+        saturation = np.where(maxc == 0, 0.0, delta / maxc)
+    value = maxc / 255.0
+
+    hue_bin = np.minimum((hue * HUE_BINS).astype(np.intp), HUE_BINS - 1)
+    sat_bin = np.minimum((saturation * SAT_BINS).astype(np.intp), SAT_BINS - 1)
+    val_bin = np.minimum((value * VAL_BINS).astype(np.intp), VAL_BINS - 1)
+    return (hue_bin * SAT_BINS + sat_bin) * VAL_BINS + val_bin
+
+
+def _build_bin_tables():
+    """
+    Tabulate hsv_bin_indices_reference. Hue only depends on which channel is
+    the max, on the difference of the other two (-255..255) and on the
+    spread d = max - min; saturation and value only on (max, min). Returns
+    (hue table over [case, difference + 255, d], premultiplied to a flat bin
+    offset, and saturation/value table over max << 8 | min).
+    """
+    difference = np.arange(-255, 256, dtype=np.float32)[:, None]
+    d = np.arange(256, dtype=np.float32)[None, :]
+    hue_tables = []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Red, green and blue max, as the reference's (g - b), 2 + (b - r), 4 + (r - g)
+        for hue in (difference / d, 2.0 + difference / d, 4.0 + difference / d):
+            hue = np.where(d == 0, 0.0, hue / 6.0 % 1.0)
+            hue_bin = np.minimum((hue * HUE_BINS).astype(np.intp), HUE_BINS - 1)
+            hue_tables.append(hue_bin * SAT_BINS * VAL_BINS)
+
+    M, m = np.meshgrid(np.arange(256, dtype=np.float32), np.arange(256, dtype=np.float32),
+                       indexing="ij")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        saturation = np.where(M == 0, 0.0, (M - m) / M)
+    sat_bin = np.minimum((saturation * SAT_BINS).astype(np.intp), SAT_BINS - 1)
+    val_bin = np.minimum((M / 255.0 * VAL_BINS).astype(np.intp), VAL_BINS - 1)
+    return (
+        np.stack(hue_tables).astype(np.int32).ravel(),
+        (sat_bin * VAL_BINS + val_bin).astype(np.int32).ravel(),
+    )
+
+
+_HUE_BIN, _SV_BIN = _build_bin_tables()
+_HUE_CASE = 511 * 256  # entries per max-channel case in _HUE_BIN
+
+
+def hsv_bin_indices(pixels):
+    """
+    Flat histogram bin of every pixel of an (..., 3) uint8 RGB array, with
+    integer arithmetic and table lookups only. Same bins as
+    hsv_bin_indices_reference.
+    """
+    rgb = pixels.reshape(-1, 3)
+    r, g, b = (rgb[:, i].astype(np.int32) for i in range(3))
+    M = np.maximum(np.maximum(r, g), b)
+    m = np.minimum(np.minimum(r, g), b)
+
+    # Later cases win ties, as in the reference: red, then green, then blue
+    difference = g - b
+    case = np.zeros_like(r)
+    green_max = g == M
+    np.copyto(difference, b - r, where=green_max)
+    case[green_max] = 1
+    blue_max = b == M
+    np.copyto(difference, r - g, where=blue_max)
+    case[blue_max] = 2
+
+    hue_index = case * _HUE_CASE + (difference + 255) * 256 + (M - m)
+    return _HUE_BIN[hue_index] + _SV_BIN[(M << 8) | m]
+
+
+def tile_histograms(img, regions=()):
+    """
+    Colour histograms of one tile: the whole tile first, then the pixels
+    inside each bit-packed region mask. Returns encoded histograms.
+    """
+    pixels = np.asarray(img, dtype=np.uint8)
+    bins = hsv_bin_indices(pixels)
+    size = HUE_BINS * SAT_BINS * VAL_BINS
+    histograms = [np.bincount(bins, minlength=size)]
+    for packed in regions:
+        region = np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=len(bins)).view(bool)
+        histograms.append(np.bincount(bins[region], minlength=size))
+    return [encode_histogram(histogram) for histogram in histograms]
+
+
+def encode_histogram(histogram):
+    # Most bins of a tile are empty, so the dense array compresses well even
+    # at the fastest level
+    return zlib.compress(np.asarray(histogram, dtype="<u4").tobytes(), 1)
+
+
+def decode_histogram(data):
+    return np.frombuffer(zlib.decompress(data), dtype="<u4")
+
+
+def threshold_selector(thresholds=None):
+    """
+    Boolean mask over histogram bins that count as green for thresholds
+    {hue_min, hue_max (degrees), sat_min, sat_max, val_min, val_max (0-1)},
+    missing keys taking their DEFAULT_THRESHOLDS value. A bin counts when
+    its centre is within the thresholds, so they apply at bin resolution.
+    hue_min > hue_max selects hues wrapping around 0°.
+    Raises ValueError on unknown keys or out of range values.
+    """
+    thresholds = dict(thresholds or {})
+    unknown = set(thresholds) - set(DEFAULT_THRESHOLDS)
+    if unknown:
+        raise ValueError(f"unknown thresholds: {', '.join(sorted(unknown))}")
+    t = {**DEFAULT_THRESHOLDS, **{key: float(value) for key, value in thresholds.items()}}
+    if not (0 <= t["hue_min"] <= 360 and 0 <= t["hue_max"] <= 360):
+        raise ValueError("hue thresholds must be between 0 and 360")
+    for key in ("sat_min", "sat_max", "val_min", "val_max"):
+        if not 0 <= t[key] <= 1:
+            raise ValueError(f"{key} must be between 0 and 1")
+
+    hue = (np.arange(HUE_BINS) + 0.5) * 360.0 / HUE_BINS
+    sat = (np.arange(SAT_BINS) + 0.5) / SAT_BINS
+    val = (np.arange(VAL_BINS) + 0.5) / VAL_BINS
+    if t["hue_min"] <= t["hue_max"]:
+        hue_ok = (hue >= t["hue_min"]) & (hue <= t["hue_max"])
+    else:
+        hue_ok = (hue >= t["hue_min"]) | (hue <= t["hue_max"])
+    sat_ok = (sat >= t["sat_min"]) & (sat <= t["sat_max"])
+    val_ok = (val >= t["val_min"]) & (val <= t["val_max"])
+    return (hue_ok[:, None, None] & sat_ok[None, :, None] & val_ok[None, None, :]).ravel()
 
 
 # -------------------------------
 # Main Green Cover Calculator
 # -------------------------------
 
-def calculate_green_cover_from_tiles(bbox, zoom, mapbox_token):
+def compute_tile_counts(tiles, zoom, mapbox_token, regions=None, progress=None):
     """
-    Calculate green cover percentage for the given bounding box using Mapbox tiles.
-    bbox: (min_lon, min_lat, max_lon, max_lat)
+    Classify tiles, using cached results where possible.
+    tiles: (x, y) tiles whose whole-tile counts are needed
+    regions: optional {(x, y): [(region_key, geom), ...]} of tiles that only
+             partly belong to a region; those are counted inside its polygon
+    progress: optional callback, called with (tiles done, tiles total) as
+              tiles are classified
+    Returns (counts, region_counts, failed):
+      counts: {(x, y): (green, total)}
+      region_counts: {((x, y), region_key): (green, total)}
+      failed: {(x, y): error}
+    Each tile is fetched and classified at most once, however many regions
+    it belongs to.
     """
-    min_lon, min_lat, max_lon, max_lat = bbox
+    tiles = list(dict.fromkeys(tiles))
+    regions = regions or {}
+    results = get_tile_results()
+    pairs = [(tile, key) for tile, entries in regions.items() for key, _ in entries]
+    wanted = set(tiles)
+    if results:
+        counts = results.get_many(TILE_STYLE, zoom, CLASSIFIER_VERSION, tiles)
+        region_counts = results.get_regions(TILE_STYLE, zoom, CLASSIFIER_VERSION, pairs)
+    else:
+        counts, region_counts = {}, {}
 
-    # Determine which tiles cover the bounding box
-    x_min, y_max = deg2num(min_lat, min_lon, zoom)
-    x_max, y_min = deg2num(max_lat, max_lon, zoom)
+    # Region masks each tile still needs; an empty list means whole tile only
+    pending = {tile: [] for tile in tiles if tile not in counts}
+    for tile, entries in regions.items():
+        for key, geom in entries:
+            if (tile, key) not in region_counts:
+                pending.setdefault(tile, []).append((key, geom))
+
+    def current(batch):
+        stored = results.get_many(TILE_STYLE, zoom, CLASSIFIER_VERSION, [
+            tile for tile in batch if tile in wanted and tile not in counts
+        ])
+        stored_regions = results.get_regions(TILE_STYLE, zoom, CLASSIFIER_VERSION, [
+            (tile, key) for tile in batch for key, _ in pending[tile]
+        ])
+        return {
+            tile for tile in batch
+            if (tile not in wanted or tile in counts or tile in stored)
+            and all((tile, key) in stored_regions for key, _ in pending[tile])
+        }
+
+    TILE_RESULTS.inc(len(set(tiles) | set(regions)) - len(pending), outcome="cached")
+    computed, computed_regions, _, reused, failed = process_tiles(
+        pending, zoom, mapbox_token, len(set(tiles) | set(regions)), progress,
+        current if results else None
+    )
+    counts.update(computed)
+    region_counts.update(computed_regions)
+    if reused:
+        # Unchanged imagery: the stored results are current again
+        counts.update(results.get_many(
+            TILE_STYLE, zoom, CLASSIFIER_VERSION, [tile for tile in reused if tile in wanted]
+        ))
+        region_counts.update(results.get_regions(TILE_STYLE, zoom, CLASSIFIER_VERSION, [
+            (tile, key) for tile in reused for key, _ in pending[tile]
+        ]))
+    return counts, region_counts, failed
 
+
+def compute_tile_histograms(tiles, zoom, mapbox_token, regions=None, progress=None):
+    """
+    Colour histograms of tiles, and of the parts of tiles inside regions,
+    like compute_tile_counts. Tiles processed before histograms were stored
+    are classified again, once, to fill them in.
+    Returns (histograms, failed) where histograms maps (x, y) for whole
+    tiles and ((x, y), region_key) for regions to decoded histograms.
+    """
+    tiles = list(dict.fromkeys(tiles))
+    regions = regions or {}
+    results = get_tile_results()
+    pairs = [(tile, "") for tile in tiles]
+    pairs += [(tile, key) for tile, entries in regions.items() for key, _ in entries]
+    stored = results.get_histograms(TILE_STYLE, zoom, HISTOGRAM_VERSION, pairs) if results else {}
+
+    pending = {tile: [] for tile in tiles if (tile, "") not in stored}
+    for tile, entries in regions.items():
+        for key, geom in entries:
+            if (tile, key) not in stored:
+                pending.setdefault(tile, []).append((key, geom))
+
+    wanted = set(tiles)
+
+    def current(batch):
+        needed = {tile: [(tile, key) for key, _ in pending[tile]] for tile in batch}
+        for tile in batch:
+            if tile in wanted:
+                needed[tile].append((tile, ""))
+        found = results.get_histograms(TILE_STYLE, zoom, HISTOGRAM_VERSION, [
+            pair for pairs in needed.values() for pair in pairs
+        ])
+        return {tile for tile in batch if all(pair in found for pair in needed[tile])}
+
+    _, _, computed, reused, failed = process_tiles(
+        pending, zoom, mapbox_token, len(set(tiles) | set(regions)), progress,
+        current if results else None, histograms=True
+    )
+    stored.update(computed)
+    if reused:
+        stored.update(results.get_histograms(TILE_STYLE, zoom, HISTOGRAM_VERSION, [
+            pair for pair in pairs if pair[0] in reused
+        ]))
+    histograms = {
+        tile if key == "" else (tile, key): decode_histogram(data)
+        for (tile, key), data in stored.items()
+    }
+    return histograms, failed
+
+
+def process_tiles(pending, zoom, mapbox_token, total, progress=None, current=None,
+                  histograms=False):
+    """
+    Fetch and classify tiles and store their results: counts, and colour
+    histograms too when `histograms` is set. Histograms are only built for
+    /api/green-cover/thresholds, which fills them in on its first call.
+    pending: {(x, y): [(region_key, geom), ...]} of tiles to process and
+             the regions each one is also needed for
+    total: tiles the caller needs, including those it already had, for progress
+    current: optional callback returning which tiles of a list have current
+             stored results. Tiles are revalidated with the provider once
+             their results pass the result TTL; if the imagery turns out
+             unchanged, their results are current again and they aren't
+             classified. Fetched tiles are checked TILE_BATCH_SIZE at a time.
+    Returns (counts, region_counts, histograms, reused, failed), histograms
+    holding encoded histograms keyed ((x, y), region_key), region "" being
+    the whole tile, and reused the tiles whose stored results were kept.
+    """
+    failed = {}
+    done = total - len(pending)
+    if progress:
+        progress(done, total)
+
+    results = get_tile_results()
+    max_age = results.ttl if results else None
+    reused = set()
+
+    def fetch(tile):
+        return fetch_tile(tile[0], tile[1], zoom, mapbox_token, max_age)
+
+    def fetched():
+        ready = []
+        for tile, data, error in iter_fetch(list(pending), fetch):
+            if error is not None:
+                failed[tile] = error
+                tile_done()
+                continue
+            # The pipeline classifies in batches anyway, so check whole
+            # batches against the stored results
+            ready.append((tile, data))
+            if len(ready) == TILE_BATCH_SIZE:
+                yield from unless_current(ready)
+                ready = []
+        yield from unless_current(ready)
+
+    def unless_current(ready):
+        kept = current([tile for tile, _ in ready]) if current and ready else set()
+        for tile, data in ready:
+            if tile in kept:
+                reused.add(tile)
+                tile_done()
+                continue
+            masks = [get_region_mask(key, geom, tile[0], tile[1], zoom) for key, geom in pending[tile]]
+            yield tile, data, masks
+
+    def tile_done():
+        nonlocal done
+        done += 1
+        if progress:
+            progress(done, total)
+
+    # tile_pipeline imports this module, so import it lazily
+    from tile_pipeline import classify_encoded_tiles
+
+    computed = {}
+    computed_regions = {}
+    computed_histograms = {}
+    classified = classify_encoded_tiles(fetched(), histograms=histograms)
+    for tile, green, tile_total, tile_region_counts, encoded, error in classified:
+        tile_done()
+        if error is not None:
+            failed[tile] = f"decode error: {error}"
+            continue
+        computed[tile] = (green, tile_total)
+        keys = [key for key, _ in pending[tile]]
+        for key, region_count in zip(keys, tile_region_counts):
+            computed_regions[(tile, key)] = region_count
+        for key, histogram in zip([""] + keys, encoded):
+            computed_histograms[(tile, key)] = histogram
+
+    if results:
+        results.put_many(TILE_STYLE, zoom, CLASSIFIER_VERSION, computed)
+        results.put_regions(TILE_STYLE, zoom, CLASSIFIER_VERSION, computed_regions)
+        results.put_histograms(TILE_STYLE, zoom, HISTOGRAM_VERSION, computed_histograms)
+    TILE_RESULTS.inc(len(computed), outcome="classified")
+    TILE_RESULTS.inc(len(reused), outcome="reused")
+    TILE_RESULTS.inc(len(failed), outcome="failed")
+
+    for (x, y), error in failed.items():
+        print(f"⚠️ Failed to fetch tile {x},{y} at zoom {zoom}: {error}")
+    if reused:
+        print(f"Reused results of {len(reused)} tiles with unchanged imagery at zoom {zoom}")
+    return computed, computed_regions, computed_histograms, reused, failed
+
+
+def summarize_tile_counts(tiles, zoom, counts, failed, edge_tiles=(), region=None, region_counts=None):
+    """
+    Aggregate per-tile counts into a green cover result: whole-tile counts
+    for `tiles`, plus counts inside `region` for `edge_tiles`.
+    """
     total_green = 0
     total_pixels = 0
+    failed_tiles = []
+    parts = [(tile, counts, tile) for tile in tiles]
+    parts += [(tile, region_counts, (tile, region)) for tile in edge_tiles]
+    for tile, source, key in parts:
+        if key in source:
+            green, total = source[key]
+            total_green += green
+            total_pixels += total
+        elif tile in failed:
+            failed_tiles.append({"x": tile[0], "y": tile[1], "z": zoom, "error": failed[tile]})
 
-    for x in range(min(x_min, x_max), max(x_min, x_max) + 1):
-        for y in range(min(y_min, y_max), max(y_min, y_max) + 1):
-            tile_url = get_tile_url(x, y, zoom, mapbox_token)
-            response = requests.get(tile_url)
+    return {
+        "green_cover": round((total_green / total_pixels) * 100, 2) if total_pixels else 0.0,
+        "green_pixels": total_green,
+        "total_pixels": total_pixels,
+        "tiles_total": len(tiles) + len(edge_tiles),
+        "failed_tiles": failed_tiles,
+    }
 
-            if response.status_code == 200:
-                img = Image.open(BytesIO(response.content)).convert("RGB")
-                green, total = analyze_tile_image(img)
-                total_green += green
-                total_pixels += total
-            else:
-                print(f"⚠️ Failed to fetch tile {x},{y} at zoom {zoom}")
 
-    return round((total_green / total_pixels) * 100, 2) if total_pixels else 0.0
+def summarize_tile_histograms(tiles, zoom, histograms, failed, selector, edge_tiles=(), region=None):
+    """
+    summarize_tile_counts for any thresholds: green pixels are the
+    histogram bins picked by `selector` (see threshold_selector).
+    """
+    combined = np.zeros(HUE_BINS * SAT_BINS * VAL_BINS, dtype=np.int64)
+    failed_tiles = []
+    parts = [(tile, tile) for tile in tiles] + [(tile, (tile, region)) for tile in edge_tiles]
+    for tile, key in parts:
+        if key in histograms:
+            combined += histograms[key]
+        elif tile in failed:
+            failed_tiles.append({"x": tile[0], "y": tile[1], "z": zoom, "error": failed[tile]})
+
+    total_green = int(combined[selector].sum())
+    total_pixels = int(combined.sum())
+    return {
+        "green_cover": round((total_green / total_pixels) * 100, 2) if total_pixels else 0.0,
+        "green_pixels": total_green,
+        "total_pixels": total_pixels,
+        "tiles_total": len(tiles) + len(edge_tiles),
+        "failed_tiles": failed_tiles,
+    }
+
+
+def green_cover_history(tiles, zoom, edge_tiles=(), region=None, since=0):
+    """
+    Replay the recorded per-tile counts of an area (whole `tiles` plus the
+    `region` part of `edge_tiles`) into its green cover over time.
+    Returns [{"at", "green_cover", "green_pixels", "total_pixels"}], one
+    point per time the total changed, starting once every tile has a count.
+    """
+    results = get_tile_results()
+    if not results:
+        return []
+    pairs = [(tile, "") for tile in tiles] + [(tile, region) for tile in edge_tiles]
+    latest = {}
+    points = []
+    rows = results.history(TILE_STYLE, zoom, CLASSIFIER_VERSION, pairs, since)
+    for i, (recorded_at, pair, green, total) in enumerate(rows):
+        latest[pair] = (green, total)
+        # Counts stored together share a timestamp; only look at the sum after the last one
+        if i + 1 < len(rows) and rows[i + 1][0] == recorded_at:
+            continue
+        if len(latest) < len(pairs):
+            continue
+        total_green = sum(green for green, _ in latest.values())
+        total_pixels = sum(total for _, total in latest.values())
+        if points and (points[-1]["green_pixels"], points[-1]["total_pixels"]) == (total_green, total_pixels):
+            continue
+        points.append({
+            "at": recorded_at,
+            "green_cover": round((total_green / total_pixels) * 100, 2) if total_pixels else 0.0,
+            "green_pixels": total_green,
+            "total_pixels": total_pixels,
+        })
+    return points
+
+
+def compute_green_cover(bbox, zoom, mapbox_token, progress=None):
+    """
+    Calculate green cover for the given bounding box using Mapbox tiles,
+    fetching tiles concurrently. Tiles that could not be fetched or decoded
+    are reported in failed_tiles rather than silently left out.
+    bbox: (min_lon, min_lat, max_lon, max_lat)
+    """
+    tiles = tiles_for_bbox(bbox, zoom)
+    counts, _, failed = compute_tile_counts(tiles, zoom, mapbox_token, progress=progress)
+    return summarize_tile_counts(tiles, zoom, counts, failed)
+
+
+def compute_geometry_green_cover(geom, name, zoom, mapbox_token, progress=None):
+    """
+    Calculate green cover inside a shapely (Multi)Polygon rather than its
+    bounding box. Only tiles touching the geometry are fetched; tiles fully
+    inside count wholesale and boundary tiles are clipped with a rasterized
+    polygon mask. `name` identifies the region in the mask and result caches.
+    """
+    interior, edge = tiles_for_geometry(geom, zoom)
+    key = region_key(name, geom)
+    counts, region_counts, failed = compute_tile_counts(
+        interior, zoom, mapbox_token, {tile: [(key, geom)] for tile in edge}, progress
+    )
+    return summarize_tile_counts(interior, zoom, counts, failed, edge, key, region_counts)
+
+
+def calculate_green_cover_from_tiles(bbox, zoom, mapbox_token):
+    """
+    Calculate green cover percentage for the given bounding box using Mapbox tiles.
+    bbox: (min_lon, min_lat, max_lon, max_lat)
+    """
+    return compute_green_cover(bbox, zoom, mapbox_token)["green_cover"]
 
 
 # -------------------------------
@@ -0,0 +1,200 @@
+import math
+import struct
+
+import numpy as np
+import shapely
+from shapely.geometry import MultiPolygon, Polygon, box
+from shapely.ops import clip_by_rect
+
+from tile_utils import tile_bounds
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+MVT_EXTENT = 4096
+# Geometry kept outside the tile edge, in tile units, so strokes don't show seams
+MVT_BUFFER = 64
+# Simplification tolerance in tile units (1/16 of a 256px pixel)
+MVT_SIMPLIFY = 1.0
+MVT_MAX_ZOOM = 22
+
+# Geometry command ids and feature type from the Mapbox Vector Tile spec 2.1
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+POLYGON = 3
+
+
+# -------------------------------
+# Protobuf encoding
+# -------------------------------
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _message(number, payload):
+    """A length-delimited field: embedded message, string, bytes or packed values."""
+    return _field(number, 2) + _varint(len(payload)) + payload
+
+
+def _uint(number, value):
+    return _field(number, 0) + _varint(value)
+
+
+def _value(value):
+    # Value message: string_value = 1, double_value = 3, uint_value = 5, bool_value = 7
+    if isinstance(value, bool):
+        return _uint(7, int(value))
+    if isinstance(value, int) and value >= 0:
+        return _uint(5, value)
+    if isinstance(value, (int, float)):
+        return _field(3, 1) + struct.pack("<d", float(value))
+    return _message(1, str(value).encode())
+
+
+def _geometry_commands(polygons):
+    """Encode polygons (lists of integer rings, closing point omitted) as MVT commands."""
+    commands = []
+    cursor_x = cursor_y = 0
+    for rings in polygons:
+        for ring in rings:
+            commands.append((1 << 3) | MOVE_TO)
+            for i, (x, y) in enumerate(ring):
+                if i == 1:
+                    commands.append(((len(ring) - 1) << 3) | LINE_TO)
+                commands += [_zigzag(x - cursor_x), _zigzag(y - cursor_y)]
+                cursor_x, cursor_y = x, y
+            commands.append((1 << 3) | CLOSE_PATH)
+    return commands
+
+
+def encode_layer(name, features, extent=MVT_EXTENT):
+    """
+    Encode one layer from (id, polygons, properties) features, where
+    polygons come from tile_polygons. Keys and values are shared between
+    features as the spec requires.
+    """
+    keys, values = {}, {}
+    encoded = []
+    for feature_id, polygons, properties in features:
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value).__name__, value), len(values)))
+        body = b""
+        if isinstance(feature_id, int) and feature_id >= 0:
+            body += _uint(1, feature_id)
+        body += _message(2, b"".join(_varint(tag) for tag in tags))
+        body += _uint(3, POLYGON)
+        body += _message(4, b"".join(_varint(c) for c in _geometry_commands(polygons)))
+        encoded.append(_message(2, body))
+
+    layer = _uint(15, 2) + _message(1, name.encode()) + b"".join(encoded)
+    layer += b"".join(_message(3, key.encode()) for key in keys)
+    layer += b"".join(_message(4, _value(value)) for _, value in values)
+    layer += _uint(5, extent)
+    return _message(3, layer)
+
+
+# -------------------------------
+# Tile geometry
+# -------------------------------
+
+def _ring_area(ring):
+    # Shoelace sum; positive means clockwise on screen (y grows downwards)
+    x = np.asarray([p[0] for p in ring], dtype=np.int64)
+    y = np.asarray([p[1] for p in ring], dtype=np.int64)
+    return int(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))
+
+
+def _tile_ring(coords, exterior):
+    ring = []
+    for x, y in np.rint(np.asarray(coords)[:-1]).astype(np.int64).tolist():
+        if not ring or ring[-1] != [x, y]:
+            ring.append([x, y])
+    while len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+    if len(ring) < 3:
+        return None
+    area = _ring_area(ring)
+    if area == 0:
+        return None
+    # The spec wants exterior rings clockwise and interior rings counterclockwise
+    if (area > 0) != exterior:
+        ring.reverse()
+    return ring
+
+
+def tile_polygons(geom, z, x, y, extent=MVT_EXTENT, buffer=MVT_BUFFER, tolerance=MVT_SIMPLIFY):
+    """
+    Project a lon/lat shapely (Multi)Polygon into the integer coordinates
+    of tile z/x/y, clipped to the buffered tile and simplified. Returns a
+    list of polygons, each a list of rings, or [] if nothing is left.
+    """
+    lon_min, lat_min, lon_max, lat_max = tile_bounds(x, y, z)
+    margin_x = (lon_max - lon_min) * buffer / extent
+    margin_y = (lat_max - lat_min) * buffer / extent
+    if not geom.intersects(box(lon_min - margin_x, lat_min - margin_y,
+                               lon_max + margin_x, lat_max + margin_y)):
+        return []
+
+    scale = 2.0 ** z * extent
+
+    def project(coords):
+        lon, lat = coords[:, 0], np.radians(coords[:, 1])
+        px = (lon + 180.0) / 360.0 * scale - x * extent
+        py = (1.0 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2.0 * scale - y * extent
+        return np.column_stack((px, py))
+
+    clipped = clip_by_rect(shapely.transform(geom, project), -buffer, -buffer,
+                           extent + buffer, extent + buffer)
+    if tolerance > 0:
+        clipped = clipped.simplify(tolerance, preserve_topology=True)
+
+    if isinstance(clipped, Polygon):
+        parts = [clipped]
+    elif isinstance(clipped, MultiPolygon):
+        parts = list(clipped.geoms)
+    else:
+        parts = [g for g in getattr(clipped, "geoms", []) if isinstance(g, Polygon)]
+
+    polygons = []
+    for part in parts:
+        if part.is_empty:
+            continue
+        exterior = _tile_ring(part.exterior.coords, exterior=True)
+        if exterior is None:
+            continue
+        interiors = [_tile_ring(ring.coords, exterior=False) for ring in part.interiors]
+        polygons.append([exterior] + [ring for ring in interiors if ring is not None])
+    return polygons
+
+
+def render_vector_tile(layer_name, features, z, x, y):
+    """
+    Render (id, shapely geometry, properties) features into an encoded
+    vector tile, or return None if no feature reaches the tile.
+    """
+    tile_features = []
+    for feature_id, geom, properties in features:
+        polygons = tile_polygons(geom, z, x, y)
+        if polygons:
+            tile_features.append((feature_id, polygons, properties))
+    if not tile_features:
+        return None
+    return encode_layer(layer_name, tile_features)
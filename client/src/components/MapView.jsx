@@ -45,6 +45,23 @@ const MapView = ({ selectedSector, onStatsLoaded }) => {
     return () => map.remove();
   }, []);
 
+  // Parse a newline-delimited JSON response body record by record
+  const readNdjson = async (response, onRecord) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    for (;;) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split("\n");
+      buffer = lines.pop();
+      lines.filter((line) => line.trim()).forEach((line) => onRecord(JSON.parse(line)));
+    }
+    if (buffer.trim()) onRecord(JSON.parse(buffer));
+  };
+
   const loadAllSectors = async () => {
     if (!mapRef.current || !hasLoadedRef.current) return;
 
@@ -52,17 +69,12 @@ const MapView = ({ selectedSector, onStatsLoaded }) => {
     setLoadingProgress("Fetching all sectors data...");
 
     try {
-      const response = await fetch(`${url}/all-sectors`);
-      if (!response.ok) throw new Error("Failed to fetch sectors data");
+      const response = await fetch(`${url}/all-sectors/stream`);
+      if (!response.ok || !response.body) throw new Error("Failed to fetch sectors data");
 
-      const data = await response.json();
-      setLoadingProgress(`Loaded ${data.total_sectors} sectors successfully`);
-      setSectorStats(data.sector_stats);
-      geojsonRef.current = data.geojson;
-
-      if (onStatsLoaded) {
-        onStatsLoaded(data.sector_stats);
-      }
+      const collection = { type: "FeatureCollection", features: [] };
+      const stats = [];
+      geojsonRef.current = collection;
 
       const map = mapRef.current;
 
@@ -80,7 +92,7 @@ const MapView = ({ selectedSector, onStatsLoaded }) => {
 
       map.addSource("all-sectors", {
         type: "geojson",
-        data: data.geojson,
+        data: collection,
       });
 
       map.addLayer({
@@ -120,8 +132,26 @@ const MapView = ({ selectedSector, onStatsLoaded }) => {
           .addTo(map);
       });
 
+      // Draw each sector as soon as the server has computed it
+      await readNdjson(response, (record) => {
+        if (record.type === "sector") {
+          collection.features.push(...record.features);
+          stats.push(record.stats);
+          map.getSource("all-sectors").setData(collection);
+          setSectorStats([...stats]);
+          setLoading(false);
+          setLoadingProgress(`Loaded ${stats.length} sectors...`);
+        } else if (record.type === "summary") {
+          setLoadingProgress(`Loaded ${record.total_sectors} sectors successfully`);
+        }
+      });
+
+      if (onStatsLoaded) {
+        onStatsLoaded(stats);
+      }
+
       const bounds = new mapboxgl.LngLatBounds();
-      data.geojson.features.forEach((feature) => {
+      collection.features.forEach((feature) => {
         const { type, coordinates } = feature.geometry;
         if (type === "Polygon") {
           coordinates[0].forEach((coord) => bounds.extend(coord));
@@ -136,8 +166,8 @@ const MapView = ({ selectedSector, onStatsLoaded }) => {
         map.fitBounds(bounds, { padding: 50 });
       }
 
-      setLoadingProgress("");
-      setTimeout(() => setLoading(false), 1000);
+      setLoading(false);
+      setTimeout(() => setLoadingProgress(""), 2000);
     } catch (error) {
       console.error("Error loading sectors:", error);
       setLoadingProgress("Error loading sectors data");
@@ -283,6 +313,25 @@ const MapView = ({ selectedSector, onStatsLoaded }) => {
         </div>
       )}
 
+      {/* Progress while remaining sectors stream in */}
+      {!loading && loadingProgress && (
+        <div
+          style={{
+            position: "absolute",
+            bottom: "20px",
+            right: "10px",
+            backgroundColor: "rgba(0, 0, 0, 0.7)",
+            color: "white",
+            padding: "8px 12px",
+            borderRadius: "5px",
+            zIndex: 100,
+            fontSize: "13px",
+          }}
+        >
+          {loadingProgress}
+        </div>
+      )}
+
       {/* Statistics panel */}
       {stats && (
         <div